@@ -15,6 +15,19 @@ class ChoiceInline(admin.TabularInline):
   model = Choice
   extra = 3
 
+  # Shows the votes still held in vote shards
+  # alongside the editable "votes" column.
+  readonly_fields = ["total_votes"]
+
+  def get_queryset(self, request):
+    return super().get_queryset(request).with_vote_totals()
+
+  @admin.display(description="Total votes")
+  def total_votes(self, obj):
+    # Choices that haven't been saved yet are
+    # not annotated.
+    return getattr(obj, "total_votes", obj.votes)
+
 
 class QuestionAdmin(admin.ModelAdmin):
   # fields = ["pub_date", "question_text"]
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        # Connect the cache invalidation signal handlers and
+        # register the system checks.
+        from . import checks, signals  # noqa: F401
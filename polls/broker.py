@@ -0,0 +1,181 @@
+import asyncio
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+
+class _Topic:
+  """
+  The subscribers to one question's tallies on one event
+  loop, and the single task that fans updates out to them.
+  """
+
+  def __init__(self, question_id, loop, interval):
+    self.question_id = question_id
+    self.loop = loop
+    self.interval = interval
+    self.subscribers = set()
+
+    # (sequence number, choice id, votes) for each publish()
+    # since the last push. Written from any thread, so
+    # guarded by a lock.
+    self.pending = []
+    self.lock = threading.Lock()
+
+    self.wakeup = asyncio.Event()
+    self.task = loop.create_task(self.fan_out())
+
+  def add(self, seq, choice_id, count):
+    with self.lock:
+      self.pending.append((seq, choice_id, count))
+    # publish() may be called from a request thread, so the
+    # event has to be set from the loop's own thread.
+    try:
+      self.loop.call_soon_threadsafe(self.wakeup.set)
+    except RuntimeError:
+      # The loop has been closed under its subscribers.
+      pass
+
+  async def fan_out(self):
+    while True:
+      await self.wakeup.wait()
+
+      # Let the votes that arrive within the next interval
+      # join this push, so that a busy question produces
+      # at most one push per interval.
+      await asyncio.sleep(self.interval)
+      self.wakeup.clear()
+
+      with self.lock:
+        pending, self.pending = self.pending, []
+
+      if pending:
+        seq = pending[-1][0]
+        message = _message(seq, pending)
+        for subscription in self.subscribers:
+          if subscription.since < pending[0][0]:
+            subscription.queue.put_nowait(message)
+          else:
+            # A new subscriber whose tallies already count
+            # some of these votes.
+            votes = [vote for vote in pending if vote[0] > subscription.since]
+            if votes:
+              subscription.queue.put_nowait(_message(seq, votes))
+          subscription.since = seq
+
+
+def _message(seq, votes):
+  deltas = Counter()
+  for _, choice_id, count in votes:
+    deltas[str(choice_id)] += count
+  return {"seq": seq, "votes": dict(deltas)}
+
+
+class Subscription:
+  """
+  A subscriber's view of one question's tallies.
+
+  Iterating over it yields {"seq": ..., "votes": {choice
+  id: votes}} dicts of the votes published since the
+  previous one, "seq" being the sequence number of the
+  last of them. `since` starts as the question's sequence
+  number when the subscription was made: tallies read
+  after that count every vote up to it, and the votes it
+  yields are the ones after it. close() must be called
+  once the subscriber has gone.
+  """
+
+  def __init__(self, broker, question_id):
+    self.broker = broker
+    self.queue = asyncio.Queue()
+    self.since, self.topic = broker._join(question_id, self)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    return await self.queue.get()
+
+  def close(self):
+    self.broker._leave(self.topic, self)
+
+
+class TallyBroker:
+  """
+  An in-process publish/subscribe broker for vote tallies.
+
+  publish() is called once votes are committed and can be
+  called from any thread. subscribe() is used by the SSE
+  view on the event loop. All subscribers of a question
+  share one fan-out task, which coalesces the deltas it
+  receives into at most one message per `interval` seconds,
+  so each extra watcher only costs a queue.
+
+  Each question's votes are numbered in the order they are
+  published, so that a subscriber can tell which of them
+  the tallies it read already count.
+  """
+
+  def __init__(self, interval=None):
+    self._interval = interval
+    self._topics = {}
+    self._sequences = Counter()
+    self._lock = threading.Lock()
+
+  @property
+  def interval(self):
+    if self._interval is not None:
+      return self._interval
+    return getattr(settings, "POLLS_SSE_COALESCE_INTERVAL", 0.25)
+
+  def publish(self, question_id, choice_id, count=1):
+    """
+    Report `count` new votes for a choice of a question.
+    Does nothing if nobody is watching the question."""
+    with self._lock:
+      self._sequences[question_id] += 1
+      seq = self._sequences[question_id]
+      topics = [
+        topic for (topic_question_id, _), topic in self._topics.items()
+        if topic_question_id == question_id
+      ]
+    for topic in topics:
+      topic.add(seq, choice_id, count)
+
+  def subscribe(self, question_id):
+    """
+    Start watching a question's tallies. Must be called on
+    the event loop that will read from the subscription."""
+    return Subscription(self, question_id)
+
+  def subscriber_count(self, question_id):
+    with self._lock:
+      return sum(
+        len(topic.subscribers)
+        for (topic_question_id, _), topic in self._topics.items()
+        if topic_question_id == question_id)
+
+  def _join(self, question_id, subscription):
+    loop = asyncio.get_running_loop()
+    with self._lock:
+      topic = self._topics.get((question_id, loop))
+      if topic is None:
+        topic = _Topic(question_id, loop, self.interval)
+        self._topics[question_id, loop] = topic
+      topic.subscribers.add(subscription)
+      # Read under the lock, so every later vote reaches
+      # this topic.
+      return self._sequences[question_id], topic
+
+  def _leave(self, topic, subscription):
+    with self._lock:
+      topic.subscribers.discard(subscription)
+      if not topic.subscribers:
+        # The last watcher has gone; stop the fan-out task.
+        del self._topics[topic.question_id, topic.loop]
+        topic.task.cancel()
+
+
+# The broker used by the polls app.
+tally_broker = TallyBroker()
@@ -0,0 +1,197 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .counters import increment_votes
+
+logger = logging.getLogger(__name__)
+
+# Default values used when POLLS_VOTE_BUFFER in
+# storefront/settings.py leaves a key out.
+DEFAULTS = {
+  "ENABLED": False,
+  "FLUSH_INTERVAL": 1.0,
+  "FLUSH_THRESHOLD": 100,
+}
+
+
+def get_buffer_settings():
+  """
+  Return the POLLS_VOTE_BUFFER settings merged
+  on top of the defaults."""
+  return {**DEFAULTS, **getattr(settings, "POLLS_VOTE_BUFFER", {})}
+
+
+class VoteBuffer:
+  """
+  Accumulates votes in memory and writes them to the
+  database in batches.
+
+  Instead of one UPDATE per vote, each flush issues one
+  "UPDATE ... SET votes = votes + n" per choice that
+  received votes since the previous flush (see
+  counters.increment_votes()). A flush is triggered
+  when FLUSH_THRESHOLD votes are pending, or by a
+  background thread every FLUSH_INTERVAL seconds.
+
+  Votes only live in this process until they are flushed.
+  The process-wide buffer is drained when the interpreter
+  exits normally (see get_vote_buffer()), but the votes
+  pending when a process is killed or crashes, at most
+  FLUSH_THRESHOLD votes or FLUSH_INTERVAL seconds' worth,
+  are lost.
+  """
+
+  def __init__(self, flush_interval=1.0, flush_threshold=100):
+    self.flush_interval = flush_interval
+    self.flush_threshold = flush_threshold
+
+    # (choice id, question id) -> number of votes not yet written.
+    self._pending = Counter()
+    self._pending_total = 0
+
+    # Guards _pending and _pending_total. The lock is never
+    # held while talking to the database.
+    self._lock = threading.Lock()
+
+    self._stopped = threading.Event()
+    self._flusher = None
+
+  @property
+  def pending(self):
+    """The number of votes waiting to be written."""
+    with self._lock:
+      return self._pending_total
+
+  def add(self, choice_id, count=1, question_id=None):
+    """
+    Record `count` votes for the choice with the
+    primary key `choice_id`."""
+    with self._lock:
+      self._pending[choice_id, question_id] += count
+      self._pending_total += count
+      threshold_reached = self._pending_total >= self.flush_threshold
+
+    self._start_flusher()
+
+    if threshold_reached:
+      # The vote has been accepted either way; a failed
+      # flush must not fail the request that added it.
+      self._flush_and_log()
+
+  def flush(self):
+    """
+    Write every pending vote to the database and
+    return the number of votes written."""
+    with self._lock:
+      batch = self._pending
+      written = self._pending_total
+      self._pending = Counter()
+      self._pending_total = 0
+
+    if not batch:
+      return 0
+
+    try:
+      # All of the increments of one batch are committed
+      # together, so a batch is either fully applied or
+      # not applied at all.
+      with transaction.atomic():
+        for (choice_id, question_id), count in batch.items():
+          increment_votes(choice_id, count, question_id=question_id)
+    except Exception:
+      # Put the votes back so that the next flush
+      # retries them instead of losing them.
+      with self._lock:
+        self._pending.update(batch)
+        self._pending_total += written
+      raise
+
+    return written
+
+  def shutdown(self):
+    """
+    Stop the background flusher and write out whatever
+    is still pending."""
+    self._stopped.set()
+    if self._flusher is not None and \
+        self._flusher is not threading.current_thread():
+      self._flusher.join(timeout=self.flush_interval or None)
+    return self.flush()
+
+  def _start_flusher(self):
+    # A falsy FLUSH_INTERVAL turns the timer off, which
+    # leaves only the threshold and shutdown flushes.
+    if not self.flush_interval or self._flusher is not None:
+      return
+
+    with self._lock:
+      if self._flusher is not None:
+        return
+      self._flusher = threading.Thread(
+        target=self._run, name="polls-vote-flusher", daemon=True)
+      self._flusher.start()
+
+  def _flush_and_log(self):
+    try:
+      self.flush()
+    except Exception:
+      # The votes were re-queued by flush(); the next
+      # flush tries again.
+      logger.exception("Flushing buffered votes failed")
+
+  def _run(self):
+    while not self._stopped.wait(self.flush_interval):
+      try:
+        self._flush_and_log()
+      finally:
+        # This thread owns its own database connection,
+        # so it has to be cleaned up here.
+        close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+  """
+  Return the process-wide VoteBuffer, or None when
+  buffered voting is switched off."""
+  global _buffer
+
+  config = get_buffer_settings()
+  if not config["ENABLED"]:
+    return None
+
+  if _buffer is None:
+    with _buffer_lock:
+      if _buffer is None:
+        _buffer = VoteBuffer(
+          flush_interval=config["FLUSH_INTERVAL"],
+          flush_threshold=config["FLUSH_THRESHOLD"])
+
+        # Drain the buffer when the worker process exits
+        # normally, as servers' workers do on a graceful
+        # shutdown. Nothing runs if the process is killed.
+        atexit.register(_buffer.shutdown)
+  return _buffer
+
+
+def drain_vote_buffer():
+  """
+  Write out and discard the process-wide buffer, if
+  one was created. Returns the number of votes written."""
+  global _buffer
+
+  with _buffer_lock:
+    buffer, _buffer = _buffer, None
+
+  if buffer is None:
+    return 0
+  atexit.unregister(buffer.shutdown)
+  return buffer.shutdown()
@@ -0,0 +1,164 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Question
+
+
+LATEST_QUESTIONS_KEY = "polls:latest_questions"
+RESULTS_KEY = "polls:results:%s"
+
+
+def latest_questions():
+  """
+  Return the last five published questions, served from
+  the cache whenever possible.
+
+  The cached list is only valid until the next scheduled
+  pub_date: at that moment a new question may have to
+  appear on the index page, so the entry is treated as
+  expired and rebuilt. Saving or deleting a Question
+  deletes the entry (see polls/signals.py).
+  """
+  now = timezone.now()
+
+  cached = cache.get(LATEST_QUESTIONS_KEY)
+  if cached is not None:
+    questions, valid_until = cached
+    if valid_until is None or now < valid_until:
+      return questions
+
+  questions = list(
+    Question.objects.filter(pub_date__lte=now).order_by("-pub_date")[:5])
+
+  # The earliest pub_date that is still in the future, if any.
+  valid_until = Question.objects.filter(
+    pub_date__gt=now).aggregate(next_pub_date=Min("pub_date"))["next_pub_date"]
+
+  timeout = getattr(settings, "POLLS_INDEX_CACHE_TIMEOUT", 300)
+  if valid_until is not None:
+    # Let the cache evict the entry shortly after it
+    # stops being valid. valid_until itself is what
+    # makes it expire on time.
+    timeout = min(timeout, (valid_until - now).total_seconds() + 1)
+
+  cache.set(LATEST_QUESTIONS_KEY, (questions, valid_until), timeout)
+  return questions
+
+
+def invalidate_latest_questions():
+  cache.delete(LATEST_QUESTIONS_KEY)
+
+
+# Hit/miss counters for the results cache. They are kept
+# per process, like the LocMemCache they are measuring.
+_results_stats = {"hits": 0, "misses": 0}
+_results_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+  with _results_stats_lock:
+    _results_stats[outcome] += 1
+
+
+def question_results(question_id):
+  """
+  Return {"question": ..., "choices": [...]} for the results
+  page of a question, or None if it doesn't exist. Each
+  choice carries its "total_votes".
+
+  By default the entry lives until a vote for the question
+  is committed (see votes_changed()). With
+  POLLS_RESULTS_MAX_STALENESS set, votes leave the entry
+  alone and it simply expires after that many seconds, so
+  a very hot poll is re-read at most once per period.
+  """
+  key = RESULTS_KEY % question_id
+
+  results = cache.get(key)
+  if results is not None:
+    _count("hits")
+    return results
+  _count("misses")
+
+  try:
+    question = Question.objects.get(pk=question_id)
+  except Question.DoesNotExist:
+    return None
+
+  results = {
+    "question": question,
+    "choices": list(question.choice_set.with_vote_totals()),
+  }
+
+  cache.set(key, results, _results_timeout())
+  return results
+
+
+async def aquestion_results(question_id):
+  """
+  Async version of question_results(), built on the
+  async cache and ORM APIs."""
+  key = RESULTS_KEY % question_id
+
+  results = await cache.aget(key)
+  if results is not None:
+    _count("hits")
+    return results
+  _count("misses")
+
+  try:
+    question = await Question.objects.aget(pk=question_id)
+  except Question.DoesNotExist:
+    return None
+
+  results = {
+    "question": question,
+    "choices": [
+      choice async for choice in question.choice_set.with_vote_totals()
+    ],
+  }
+
+  await cache.aset(key, results, _results_timeout())
+  return results
+
+
+def _results_timeout():
+  return getattr(settings, "POLLS_RESULTS_MAX_STALENESS", 0) or \
+    getattr(settings, "POLLS_RESULTS_CACHE_TIMEOUT", 300)
+
+
+def invalidate_question_results(question_id):
+  cache.delete(RESULTS_KEY % question_id)
+
+
+def votes_changed(question_id):
+  """
+  Called once votes for the question have been committed."""
+  if not getattr(settings, "POLLS_RESULTS_MAX_STALENESS", 0):
+    invalidate_question_results(question_id)
+
+
+async def avotes_changed(question_id):
+  if not getattr(settings, "POLLS_RESULTS_MAX_STALENESS", 0):
+    await cache.adelete(RESULTS_KEY % question_id)
+
+
+def results_cache_stats():
+  """
+  Return the hit and miss counts of the results cache
+  in this process."""
+  with _results_stats_lock:
+    stats = dict(_results_stats)
+
+  lookups = stats["hits"] + stats["misses"]
+  stats["hit_ratio"] = stats["hits"] / lookups if lookups else None
+  return stats
+
+
+def reset_results_cache_stats():
+  with _results_stats_lock:
+    _results_stats.update(hits=0, misses=0)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from django.utils.module_loading import import_string
+
+
+@register(Tags.async_support)
+def check_middleware_is_async_capable(app_configs, **kwargs):
+  """
+  The async polls views only run on the event loop if every
+  middleware in MIDDLEWARE is async-capable. A single
+  sync-only middleware makes Django adapt the whole request
+  handling chain around it to run in a thread.
+  """
+  errors = []
+  for middleware_path in settings.MIDDLEWARE:
+    middleware = import_string(middleware_path)
+    if not getattr(middleware, "async_capable", False):
+      errors.append(Warning(
+        f"{middleware_path} is not async-capable.",
+        hint="Requests to the async polls views will be run in a "
+             "thread. Mark the middleware async_capable or remove it.",
+        obj=middleware_path,
+        id="polls.W001",
+      ))
+  return errors
@@ -0,0 +1,189 @@
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .broker import tally_broker
+from .cache import avotes_changed, votes_changed
+from .models import Choice, VoteShard
+
+
+def get_shard_count():
+  """
+  The number of VoteShard rows per choice. 0 means
+  votes are added to Choice.votes directly."""
+  return getattr(settings, "POLLS_VOTE_SHARDS", 0)
+
+
+def increment_votes(choice_id, count=1, shards=None, question_id=None):
+  """
+  Add `count` votes to the choice with the primary key
+  `choice_id`.
+
+  Every vote written by the polls app goes through this
+  function, whether it comes from vote() directly or
+  from a VoteBuffer flush. When `question_id` is given,
+  votes_committed() is called once the surrounding
+  transaction commits.
+  """
+  if shards is None:
+    shards = get_shard_count()
+
+  if not shards:
+    Choice.objects.filter(pk=choice_id).update(votes=F("votes") + count)
+  else:
+    _increment_shard(choice_id, count, shards)
+
+  # Outside of a transaction this runs straight away,
+  # after the write above.
+  if question_id is not None:
+    transaction.on_commit(
+      lambda: votes_committed(question_id, choice_id, count))
+
+
+def increment_many(votes, shards=None):
+  """
+  Apply a batch of votes at once. `votes` maps
+  (question id, choice id) to a number of votes.
+
+  Choices receiving the same number of votes share one
+  "UPDATE ... WHERE id IN (...)", so the number of queries
+  depends on how many distinct counts there are rather
+  than on the number of choices. Everything is applied
+  in one transaction.
+  """
+  if shards is None:
+    shards = get_shard_count()
+
+  by_count = {}
+  for (question_id, choice_id), count in votes.items():
+    by_count.setdefault(count, []).append(choice_id)
+
+  with transaction.atomic():
+    for count, choice_ids in by_count.items():
+      if not shards:
+        Choice.objects.filter(pk__in=choice_ids).update(
+          votes=F("votes") + count)
+      else:
+        _increment_shards(choice_ids, count, shards)
+
+    for (question_id, choice_id), count in votes.items():
+      transaction.on_commit(
+        lambda args=(question_id, choice_id, count): votes_committed(*args))
+
+
+def _increment_shards(choice_ids, count, shards):
+  # The whole group goes to the same randomly picked shard.
+  shard = random.randrange(shards)
+  shard_votes = VoteShard.objects.filter(choice_id__in=choice_ids, shard=shard)
+
+  existing = set(shard_votes.values_list("choice_id", flat=True))
+  shard_votes.update(votes=F("votes") + count)
+
+  missing = [choice_id for choice_id in choice_ids if choice_id not in existing]
+  if missing:
+    try:
+      with transaction.atomic():
+        VoteShard.objects.bulk_create([
+          VoteShard(choice_id=choice_id, shard=shard, votes=count)
+          for choice_id in missing
+        ])
+    except IntegrityError:
+      # Another request created some of these rows first.
+      for choice_id in missing:
+        _increment_shard(choice_id, count, shards)
+
+
+def votes_committed(question_id, choice_id, count):
+  """
+  Called once votes have been committed: drops the
+  question's cached results and tells the watchers of
+  its results stream."""
+  votes_changed(question_id)
+  tally_broker.publish(question_id, choice_id, count)
+
+
+async def aincrement_votes(choice_id, count=1, shards=None, question_id=None):
+  """
+  Async version of increment_votes(), built on the async
+  ORM. Async code runs in autocommit mode, so the cached
+  results are dropped and the watchers told straight
+  after the write.
+  """
+  if shards is None:
+    shards = get_shard_count()
+
+  if not shards:
+    await Choice.objects.filter(pk=choice_id).aupdate(
+      votes=F("votes") + count)
+  else:
+    shard = random.randrange(shards)
+    shard_votes = VoteShard.objects.filter(choice_id=choice_id, shard=shard)
+
+    if not await shard_votes.aupdate(votes=F("votes") + count):
+      try:
+        await VoteShard.objects.acreate(
+          choice_id=choice_id, shard=shard, votes=count)
+      except IntegrityError:
+        await shard_votes.aupdate(votes=F("votes") + count)
+
+  if question_id is not None:
+    await avotes_changed(question_id)
+    tally_broker.publish(question_id, choice_id, count)
+
+
+def _increment_shard(choice_id, count, shards):
+  # Pick a random shard so that concurrent votes for the
+  # same choice are likely to land on different rows.
+  shard = random.randrange(shards)
+
+  updated = VoteShard.objects.filter(
+    choice_id=choice_id, shard=shard).update(votes=F("votes") + count)
+
+  if not updated:
+    # First vote on this shard. Another request may create
+    # the same row at the same time, in which case the
+    # unique constraint fails and we fall back to UPDATE.
+    try:
+      with transaction.atomic():
+        VoteShard.objects.create(
+          choice_id=choice_id, shard=shard, votes=count)
+    except IntegrityError:
+      VoteShard.objects.filter(
+        choice_id=choice_id, shard=shard).update(votes=F("votes") + count)
+
+
+def compact_vote_shards(choice_ids=None):
+  """
+  Fold the VoteShard rows back into Choice.votes and
+  delete the emptied shards. Returns the number of
+  votes that were moved.
+
+  Each shard is decremented by the amount that was read
+  rather than being deleted outright, so votes that land
+  on a shard while it is being compacted are kept.
+  """
+  moved = 0
+
+  with transaction.atomic():
+    shards = VoteShard.objects.exclude(votes=0)
+    if choice_ids is not None:
+      shards = shards.filter(choice_id__in=choice_ids)
+
+    totals = {}
+    for shard_id, choice_id, votes in shards.values_list(
+        "id", "choice_id", "votes"):
+      VoteShard.objects.filter(pk=shard_id).update(votes=F("votes") - votes)
+      totals[choice_id] = totals.get(choice_id, 0) + votes
+
+    for choice_id, votes in totals.items():
+      Choice.objects.filter(pk=choice_id).update(votes=F("votes") + votes)
+      moved += votes
+
+    empty = VoteShard.objects.filter(votes=0)
+    if choice_ids is not None:
+      empty = empty.filter(choice_id__in=choice_ids)
+    empty.delete()
+
+  return moved
@@ -0,0 +1,157 @@
+"""
+One vote per voter and question, checked in memory first.
+
+Every accepted vote is recorded as a Ballot row, whose
+unique constraint on (question, voter_key) is the source
+of truth. To avoid an extra indexed lookup on every vote,
+each question also has a Bloom filter of the voter keys
+that have voted on it:
+
+* if the filter says a key is absent, it is certainly
+  absent, and the Ballot is inserted without a lookup;
+* if the filter says a key may be present, the Ballot
+  table is checked, since it may be a false positive.
+
+A filter sized for n voters with a false-positive rate p
+uses m = -n * ln(p) / ln(2)^2 bits and k = m / n * ln(2)
+hash functions:
+
+  p = 1%     9.59 bits per voter, k = 7    1.14 MiB per 1M voters
+  p = 0.1%  14.38 bits per voter, k = 10   1.71 MiB per 1M voters
+  p = 0.01% 19.17 bits per voter, k = 13   2.29 MiB per 1M voters
+
+So with the default 1% rate, roughly one first-time voter
+in a hundred pays for the fallback lookup. The filters are
+kept per process and rebuilt from the Ballot table with one
+query the first time each question is voted on after the
+process starts. A filter that fills up past its capacity
+is rebuilt at twice the size, keeping the rate at p.
+"""
+import hashlib
+import math
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Ballot
+
+
+class BloomFilter:
+  """
+  A fixed-size Bloom filter of strings, sized for
+  `capacity` members at `error_rate` false positives."""
+
+  def __init__(self, capacity, error_rate=0.01):
+    self.capacity = capacity
+    self.error_rate = error_rate
+    self.size = max(8, math.ceil(
+      -capacity * math.log(error_rate) / math.log(2) ** 2))
+    self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+    self.bits = bytearray((self.size + 7) // 8)
+    self.count = 0
+
+  def _positions(self, key):
+    # Double hashing: k positions from two 64-bit halves
+    # of a single digest.
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "little")
+    second = int.from_bytes(digest[8:], "little") | 1
+    return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+  def add(self, key):
+    for position in self._positions(key):
+      self.bits[position >> 3] |= 1 << (position & 7)
+    self.count += 1
+
+  def __contains__(self, key):
+    return all(
+      self.bits[position >> 3] & (1 << (position & 7))
+      for position in self._positions(key))
+
+  @property
+  def memory(self):
+    """The size of the bit array, in bytes."""
+    return len(self.bits)
+
+
+class VoterRegistry:
+  """
+  Records who has voted on which question. See the module
+  docstring for how the Bloom filters are used."""
+
+  def __init__(self, capacity=None, error_rate=None):
+    self.capacity = capacity or getattr(
+      settings, "POLLS_DEDUPE_CAPACITY", 10000)
+    self.error_rate = error_rate or getattr(
+      settings, "POLLS_DEDUPE_ERROR_RATE", 0.01)
+    self._filters = {}
+    self._lock = threading.Lock()
+
+  def _load(self, question_id, capacity):
+    voter_keys = Ballot.objects.filter(
+      question_id=question_id).values_list("voter_key", flat=True)
+
+    bloom = BloomFilter(capacity, self.error_rate)
+    for voter_key in voter_keys.iterator():
+      bloom.add(voter_key)
+
+    # Leave room to grow before the next rebuild.
+    if bloom.count > capacity // 2:
+      return self._load(question_id, capacity * 2)
+    return bloom
+
+  def _filter(self, question_id):
+    bloom = self._filters.get(question_id)
+    if bloom is None or bloom.count >= bloom.capacity:
+      capacity = self.capacity if bloom is None else bloom.capacity * 2
+      bloom = self._load(question_id, capacity)
+      with self._lock:
+        self._filters[question_id] = bloom
+    return bloom
+
+  def register(self, question_id, voter_key):
+    """
+    Record a vote by `voter_key` on a question. Returns
+    False, without recording anything, if that voter has
+    already voted on it."""
+    bloom = self._filter(question_id)
+
+    if voter_key in bloom and Ballot.objects.filter(
+        question_id=question_id, voter_key=voter_key).exists():
+      return False
+
+    try:
+      with transaction.atomic():
+        Ballot.objects.create(question_id=question_id, voter_key=voter_key)
+    except IntegrityError:
+      # The same voter voted twice at the same moment.
+      return False
+    finally:
+      with self._lock:
+        bloom.add(voter_key)
+    return True
+
+  def clear(self):
+    with self._lock:
+      self._filters.clear()
+
+
+def voter_key(request):
+  """
+  Identify the voter behind a request: the user when
+  logged in, the session otherwise."""
+  if request.user.is_authenticated:
+    return f"user:{request.user.pk}"
+
+  if request.session.session_key is None:
+    # Anonymous visitors get a session on their first vote.
+    request.session.save()
+  return f"session:{request.session.session_key}"
+
+
+def dedupe_enabled():
+  return getattr(settings, "POLLS_ONE_VOTE_PER_VOTER", False)
+
+
+voter_registry = VoterRegistry()
@@ -0,0 +1,138 @@
+"""
+Helpers shared by the polls benchmark commands.
+
+The leading underscore keeps Django from treating
+this module as a management command.
+"""
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test.utils import (
+  override_settings, setup_databases, teardown_databases)
+
+
+@contextmanager
+def scratch_database():
+  """
+  Run the enclosed block against a freshly migrated,
+  file-backed copy of the default SQLite database, so
+  that benchmarks never touch db.sqlite3 and see the
+  same locking behaviour as the real database file.
+
+  DEBUG is switched off for the duration, as it would be
+  in production; otherwise the debug toolbar and query
+  logging dominate every measurement. The test client's
+  "testserver" host is allowed, as it is under the test
+  runner.
+  """
+  directory = tempfile.mkdtemp(prefix="polls-bench-")
+  test_settings = connection.settings_dict.setdefault("TEST", {})
+  original_name = test_settings.get("NAME")
+  test_settings["NAME"] = os.path.join(directory, "bench.sqlite3")
+
+  old_config = setup_databases(
+    verbosity=0, interactive=False, aliases={"default"})
+  try:
+    with override_settings(
+        DEBUG=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+      yield
+  finally:
+    connections.close_all()
+    teardown_databases(old_config, verbosity=0)
+    test_settings["NAME"] = original_name
+    os.rmdir(directory)
+
+
+def percentile(samples, fraction):
+  """
+  Return the value below which `fraction` (0..1) of the
+  sorted `samples` fall, using the nearest-rank method."""
+  if not samples:
+    return 0.0
+  ordered = sorted(samples)
+  rank = max(1, math.ceil(fraction * len(ordered)))
+  return ordered[rank - 1]
+
+
+def run_threads(target, count):
+  """
+  Call target(index) in `count` threads that all start
+  at the same moment. Returns the wall-clock time taken.
+  """
+  barrier = threading.Barrier(count + 1)
+
+  def worker(index):
+    barrier.wait()
+    try:
+      target(index)
+    finally:
+      # Every thread opened its own connection.
+      connection.close()
+
+  threads = [
+    threading.Thread(target=worker, args=(index,))
+    for index in range(count)
+  ]
+  for thread in threads:
+    thread.start()
+
+  barrier.wait()
+  started = time.perf_counter()
+  for thread in threads:
+    thread.join()
+  return time.perf_counter() - started
+
+
+def run_processes(target, count):
+  """
+  Call target(index) in `count` forked processes that all
+  start at the same moment. Returns the list of values
+  they returned, in order, and the wall-clock time taken.
+
+  Fork is required, so that the children inherit the
+  scratch database settings; it is not available on
+  Windows.
+  """
+  context = multiprocessing.get_context("fork")
+  barrier = context.Barrier(count + 1)
+  results = context.Queue()
+
+  def worker(index):
+    barrier.wait()
+    try:
+      results.put((index, target(index)))
+    except Exception as error:
+      # Report the failure rather than leave the parent
+      # waiting for a result that never comes.
+      results.put((index, RuntimeError(f"worker {index}: {error!r}")))
+    finally:
+      connection.close()
+
+  # A connection must never be shared with a child.
+  connections.close_all()
+
+  processes = [
+    context.Process(target=worker, args=(index,))
+    for index in range(count)
+  ]
+  for process in processes:
+    process.start()
+
+  barrier.wait()
+  started = time.perf_counter()
+  values = dict(results.get() for _ in processes)
+  elapsed = time.perf_counter() - started
+  for process in processes:
+    process.join()
+
+  for value in values.values():
+    if isinstance(value, Exception):
+      raise value
+  return [values[index] for index in range(count)], elapsed
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+from django.utils import timezone
+
+from polls.counters import increment_votes
+from polls.models import Choice, Question
+
+from ._bench import scratch_database, run_threads
+
+
+class Command(BaseCommand):
+  help = (
+    "Measure vote write throughput on one hot Choice for "
+    "different POLLS_VOTE_SHARDS values. Runs against a "
+    "scratch database, never db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--shards", default="0,1,4,16",
+      help="Comma separated shard counts to compare (0 = unsharded).")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+      "--votes", type=int, default=500, help="Votes cast per thread.")
+
+  def handle(self, *args, **options):
+    shard_counts = [int(value) for value in options["shards"].split(",")]
+    threads = options["threads"]
+    votes = options["votes"]
+
+    self.stdout.write(
+      f"{threads} threads x {votes} votes on a single choice\n")
+    self.stdout.write(
+      f"{'shards':>8} {'votes/s':>10} {'locked':>8} {'total ok':>9}")
+
+    with scratch_database():
+      for shards in shard_counts:
+        question = Question.objects.create(
+          question_text=f"Benchmark ({shards} shards)",
+          pub_date=timezone.now())
+        choice = Choice.objects.create(question=question, choice_text="Hot")
+
+        locked = [0] * threads
+        cast = [0] * threads
+
+        def cast_votes(index):
+          for _ in range(votes):
+            try:
+              increment_votes(choice.pk, shards=shards)
+              cast[index] += 1
+            except OperationalError:
+              # "database is locked": SQLite gave up waiting
+              # for another writer.
+              locked[index] += 1
+
+        elapsed = run_threads(cast_votes, threads)
+
+        total = Choice.objects.with_vote_totals().get(pk=choice.pk).total_votes
+        self.stdout.write(
+          f"{shards:>8} {sum(cast) / elapsed:>10.0f} {sum(locked):>8} "
+          f"{'yes' if total == sum(cast) else 'NO':>9}")
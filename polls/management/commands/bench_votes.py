@@ -0,0 +1,223 @@
+import json
+import os
+import platform
+import sqlite3
+import time
+from contextlib import redirect_stdout
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from polls.buffer import drain_vote_buffer, get_buffer_settings
+from polls.counters import get_shard_count
+from polls.dedupe import dedupe_enabled
+from polls.models import Choice, Question
+
+from ._bench import percentile, run_processes, run_threads, scratch_database
+
+
+class Command(BaseCommand):
+  help = (
+    "Measure polls.views.vote under concurrent voters: votes/s, "
+    "p50/p99 latency and \"database is locked\" errors, and check "
+    "that every accepted vote was counted. Runs against a scratch "
+    "copy of the SQLite database. Results can be saved as a JSON "
+    "baseline and later runs compared against it."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--workers", type=int, default=8,
+      help="Concurrent voters.")
+    parser.add_argument(
+      "--mode", choices=["threads", "processes"], default="threads",
+      help="Run the voters as threads of this process, or as "
+           "forked processes, which do not share the GIL.")
+    parser.add_argument(
+      "--votes", type=int, default=250, help="Votes posted per worker.")
+    parser.add_argument(
+      "--choices", type=int, default=1,
+      help="Choices the votes are spread over. 1 makes every "
+           "vote contend for the same row.")
+    parser.add_argument(
+      "--output", metavar="PATH",
+      help="Write the results to PATH as JSON, to be used as a "
+           "baseline by later runs.")
+    parser.add_argument(
+      "--baseline", metavar="PATH",
+      help="Compare the results with the JSON written by an "
+           "earlier --output run, and fail on a regression.")
+    parser.add_argument(
+      "--tolerance", type=float, default=0.2,
+      help="How much worse than the baseline votes/s and p99 "
+           "latency may get, as a fraction (default: 0.2).")
+
+  def handle(self, *args, **options):
+    config = {
+      "mode": options["mode"],
+      "workers": options["workers"],
+      "votes_per_worker": options["votes"],
+      "choices": options["choices"],
+      "vote_buffer": get_buffer_settings()["ENABLED"],
+      "vote_shards": get_shard_count(),
+      "one_vote_per_voter": dedupe_enabled(),
+    }
+    self.stdout.write(
+      f"{config['workers']} {config['mode']} x {config['votes_per_worker']} "
+      f"votes over {config['choices']} choice(s)")
+
+    # vote() prints as it goes; the output is thrown away
+    # rather than the calls skipped, so that they are still
+    # part of the measurement.
+    with scratch_database(), open(os.devnull, "w") as devnull, \
+        redirect_stdout(devnull):
+      results = self.run(config)
+
+    self.report(results)
+    report = {
+      "benchmark": "polls.views.vote",
+      "created": timezone.now().isoformat(),
+      "config": config,
+      "environment": {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "sqlite": sqlite3.sqlite_version,
+      },
+      "results": results,
+    }
+
+    if options["output"]:
+      with open(options["output"], "w") as output:
+        json.dump(report, output, indent=2)
+        output.write("\n")
+      self.stdout.write(f"Results written to {options['output']}")
+
+    if not results["totals_match"]:
+      raise CommandError(
+        f"{results['accepted']} votes were accepted but "
+        f"{results['recorded']} were recorded.")
+
+    if options["baseline"]:
+      self.compare(report, options["baseline"], options["tolerance"])
+
+  def run(self, config):
+    question = Question.objects.create(
+      question_text="Benchmark question", pub_date=timezone.now())
+    choice_ids = [
+      Choice.objects.create(question=question, choice_text=f"Choice {n}").pk
+      for n in range(config["choices"])
+    ]
+    url = reverse("polls:vote", args=(question.pk,))
+    votes = config["votes_per_worker"]
+
+    def cast_votes(index):
+      client = Client()
+      latencies = []
+      accepted = locked = errors = 0
+
+      for n in range(votes):
+        choice_id = choice_ids[(index + n) % len(choice_ids)]
+        started = time.perf_counter()
+        try:
+          response = client.post(url, {"choice": choice_id})
+        except OperationalError as error:
+          if "database is locked" not in str(error):
+            raise
+          # SQLite gave up waiting for another writer.
+          locked += 1
+        else:
+          # vote() redirects once the vote is counted, and
+          # re-renders the form when it is turned away.
+          if response.status_code == 302:
+            accepted += 1
+          else:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+
+      return {
+        "latencies": latencies, "accepted": accepted,
+        "locked": locked, "errors": errors,
+      }
+
+    if config["mode"] == "processes":
+      def process(index):
+        outcome = cast_votes(index)
+        # Each process has its own vote buffer to write out.
+        drain_vote_buffer()
+        return outcome
+
+      outcomes, elapsed = run_processes(process, config["workers"])
+    else:
+      outcomes = [None] * config["workers"]
+
+      def thread(index):
+        outcomes[index] = cast_votes(index)
+
+      elapsed = run_threads(thread, config["workers"])
+      drain_vote_buffer()
+
+    latencies = [
+      latency for outcome in outcomes for latency in outcome["latencies"]]
+    accepted = sum(outcome["accepted"] for outcome in outcomes)
+    recorded = sum(
+      choice.total_votes
+      for choice in Choice.objects.filter(question=question).with_vote_totals())
+
+    return {
+      "submitted": len(latencies),
+      "accepted": accepted,
+      "locked": sum(outcome["locked"] for outcome in outcomes),
+      "errors": sum(outcome["errors"] for outcome in outcomes),
+      "recorded": recorded,
+      "totals_match": recorded == accepted,
+      "elapsed": round(elapsed, 3),
+      "votes_per_second": round(accepted / elapsed, 1),
+      "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+      "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+  def report(self, results):
+    self.stdout.write(
+      f"{'votes/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'locked':>7} "
+      f"{'errors':>7} {'accepted':>9} {'recorded':>9}")
+    self.stdout.write(
+      f"{results['votes_per_second']:>10.0f} {results['p50_ms']:>8.2f} "
+      f"{results['p99_ms']:>8.2f} {results['locked']:>7} "
+      f"{results['errors']:>7} {results['accepted']:>9} "
+      f"{results['recorded']:>9}")
+
+  def compare(self, report, path, tolerance):
+    try:
+      with open(path) as baseline_file:
+        baseline = json.load(baseline_file)
+    except (OSError, ValueError) as error:
+      raise CommandError(f"Cannot read the baseline {path}: {error}")
+
+    if baseline["config"] != report["config"]:
+      self.stderr.write(
+        "The baseline was run with different options or settings; "
+        "the comparison may not be meaningful.")
+
+    before, after = baseline["results"], report["results"]
+    regressions = []
+    if after["votes_per_second"] < before["votes_per_second"] * (1 - tolerance):
+      regressions.append(
+        f"votes/s fell from {before['votes_per_second']:.0f} "
+        f"to {after['votes_per_second']:.0f}")
+    if after["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+      regressions.append(
+        f"p99 latency rose from {before['p99_ms']:.2f} ms "
+        f"to {after['p99_ms']:.2f} ms")
+    if after["locked"] > before["locked"]:
+      regressions.append(
+        f"\"database is locked\" errors rose from {before['locked']} "
+        f"to {after['locked']}")
+
+    if regressions:
+      raise CommandError(
+        "Regression against the baseline: " + "; ".join(regressions) + ".")
+    self.stdout.write(self.style.SUCCESS("No regression against the baseline."))
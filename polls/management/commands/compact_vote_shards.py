@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from polls.counters import compact_vote_shards
+
+
+class Command(BaseCommand):
+  help = "Fold the votes held in VoteShard rows back into Choice.votes."
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "choice_ids", nargs="*", type=int,
+      help="Only compact the shards of these choices.")
+
+  def handle(self, *args, **options):
+    moved = compact_vote_shards(options["choice_ids"] or None)
+    self.stdout.write(self.style.SUCCESS(
+      f"Moved {moved} vote{'s' if moved != 1 else ''} into Choice.votes."))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 21:59
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_ballot'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='choice',
+            options={'permissions': [('add_bulk_votes', 'Can submit votes in bulk')]},
+        ),
+    ]
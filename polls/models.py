@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
 
 import datetime
 
@@ -49,6 +51,18 @@ class Question(models.Model):
     return self.question_text
 
 
+class ChoiceQuerySet(models.QuerySet):
+  def with_vote_totals(self):
+    """
+    Annotate every Choice with "total_votes": the votes
+    folded into Choice.votes plus the votes still spread
+    across its VoteShard rows. The sum is computed by the
+    database in the same query that fetches the choices."""
+    return self.annotate(
+      total_votes=F("votes") + Coalesce(Sum("vote_shards__votes"), 0)
+    ).order_by("pk")
+
+
 class Choice(models.Model):
   question = models.ForeignKey(Question, on_delete=models.CASCADE)
 
@@ -57,5 +71,58 @@ class Choice(models.Model):
   # "votes" is a field in a database table.
   votes = models.IntegerField(default=0)
 
+  # question.choice_set uses this manager as well, so
+  # question.choice_set.with_vote_totals() works too.
+  objects = ChoiceQuerySet.as_manager()
+
+  class Meta:
+    permissions = [
+      # For kiosk and operator accounts; see
+      # polls.views.BulkVoteView.
+      ("add_bulk_votes", "Can submit votes in bulk"),
+    ]
+
+  def __str__(self):
+    return self.choice_text
+
+
+# With POLLS_VOTE_SHARDS set, votes for a Choice are spread
+# over several VoteShard rows instead of all incrementing the
+# single Choice.votes counter, so that concurrent votes for a
+# popular choice don't all wait on the same row.
+class VoteShard(models.Model):
+  choice = models.ForeignKey(
+    Choice, related_name="vote_shards", on_delete=models.CASCADE)
+
+  # Which of the POLLS_VOTE_SHARDS slots this row is.
+  shard = models.PositiveSmallIntegerField()
+
+  votes = models.IntegerField(default=0)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=["choice", "shard"], name="unique_vote_shard"),
+    ]
+
+  def __str__(self):
+    return f"{self.choice} [shard {self.shard}]"
+
+# One row per voter and question, when POLLS_ONE_VOTE_PER_VOTER
+# is enabled. See polls/dedupe.py.
+class Ballot(models.Model):
+  question = models.ForeignKey(Question, on_delete=models.CASCADE)
+
+  # "user:<id>" for logged in users, "session:<key>" otherwise.
+  voter_key = models.CharField(max_length=64)
+
+  cast = models.DateTimeField(auto_now_add=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=["question", "voter_key"], name="unique_ballot"),
+    ]
+
   def __str__(self):
-    return self.choice_text
\ No newline at end of file
+    return f"{self.voter_key} on {self.question}"
@@ -0,0 +1,16 @@
+from rest_framework import serializers
+
+# The most votes one entry may carry.
+MAX_COUNT = 10000
+
+
+# Purpose: To validate one entry of a bulk vote
+# submission (see polls.views.BulkVoteView).
+class VoteEntrySerializer(serializers.Serializer):
+  question_id = serializers.IntegerField(min_value=1)
+  choice_id = serializers.IntegerField(min_value=1)
+
+  # The number of votes the client collected
+  # for this choice while it was offline.
+  count = serializers.IntegerField(
+    min_value=1, max_value=MAX_COUNT, default=1)
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_latest_questions, invalidate_question_results
+from .models import Choice, Question
+
+
+# Any Question saved or deleted through the ORM, which
+# includes the QuestionAdmin pages, may change the index
+# page. Note that QuerySet.update() and bulk_create() do
+# not send these signals.
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+  invalidate_latest_questions()
+  invalidate_question_results(instance.pk)
+
+
+# Editing a choice in the admin changes the results page
+# of its question. Votes are handled by votes_changed().
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+  invalidate_question_results(instance.question_id)
@@ -1,10 +1,23 @@
+import asyncio
 import datetime
+import json
+import time
 
-from django.test import TestCase
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
-from .models import Question
+from .broker import TallyBroker
+from .buffer import VoteBuffer, drain_vote_buffer
+from .cache import reset_results_cache_stats, results_cache_stats
+from .counters import compact_vote_shards, increment_votes
+from .dedupe import BloomFilter, VoterRegistry, voter_registry
+from .models import Ballot, Choice, Question, VoteShard
 
 
 class QuestionModelTests(TestCase):
@@ -71,6 +84,12 @@ def create_question(question_text, days):
 
 
 class QuestionIndexViewTests(TestCase):
+  def setUp(self):
+    # The index page is cached, and rolling back the previous
+    # test's questions doesn't send the signals that would
+    # invalidate it.
+    cache.clear()
+
   def test_no_questions(self):
     """
     If no questions exist, an appropriate message is displayed.
@@ -207,4 +226,709 @@ class QuestionDetailViewTests(TestCase):
     # past_question.question_text, it shows that the GET
     # request was successful because a response consisting
     # of "Past Question" was sent back from the web server.
-    self.assertContains(response, past_question.question_text)
\ No newline at end of file
+    self.assertContains(response, past_question.question_text)
+
+
+class VoteBufferTests(TestCase):
+  def setUp(self):
+    question = create_question(question_text="Buffered question.", days=-1)
+    self.choice = Choice.objects.create(question=question, choice_text="Yes")
+    self.url = reverse("polls:vote", args=(question.id,))
+
+  def tearDown(self):
+    drain_vote_buffer()
+
+  def test_votes_are_written_synchronously_by_default(self):
+    """
+    Without POLLS_VOTE_BUFFER enabled, every vote is
+    written to the database straight away.
+    """
+    self.client.post(self.url, {"choice": self.choice.id})
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 1)
+
+  @override_settings(POLLS_VOTE_BUFFER={
+    "ENABLED": True, "FLUSH_INTERVAL": 0, "FLUSH_THRESHOLD": 3})
+  def test_votes_are_flushed_at_the_threshold(self):
+    """
+    Buffered votes are held back until FLUSH_THRESHOLD
+    votes are pending, and are then written in one batch.
+    """
+    for _ in range(2):
+      self.client.post(self.url, {"choice": self.choice.id})
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 0)
+
+    self.client.post(self.url, {"choice": self.choice.id})
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 3)
+
+  @override_settings(POLLS_VOTE_BUFFER={
+    "ENABLED": True, "FLUSH_INTERVAL": 0, "FLUSH_THRESHOLD": 100})
+  def test_pending_votes_are_drained_on_shutdown(self):
+    """
+    Votes still in the buffer are written when it is drained.
+    """
+    for _ in range(5):
+      self.client.post(self.url, {"choice": self.choice.id})
+
+    self.assertEqual(drain_vote_buffer(), 5)
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 5)
+
+  def test_failed_threshold_flush_keeps_the_votes(self):
+    """
+    A flush that fails when a vote reaches the threshold
+    is logged, and its votes stay pending for the next.
+    """
+    vote_buffer = VoteBuffer(flush_interval=0, flush_threshold=2)
+    vote_buffer.add(self.choice.id)
+
+    with mock.patch(
+        "polls.buffer.increment_votes", side_effect=DatabaseError("locked")):
+      with self.assertLogs("polls.buffer", "ERROR"):
+        vote_buffer.add(self.choice.id)
+
+    self.assertEqual(vote_buffer.pending, 2)
+    self.assertEqual(vote_buffer.flush(), 2)
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 2)
+
+  def test_one_update_per_choice(self):
+    """
+    A flush issues one UPDATE per choice, however many
+    votes that choice received.
+    """
+    other = Choice.objects.create(
+      question=self.choice.question, choice_text="No")
+    vote_buffer = VoteBuffer(flush_interval=0, flush_threshold=1000)
+
+    for _ in range(10):
+      vote_buffer.add(self.choice.id)
+    vote_buffer.add(other.id, count=4)
+
+    # One query per choice, plus the savepoint and its release.
+    with self.assertNumQueries(4):
+      self.assertEqual(vote_buffer.flush(), 14)
+
+    self.assertEqual(vote_buffer.pending, 0)
+    self.assertEqual(
+      list(Choice.objects.order_by("id").values_list("votes", flat=True)),
+      [10, 4])
+
+
+class VoteShardTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.question = create_question(question_text="Sharded question.", days=-1)
+    self.choice = Choice.objects.create(
+      question=self.question, choice_text="Yes", votes=2)
+
+  def test_sharded_votes_are_spread_over_shard_rows(self):
+    """
+    With shards, votes go to VoteShard rows and never
+    to more rows than the configured shard count.
+    """
+    for _ in range(50):
+      increment_votes(self.choice.id, shards=4)
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 2)
+    self.assertLessEqual(self.choice.vote_shards.count(), 4)
+    self.assertEqual(
+      sum(self.choice.vote_shards.values_list("votes", flat=True)), 50)
+
+  def test_vote_totals_sum_the_shards_in_one_query(self):
+    """
+    with_vote_totals() adds the shard rows to Choice.votes
+    in a single query.
+    """
+    for _ in range(5):
+      increment_votes(self.choice.id, shards=3)
+
+    with self.assertNumQueries(1):
+      choice = self.question.choice_set.with_vote_totals().get()
+    self.assertEqual(choice.total_votes, 7)
+
+  @override_settings(POLLS_VOTE_SHARDS=4)
+  def test_results_page_includes_sharded_votes(self):
+    """
+    The results page shows the sharded votes.
+    """
+    self.client.post(
+      reverse("polls:vote", args=(self.question.id,)),
+      {"choice": self.choice.id})
+
+    response = self.client.get(
+      reverse("polls:results", args=(self.question.id,)))
+    self.assertContains(response, "Yes -- 3 votes")
+
+  def test_compaction_folds_shards_into_choice_votes(self):
+    """
+    compact_vote_shards() moves every shard vote into
+    Choice.votes and removes the emptied shards.
+    """
+    for _ in range(10):
+      increment_votes(self.choice.id, shards=4)
+
+    self.assertEqual(compact_vote_shards(), 10)
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 12)
+    self.assertFalse(VoteShard.objects.exists())
+
+
+class LatestQuestionsCacheTests(TestCase):
+  def setUp(self):
+    cache.clear()
+
+  def test_cached_index_page_runs_no_queries(self):
+    """
+    Once the question list is cached, the index page
+    doesn't query the database.
+    """
+    create_question(question_text="Past question.", days=-1)
+    self.client.get(reverse("polls:index"))
+
+    with self.assertNumQueries(0):
+      response = self.client.get(reverse("polls:index"))
+    self.assertContains(response, "Past question.")
+
+  def test_saving_a_question_invalidates_the_cache(self):
+    """
+    Creating, editing or deleting a question is reflected on
+    the next index page view.
+    """
+    self.client.get(reverse("polls:index"))
+
+    question = create_question(question_text="New question.", days=-1)
+    self.assertContains(self.client.get(reverse("polls:index")), "New question.")
+
+    question.question_text = "Edited question."
+    question.save()
+    self.assertContains(
+      self.client.get(reverse("polls:index")), "Edited question.")
+
+    question.delete()
+    self.assertContains(
+      self.client.get(reverse("polls:index")), "No polls are available.")
+
+  def test_scheduled_question_appears_at_its_pub_date(self):
+    """
+    The cached list expires when the next scheduled
+    question's pub_date is reached.
+    """
+    question = create_question(question_text="Scheduled question.", days=1)
+    self.assertContains(
+      self.client.get(reverse("polls:index")), "No polls are available.")
+
+    with mock.patch("polls.cache.timezone.now",
+                    return_value=question.pub_date):
+      response = self.client.get(reverse("polls:index"))
+    self.assertContains(response, "Scheduled question.")
+
+
+class ResultsCacheTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    reset_results_cache_stats()
+
+    self.question = create_question(question_text="Cached results.", days=-1)
+    self.choice = Choice.objects.create(
+      question=self.question, choice_text="Yes")
+    self.results_url = reverse("polls:results", args=(self.question.id,))
+    self.vote_url = reverse("polls:vote", args=(self.question.id,))
+
+  def test_cached_results_page_runs_no_queries(self):
+    """
+    A results page served from the cache doesn't query
+    the database.
+    """
+    self.client.get(self.results_url)
+
+    with self.assertNumQueries(0):
+      response = self.client.get(self.results_url)
+    self.assertContains(response, "Yes -- 0 votes")
+
+    self.assertEqual(results_cache_stats(),
+                     {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+  def test_committed_vote_invalidates_the_results(self):
+    """
+    The results page shows a vote as soon as it is committed.
+    """
+    self.client.get(self.results_url)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.client.post(self.vote_url, {"choice": self.choice.id})
+
+    self.assertContains(self.client.get(self.results_url), "Yes -- 1 vote")
+
+  @override_settings(POLLS_RESULTS_MAX_STALENESS=1)
+  def test_bounded_staleness_keeps_results_until_they_expire(self):
+    """
+    With POLLS_RESULTS_MAX_STALENESS, votes don't invalidate
+    the cached results; they are re-read once they expire.
+    """
+    self.client.get(self.results_url)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.client.post(self.vote_url, {"choice": self.choice.id})
+
+    self.assertContains(self.client.get(self.results_url), "Yes -- 0 votes")
+
+    with mock.patch("django.core.cache.backends.locmem.time.time",
+                    return_value=time.time() + 2):
+      response = self.client.get(self.results_url)
+    self.assertContains(response, "Yes -- 1 vote")
+
+  def test_missing_question_is_a_404(self):
+    response = self.client.get(reverse("polls:results", args=(999,)))
+    self.assertEqual(response.status_code, 404)
+
+  def test_stats_are_staff_only(self):
+    """
+    The hit/miss counters are only shown to staff members.
+    """
+    url = reverse("polls:results_cache")
+    self.assertEqual(self.client.get(url).status_code, 302)
+
+    staff = User.objects.create_user("staff", password="secret", is_staff=True)
+    self.client.force_login(staff)
+    self.assertEqual(
+      self.client.get(url).json(), {"hits": 0, "misses": 0, "hit_ratio": None})
+
+
+class AsyncViewTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.question = create_question(question_text="Async question.", days=-1)
+    self.choice = Choice.objects.create(
+      question=self.question, choice_text="Yes")
+
+  async def test_async_detail_view(self):
+    """
+    The async detail view lists the choices and posts
+    the form to the async vote view.
+    """
+    response = await self.async_client.get(
+      reverse("polls:async_detail", args=(self.question.id,)))
+
+    self.assertContains(response, "Async question.")
+    self.assertContains(response, 'name="choice"')
+    self.assertContains(
+      response, reverse("polls:async_vote", args=(self.question.id,)))
+
+  async def test_async_detail_view_hides_future_questions(self):
+    future_question = await Question.objects.acreate(
+      question_text="Future question.",
+      pub_date=timezone.now() + datetime.timedelta(days=5))
+
+    response = await self.async_client.get(
+      reverse("polls:async_detail", args=(future_question.id,)))
+    self.assertEqual(response.status_code, 404)
+
+  async def test_async_vote_and_results(self):
+    """
+    A vote through the async view is counted and shown on
+    the async results page.
+    """
+    response = await self.async_client.post(
+      reverse("polls:async_vote", args=(self.question.id,)),
+      {"choice": self.choice.id})
+
+    self.assertRedirects(
+      response, reverse("polls:async_results", args=(self.question.id,)),
+      fetch_redirect_response=False)
+
+    response = await self.async_client.get(response.url)
+    self.assertContains(response, "Yes -- 1 vote")
+
+  @override_settings(POLLS_VOTE_BUFFER={
+    "ENABLED": True, "FLUSH_INTERVAL": 0, "FLUSH_THRESHOLD": 1})
+  async def test_async_vote_flushes_the_buffer(self):
+    """
+    A vote that fills the buffer flushes it off the event
+    loop, where the database cannot be used.
+    """
+    self.addCleanup(drain_vote_buffer)
+    response = await self.async_client.post(
+      reverse("polls:async_vote", args=(self.question.id,)),
+      {"choice": self.choice.id})
+
+    self.assertEqual(response.status_code, 302)
+    await self.choice.arefresh_from_db()
+    self.assertEqual(self.choice.votes, 1)
+
+  async def test_async_vote_without_a_choice(self):
+    response = await self.async_client.post(
+      reverse("polls:async_vote", args=(self.question.id,)), {})
+
+    self.assertContains(response, "You didn&#x27;t select a choice.")
+
+  def test_middleware_is_async_capable(self):
+    """
+    Every configured middleware can run on the event loop.
+    """
+    from .checks import check_middleware_is_async_capable
+
+    self.assertEqual(check_middleware_is_async_capable(None), [])
+
+
+class TallyBrokerTests(SimpleTestCase):
+  async def test_votes_are_coalesced_into_one_push(self):
+    """
+    Votes published within one interval reach every
+    subscriber as a single message.
+    """
+    broker = TallyBroker(interval=0.05)
+    first = broker.subscribe(1)
+    second = broker.subscribe(1)
+
+    broker.publish(1, 10)
+    broker.publish(1, 10)
+    broker.publish(1, 11, count=3)
+    # Nobody is watching question 2.
+    broker.publish(2, 20)
+
+    for subscription in (first, second):
+      message = await asyncio.wait_for(anext(subscription), 1)
+      self.assertEqual(message, {"seq": 3, "votes": {"10": 2, "11": 3}})
+      self.assertTrue(subscription.queue.empty())
+
+    first.close()
+    second.close()
+
+  async def test_subscribers_share_one_fan_out_task(self):
+    broker = TallyBroker(interval=0.05)
+    subscriptions = [broker.subscribe(1) for _ in range(3)]
+
+    self.assertEqual(broker.subscriber_count(1), 3)
+    self.assertEqual(len({s.topic.task for s in subscriptions}), 1)
+
+    for subscription in subscriptions:
+      subscription.close()
+    self.assertEqual(broker.subscriber_count(1), 0)
+
+  async def test_publishing_from_another_thread(self):
+    """
+    Votes committed in a request thread reach subscribers
+    on the event loop.
+    """
+    broker = TallyBroker(interval=0.01)
+    subscription = broker.subscribe(1)
+
+    await asyncio.to_thread(broker.publish, 1, 10)
+
+    self.assertEqual(
+      await asyncio.wait_for(anext(subscription), 1),
+      {"seq": 1, "votes": {"10": 1}})
+    subscription.close()
+
+  async def test_new_subscribers_skip_votes_published_before_them(self):
+    """
+    A vote published before a subscription was made, but
+    not pushed yet, only reaches the older subscribers.
+    """
+    broker = TallyBroker(interval=0.05)
+    first = broker.subscribe(1)
+    broker.publish(1, 10)
+    second = broker.subscribe(1)
+    broker.publish(1, 11)
+
+    self.assertEqual(second.since, 1)
+    self.assertEqual(
+      await asyncio.wait_for(anext(first), 1),
+      {"seq": 2, "votes": {"10": 1, "11": 1}})
+    self.assertEqual(
+      await asyncio.wait_for(anext(second), 1),
+      {"seq": 2, "votes": {"11": 1}})
+
+    first.close()
+    second.close()
+
+
+@override_settings(POLLS_SSE_COALESCE_INTERVAL=0.01)
+class ResultsStreamTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.question = create_question(question_text="Streamed question.", days=-1)
+    self.choice = Choice.objects.create(
+      question=self.question, choice_text="Yes", votes=4)
+    self.url = reverse("polls:results_stream", args=(self.question.id,))
+
+  async def test_stream_sends_tallies_then_deltas(self):
+    response = await self.async_client.get(self.url)
+    self.assertEqual(response["Content-Type"], "text/event-stream")
+
+    events = aiter(response.streaming_content)
+    first = (await anext(events)).decode()
+    self.assertIn("event: tallies", first)
+    data = json.loads(first.split("data: ")[1])
+    self.assertEqual(data["tallies"], {str(self.choice.id): 4})
+
+    await self.async_client.post(
+      reverse("polls:async_vote", args=(self.question.id,)),
+      {"choice": self.choice.id})
+
+    second = (await asyncio.wait_for(anext(events), 1)).decode()
+    self.assertEqual(
+      second,
+      'event: delta\ndata: {"seq": %d, "votes": {"%s": 1}}\n\n'
+      % (data["seq"] + 1, self.choice.id))
+
+    await events.aclose()
+
+  def test_no_stream_under_wsgi(self):
+    """
+    Under WSGI the results page doesn't open the stream,
+    and the stream answers 204 so browsers don't retry.
+    """
+    response = self.client.get(
+      reverse("polls:results", args=(self.question.id,)))
+    self.assertNotContains(response, "EventSource")
+
+    with self.assertNumQueries(0):
+      response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 204)
+
+  async def test_results_page_opens_the_stream_under_asgi(self):
+    response = await self.async_client.get(
+      reverse("polls:async_results", args=(self.question.id,)))
+    self.assertContains(response, "EventSource")
+
+
+class BulkVoteTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.question = create_question(question_text="Kiosk question.", days=-1)
+    self.choices = [
+      Choice.objects.create(question=self.question, choice_text=f"Choice {n}")
+      for n in range(20)
+    ]
+    self.url = reverse("polls:bulk_vote")
+    kiosk = User.objects.create_user("kiosk")
+    kiosk.user_permissions.add(
+      Permission.objects.get(codename="add_bulk_votes"))
+    self.client.force_login(kiosk)
+
+  def post(self, entries):
+    return self.client.post(self.url, entries, content_type="application/json")
+
+  def entries(self, count):
+    return [
+      {"question_id": self.question.id,
+       "choice_id": self.choices[n % len(self.choices)].id}
+      for n in range(count)
+    ]
+
+  def test_votes_are_applied(self):
+    response = self.post([
+      {"question_id": self.question.id, "choice_id": self.choices[0].id,
+       "count": 3},
+      {"question_id": self.question.id, "choice_id": self.choices[0].id},
+      {"question_id": self.question.id, "choice_id": self.choices[1].id,
+       "count": 2},
+    ])
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()["accepted"], 6)
+    self.assertEqual(
+      [choice.votes for choice in Choice.objects.order_by("id")[:3]],
+      [4, 2, 0])
+
+  def test_invalid_entries_are_reported_per_item(self):
+    other_question = create_question(question_text="Other question.", days=-1)
+    future_question = create_question(question_text="Future question.", days=5)
+    future_choice = Choice.objects.create(
+      question=future_question, choice_text="Too early")
+
+    response = self.post([
+      {"question_id": self.question.id, "choice_id": self.choices[0].id},
+      {"question_id": self.question.id},
+      {"question_id": other_question.id, "choice_id": self.choices[0].id},
+      {"question_id": future_question.id, "choice_id": future_choice.id},
+      {"question_id": self.question.id, "choice_id": self.choices[0].id,
+       "count": 0},
+      {"question_id": self.question.id, "choice_id": self.choices[0].id,
+       "count": 10 ** 30},
+    ])
+
+    results = response.json()["results"]
+    self.assertEqual(response.json()["accepted"], 1)
+    self.assertEqual(
+      [result["status"] for result in results],
+      ["ok", "error", "error", "error", "error", "error"])
+    self.assertIn("choice_id", results[1]["errors"])
+    self.assertIn("choice_id", results[2]["errors"])
+    self.assertIn("choice_id", results[3]["errors"])
+    self.assertIn("count", results[4]["errors"])
+    self.assertIn("count", results[5]["errors"])
+
+  def test_query_count_does_not_grow_with_the_batch(self):
+    """
+    One query validates the ids and one UPDATE applies each
+    distinct vote count, however many entries are sent.
+    """
+    # The session and user, the user's permissions (two
+    # queries), the validation query, the savepoint, one
+    # UPDATE and the savepoint's release.
+    with self.assertNumQueries(8):
+      self.post(self.entries(200))
+    with self.assertNumQueries(8):
+      self.post(self.entries(4000))
+
+    self.assertEqual(
+      sum(Choice.objects.values_list("votes", flat=True)), 4200)
+
+  @override_settings(POLLS_VOTE_SHARDS=4)
+  def test_sharded_votes(self):
+    self.post(self.entries(100))
+    self.post(self.entries(100))
+
+    self.assertEqual(
+      sum(choice.total_votes
+          for choice in Choice.objects.with_vote_totals()), 200)
+
+  def test_voters_must_sign_in(self):
+    self.client.logout()
+    response = self.post(self.entries(1))
+    self.assertEqual(response.status_code, 403)
+    self.assertEqual(Choice.objects.filter(votes__gt=0).count(), 0)
+
+  def test_voters_need_the_bulk_vote_permission(self):
+    self.client.force_login(User.objects.create_user("voter"))
+    response = self.post(self.entries(1))
+    self.assertEqual(response.status_code, 403)
+    self.assertEqual(Choice.objects.filter(votes__gt=0).count(), 0)
+
+  def test_body_must_be_a_list(self):
+    response = self.post({"question_id": 1, "choice_id": 1})
+    self.assertEqual(response.status_code, 400)
+
+
+class BloomFilterTests(SimpleTestCase):
+  def test_members_are_always_found(self):
+    bloom = BloomFilter(capacity=1000)
+    keys = [f"session:{n}" for n in range(1000)]
+    for key in keys:
+      bloom.add(key)
+
+    self.assertTrue(all(key in bloom for key in keys))
+
+  def test_false_positive_rate(self):
+    """
+    At capacity, the false-positive rate stays close to
+    the configured error rate.
+    """
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for n in range(10000):
+      bloom.add(f"member:{n}")
+
+    false_positives = sum(f"stranger:{n}" in bloom for n in range(10000))
+    self.assertLess(false_positives / 10000, 0.02)
+
+  def test_memory_per_million_voters(self):
+    """
+    A 1% filter for a million voters takes about 1.14 MiB.
+    """
+    bloom = BloomFilter(capacity=1000000, error_rate=0.01)
+    self.assertEqual(bloom.hash_count, 7)
+    self.assertAlmostEqual(bloom.memory / 2 ** 20, 1.14, places=2)
+
+
+@override_settings(POLLS_ONE_VOTE_PER_VOTER=True)
+class OneVotePerVoterTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    voter_registry.clear()
+    self.question = create_question(question_text="Dedupe question.", days=-1)
+    self.choice = Choice.objects.create(
+      question=self.question, choice_text="Yes")
+    self.url = reverse("polls:vote", args=(self.question.id,))
+
+  def test_second_vote_is_rejected(self):
+    self.client.post(self.url, {"choice": self.choice.id})
+    response = self.client.post(self.url, {"choice": self.choice.id})
+
+    self.assertContains(response, "You have already voted on this question.")
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 1)
+    self.assertEqual(Ballot.objects.count(), 1)
+
+  def test_different_voters_can_each_vote(self):
+    self.client.post(self.url, {"choice": self.choice.id})
+
+    user = User.objects.create_user("voter", password="secret")
+    self.client.force_login(user)
+    self.client.post(self.url, {"choice": self.choice.id})
+    self.client.post(self.url, {"choice": self.choice.id})
+
+    self.choice.refresh_from_db()
+    self.assertEqual(self.choice.votes, 2)
+    self.assertEqual(
+      sorted(key.split(":")[0] for key in
+             Ballot.objects.values_list("voter_key", flat=True)),
+      ["session", "user"])
+
+  async def test_async_vote_is_deduplicated(self):
+    url = reverse("polls:async_vote", args=(self.question.id,))
+    await self.async_client.post(url, {"choice": self.choice.id})
+    response = await self.async_client.post(url, {"choice": self.choice.id})
+
+    self.assertContains(response, "You have already voted on this question.")
+    self.assertEqual(await Ballot.objects.acount(), 1)
+
+  async def test_async_ballot_is_rolled_back_with_its_vote(self):
+    url = reverse("polls:async_vote", args=(self.question.id,))
+    with mock.patch(
+        "polls.views.increment_votes", side_effect=DatabaseError("locked")):
+      with self.assertRaises(DatabaseError):
+        await self.async_client.post(url, {"choice": self.choice.id})
+    self.assertEqual(await Ballot.objects.acount(), 0)
+
+    # So the voter can try again.
+    await self.async_client.post(url, {"choice": self.choice.id})
+    await self.choice.arefresh_from_db()
+    self.assertEqual(self.choice.votes, 1)
+
+  def test_first_votes_skip_the_ballot_lookup(self):
+    """
+    A voter the filter has never seen is recorded without
+    looking the ballot up first.
+    """
+    registry = VoterRegistry(capacity=100)
+    # Loads the (empty) filter for the question.
+    registry.register(self.question.id, "session:first")
+
+    # The savepoint, the INSERT and the savepoint's release.
+    with self.assertNumQueries(3):
+      self.assertTrue(registry.register(self.question.id, "session:second"))
+
+    # A possible hit is checked against the table.
+    with self.assertNumQueries(1):
+      self.assertFalse(registry.register(self.question.id, "session:second"))
+
+  def test_filters_are_rebuilt_from_the_ballot_table(self):
+    """
+    A new process (a new registry) rejects the voters
+    recorded by a previous one.
+    """
+    VoterRegistry().register(self.question.id, "session:abc")
+
+    registry = VoterRegistry()
+    self.assertFalse(registry.register(self.question.id, "session:abc"))
+    self.assertTrue(registry.register(self.question.id, "session:def"))
+
+  def test_filter_grows_past_its_capacity(self):
+    registry = VoterRegistry(capacity=4)
+    for n in range(20):
+      self.assertTrue(registry.register(self.question.id, f"session:{n}"))
+
+    self.assertGreaterEqual(registry._filters[self.question.id].capacity, 16)
+    for n in range(20):
+      self.assertFalse(registry.register(self.question.id, f"session:{n}"))
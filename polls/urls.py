@@ -19,12 +19,34 @@ urlpatterns = [
   # path("<int:question_id>/results/", views.results, name="results"),
   path("<int:pk>/results/", views.ResultsView.as_view(), name="results"),
 
+  # ex: /polls/1/results/stream/
+  # Live tallies as Server-Sent Events (needs ASGI).
+  path("<int:pk>/results/stream/", views.results_stream,
+       name="results_stream"),
+
   # ex: /polls/1/vote/
   # This request will be handled by the
   # vote() function in polls/views.py.
   # path("<int:question_id>/vote/", views.vote, name="vote")
   path("<int:question_id>/vote/", views.vote, name="vote"),
 
+  # Async versions of the detail, results and vote views
+  # for use under ASGI.
+  # ex: /polls/async/1/
+  path("async/<int:pk>/", views.AsyncDetailView.as_view(),
+       name="async_detail"),
+  path("async/<int:pk>/results/", views.AsyncResultsView.as_view(),
+       name="async_results"),
+  path("async/<int:question_id>/vote/", views.async_vote,
+       name="async_vote"),
+
+  # ex: /polls/api/votes/
+  # Bulk vote submission for batch and offline clients.
+  path("api/votes/", views.BulkVoteView.as_view(), name="bulk_vote"),
+
+  # /polls/results-cache/
+  path("results-cache/", views.results_cache, name="results_cache"),
+
   # /polls/errors/
   path('errors', views.errors, name='errors'),
 
@@ -1,13 +1,34 @@
-from django.db.models import F
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+import asyncio
+import json
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+  HttpResponse, HttpResponseRedirect, Http404, JsonResponse,
+  StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.views import generic
 from django.http import Http404
 from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
 # from django.core.mail import send_mail
-
+from storefront.query_budget import query_budget
+
+from .broker import tally_broker
+from .buffer import get_vote_buffer
+from .cache import (
+  aquestion_results, latest_questions, question_results, results_cache_stats)
+from .counters import aincrement_votes, increment_many, increment_votes
+from .dedupe import dedupe_enabled, voter_key, voter_registry
 from .models import Choice, Question
+from .serializers import VoteEntrySerializer
 
 
 # def index(request):
@@ -44,6 +65,11 @@ class IndexView(generic.ListView):
   # accessible inside of "polls/index.html".
   context_object_name = "latest_question_list"
 
+  # The most SQL queries one request may run (see
+  # storefront/query_budget.py). Rebuilding the cached
+  # question list takes two.
+  query_budget = 2
+
   # Each generic view needs to know what
   # model it will be acting upon.
   def get_queryset(self):
@@ -61,11 +87,12 @@ class IndexView(generic.ListView):
        
        The lte lookup is used to get records that are less than,
        or equal to, a specified value.
+
+       latest_questions() runs that query once and caches the
+       result until the next question is due to be published,
+       so a steady stream of index page views costs no queries.
     """
-    print("Questions to be returned:", Question.objects.filter(
-      pub_date__lte=timezone.now()).order_by("-pub_date")[:5])
-    return Question.objects.filter(
-      pub_date__lte=timezone.now()).order_by("-pub_date")[:5]
+    return latest_questions()
 
 
 # def detail(request, question_id):
@@ -102,12 +129,22 @@ class DetailView(generic.DetailView):
   """
   template_name = "polls/detail.html"
 
+  # The question and its choices.
+  query_budget = 2
+
   def get_queryset(self):
     """
     Excludes any questions that aren't published yet.
     """
     return Question.objects.filter(pub_date__lte=timezone.now())
 
+  def get_context_data(self, **kwargs):
+    # polls/detail.html loops over the choices twice, so
+    # load them once here.
+    context = super().get_context_data(**kwargs)
+    context["choices"] = list(self.object.choice_set.all())
+    return context
+
 
 
 # def results(request, question_id):
@@ -128,13 +165,43 @@ class ResultsView(generic.DetailView):
 
   template_name = "polls/results.html"
 
+  # The question and its choices, on a cache miss.
+  query_budget = 2
+
+  def get_object(self, queryset=None):
+    """
+    Load the question and its vote tallies from the results
+    cache. The tallies are the question's choices annotated
+    with their vote totals, including votes still held in
+    VoteShard rows.
+    """
+    self.results = question_results(self.kwargs["pk"])
+    if self.results is None:
+      raise Http404("No question found matching the query")
+    return self.results["question"]
+
+  def get_context_data(self, **kwargs):
+    context = super().get_context_data(**kwargs)
+    context["choices"] = self.results["choices"]
+    # results_stream() only streams under ASGI.
+    context["live_results"] = isinstance(self.request, ASGIRequest)
+    return context
+
 
 # def vote(request, question_id):
 #   return HttpResponse("You're voting on question %s." % question_id)
 
+ALREADY_VOTED = "You have already voted on this question."
+
 # The vote() function is invoked when making
 # a POST request to the following URL:
 # http://127.0.0.1:8000/polls/1/vote/
+
+# Most of the budget goes on POLLS_ONE_VOTE_PER_VOTER: an
+# anonymous voter's first vote creates their session and
+# loads the question's Bloom filter before the ballot is
+# recorded. Without it a vote takes five queries.
+@query_budget(13)
 def vote(request, question_id):
   # In this case, question_id will be equal to
   # 1 because it is included in the URL.
@@ -203,6 +270,7 @@ def vote(request, question_id):
       "polls/detail.html",
       {
         "question": question,
+        "choices": list(question.choice_set.all()),
         "error_message": "You didn't select a choice.",
       },
     )
@@ -221,9 +289,36 @@ def vote(request, question_id):
     # the database will do inside a transaction and will
     # ensure can't happen at the same time as another UPDATE.
     # This prevents racing conditions.
-    selected_choice.votes = F("votes") + 1
 
-    selected_choice.save()
+    # increment_votes() performs that F("votes") + 1 UPDATE,
+    # or spreads it over VoteShard rows when POLLS_VOTE_SHARDS
+    # is set.
+
+    # With POLLS_ONE_VOTE_PER_VOTER enabled, a voter's ballot
+    # is recorded in the same transaction as the vote, and a
+    # second vote on the same question is turned away.
+    with transaction.atomic():
+      if dedupe_enabled() and \
+          not voter_registry.register(question.pk, voter_key(request)):
+        return render(
+          request,
+          "polls/detail.html",
+          {
+            "question": question,
+            "choices": list(question.choice_set.all()),
+            "error_message": ALREADY_VOTED,
+          },
+        )
+
+      # With POLLS_VOTE_BUFFER enabled the vote is only counted
+      # in memory here, and written to the database together
+      # with the other pending votes by the next flush.
+      vote_buffer = get_vote_buffer()
+
+      if vote_buffer is not None:
+        vote_buffer.add(selected_choice.pk, question_id=question.pk)
+      else:
+        increment_votes(selected_choice.pk, question_id=question.pk)
 
     # Always return an HttpResponseRedirect after successfully dealing
     # with POST data. This prevents data from being posted twice if a
@@ -243,6 +338,273 @@ def vote(request, question_id):
 
     return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
 
+# The following views are the async counterparts of
+# DetailView, ResultsView and vote(). They are served under
+# /polls/async/ and use the async ORM (aget(), aupdate() and
+# "async for"), so that under an ASGI server (storefront/asgi.py)
+# they run on the event loop instead of being handed to a
+# worker thread with sync_to_async.
+class AsyncDetailView(generic.View):
+  template_name = "polls/detail.html"
+  query_budget = 2
+
+  async def get(self, request, pk):
+    # Excludes any questions that aren't published yet.
+    try:
+      question = await Question.objects.filter(
+        pub_date__lte=timezone.now()).aget(pk=pk)
+    except Question.DoesNotExist:
+      raise Http404("No question found matching the query")
+
+    return render(request, self.template_name, {
+      "question": question,
+      "choices": [choice async for choice in question.choice_set.all()],
+      "vote_view": "polls:async_vote",
+    })
+
+
+class AsyncResultsView(generic.View):
+  template_name = "polls/results.html"
+  query_budget = 2
+
+  async def get(self, request, pk):
+    results = await aquestion_results(pk)
+    if results is None:
+      raise Http404("No question found matching the query")
+
+    return render(request, self.template_name, {
+      "question": results["question"],
+      "choices": results["choices"],
+      "detail_view": "polls:async_detail",
+      "live_results": isinstance(request, ASGIRequest),
+    })
+
+
+@sync_to_async
+def _arecord_ballot_and_vote(request, question_id, choice_id):
+  # As in vote(), the ballot and the vote are recorded in
+  # one transaction. Returns False if the voter has voted
+  # on the question already.
+  with transaction.atomic():
+    if not voter_registry.register(question_id, voter_key(request)):
+      return False
+
+    vote_buffer = get_vote_buffer()
+    if vote_buffer is not None:
+      vote_buffer.add(choice_id, question_id=question_id)
+    else:
+      increment_votes(choice_id, question_id=question_id)
+  return True
+
+
+@query_budget(13)
+async def async_vote(request, question_id):
+  try:
+    question = await Question.objects.aget(pk=question_id)
+  except Question.DoesNotExist:
+    raise Http404("No question found matching the query")
+
+  try:
+    selected_choice = await question.choice_set.aget(pk=request.POST["choice"])
+  except (KeyError, Choice.DoesNotExist):
+    # Re-display the question voting form.
+    return render(
+      request,
+      "polls/detail.html",
+      {
+        "question": question,
+        "choices": [choice async for choice in question.choice_set.all()],
+        "vote_view": "polls:async_vote",
+        "error_message": "You didn't select a choice.",
+      },
+    )
+
+  # Checking the ballot may load the session and the
+  # voter's Bloom filter, which is synchronous work, and a
+  # transaction can only span one thread.
+  if dedupe_enabled():
+    if not await _arecord_ballot_and_vote(
+        request, question.pk, selected_choice.pk):
+      return render(
+        request,
+        "polls/detail.html",
+        {
+          "question": question,
+          "choices": [choice async for choice in question.choice_set.all()],
+          "vote_view": "polls:async_vote",
+          "error_message": ALREADY_VOTED,
+        },
+      )
+  else:
+    # Adding to the vote buffer flushes it to the database
+    # once FLUSH_THRESHOLD votes are pending, which must not
+    # happen on the event loop.
+    vote_buffer = get_vote_buffer()
+
+    if vote_buffer is not None:
+      await sync_to_async(vote_buffer.add)(
+        selected_choice.pk, question_id=question.pk)
+    else:
+      await aincrement_votes(selected_choice.pk, question_id=question.pk)
+
+  return HttpResponseRedirect(
+    reverse("polls:async_results", args=(question.id,)))
+
+# Streams a question's vote tallies as Server-Sent Events,
+# so that the results page can stay up to date without being
+# reloaded. http://127.0.0.1:8000/polls/1/results/stream/
+
+# The first event, "tallies", holds the current totals. After
+# that, "delta" events hold the votes committed since the
+# previous one, coalesced by the tally broker. Every event
+# carries "seq", the tally broker's sequence number of the
+# last vote it counts, and the page ignores deltas with a
+# "seq" no later than the one it has.
+@query_budget(2)
+async def results_stream(request, pk):
+  # Only an ASGI server can hold the connection open without
+  # tying up a worker thread. results.html only opens the
+  # stream under ASGI; anybody else is told, with a 204, not
+  # to reconnect.
+  if not isinstance(request, ASGIRequest):
+    return HttpResponse(status=204)
+
+  try:
+    question = await Question.objects.aget(pk=pk)
+  except Question.DoesNotExist:
+    raise Http404("No question found matching the query")
+
+  # Subscribe before reading the totals so that no vote
+  # committed in between is missed. Votes are published once
+  # committed, so the totals count every vote up to
+  # subscription.since, and the subscription only yields
+  # the ones after it.
+  subscription = tally_broker.subscribe(question.pk)
+
+  try:
+    tallies = {
+      str(choice.pk): choice.total_votes
+      async for choice in question.choice_set.with_vote_totals()
+    }
+  except BaseException:
+    subscription.close()
+    raise
+
+  first_event = "retry: 2000\n" + _server_sent_event("tallies", {
+    "question": question.pk, "seq": subscription.since, "tallies": tallies})
+  events = _tally_events(first_event, subscription)
+
+  response = StreamingHttpResponse(events, content_type="text/event-stream")
+  response["Cache-Control"] = "no-cache"
+  # Stops nginx from buffering the stream.
+  response["X-Accel-Buffering"] = "no"
+  return response
+
+
+def _server_sent_event(event, data):
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _tally_events(first_event, subscription):
+  keepalive = getattr(settings, "POLLS_SSE_KEEPALIVE", 15)
+  max_duration = getattr(settings, "POLLS_SSE_MAX_DURATION", 300)
+
+  loop = asyncio.get_running_loop()
+  deadline = loop.time() + max_duration
+
+  try:
+    yield first_event
+
+    # Streams are closed after max_duration and re-opened by
+    # the browser, so a client that went away without the
+    # server noticing is only held on to for so long.
+    while loop.time() < deadline:
+      try:
+        deltas = await asyncio.wait_for(
+          anext(subscription), min(keepalive, deadline - loop.time()))
+      except asyncio.TimeoutError:
+        # A comment line keeps proxies from closing an
+        # idle connection.
+        yield ": keepalive\n\n"
+      else:
+        yield _server_sent_event("delta", deltas)
+  finally:
+    subscription.close()
+
+# Accepts a batch of votes collected offline, e.g. by
+# kiosk clients, in a single request:
+# POST http://127.0.0.1:8000/polls/api/votes/
+# [{"question_id": 1, "choice_id": 2, "count": 5}, ...]
+class BulkVotePermission(permissions.DjangoModelPermissions):
+  # POST needs polls.add_bulk_votes rather than the add
+  # permission on choices.
+  perms_map = {
+    **permissions.DjangoModelPermissions.perms_map,
+    "POST": ["%(app_label)s.add_bulk_votes"],
+  }
+
+
+class BulkVoteView(APIView):
+  # Each entry carries votes collected from many voters, so
+  # POLLS_ONE_VOTE_PER_VOTER cannot apply to them; only
+  # accounts given the polls.add_bulk_votes permission,
+  # e.g. kiosks' own, may send them.
+  permission_classes = [BulkVotePermission]
+  queryset = Choice.objects.all()
+
+  def post(self, request, format=None):
+    """
+    Validate every entry and apply the valid ones. The ids
+    of the whole batch are checked with one query and the
+    votes are applied in one transaction, so the number of
+    queries stays roughly constant however large the batch.
+    """
+    entries = request.data
+    if not isinstance(entries, list):
+      return Response(
+        {"detail": "Expected a list of votes."},
+        status=status.HTTP_400_BAD_REQUEST)
+
+    max_entries = getattr(settings, "POLLS_BULK_VOTE_MAX_ENTRIES", 10000)
+    if len(entries) > max_entries:
+      return Response(
+        {"detail": f"At most {max_entries} votes can be sent at once."},
+        status=status.HTTP_400_BAD_REQUEST)
+
+    results = []
+    valid = []
+    for index, entry in enumerate(entries):
+      serializer = VoteEntrySerializer(data=entry)
+      if serializer.is_valid():
+        valid.append((index, serializer.validated_data))
+        results.append({"index": index, "status": "ok"})
+      else:
+        results.append(
+          {"index": index, "status": "error", "errors": serializer.errors})
+
+    # choice id -> question id, for the published questions only.
+    choices = dict(Choice.objects.filter(
+      pk__in={entry["choice_id"] for _, entry in valid},
+      question__pub_date__lte=timezone.now(),
+    ).values_list("pk", "question_id"))
+
+    votes = Counter()
+    for index, entry in valid:
+      if choices.get(entry["choice_id"]) != entry["question_id"]:
+        results[index] = {
+          "index": index,
+          "status": "error",
+          "errors": {"choice_id": [
+            "No such choice for this question."]},
+        }
+        continue
+      votes[entry["question_id"], entry["choice_id"]] += entry["count"]
+
+    if votes:
+      increment_many(votes)
+
+    return Response({"accepted": sum(votes.values()), "results": results})
+
 # Handles HTTP responses containing a 404 status code.
 def page_not_found(request, exception=None):
   # send_mail(
@@ -265,6 +627,13 @@ def internal_server_error(request, exception=None):
   # )
   return render(request, "polls/internal_server_error.html")
 
+# Exposes the results cache's hit and miss counts for
+# this process, so that the cache can be sized.
+# http://127.0.0.1:8000/polls/results-cache/
+@staff_member_required
+def results_cache(request):
+  return JsonResponse(results_cache_stats())
+
 def errors(request):
   return render(request, 'polls/errors.html')
 
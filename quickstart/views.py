@@ -1,7 +1,8 @@
 from django.contrib.auth.models import Group, User
 from rest_framework import permissions, viewsets
 
-from tutorial.quickstart.serializers import GroupSerializer, UserSerializer
+from quickstart.serializers import GroupSerializer, UserSerializer
+from snippets.pagination import NewestUserKeysetPagination
 
 # Class-level statements are executed at import
 # time as opposed to when the program enters the
@@ -10,10 +11,22 @@ class UserViewSet(viewsets.ModelViewSet):
 	print('storefront/quickstart/views.py UserViewSet')
 
 	# API endpoint that allows users to be viewed or edited.
-	queryset = User.objects.all().order_by('-date_joined')
+	# UserSerializer links to each user's groups; fetch them
+	# for the whole page in one query instead of one per user.
+	queryset = User.objects.prefetch_related('groups').order_by('-date_joined')
 	serializer_class = UserSerializer
 	permission_classes = [permissions.IsAuthenticated]
 
+	# Pages by id, newest first, rather than with COUNT(*)
+	# and OFFSET (see snippets/pagination.py).
+	pagination_class = NewestUserKeysetPagination
+
+	# The most SQL queries one request may run (see
+	# storefront/query_budget.py), including loading the
+	# logged-in user. Writes, which cascade to whatever the
+	# user owns, have no budget.
+	query_budget = {'GET': 5}
+
 
 class GroupViewSet(viewsets.ModelViewSet):
 	print('storefront/quickstart/views.py GroupViewSet\n')
@@ -21,4 +34,5 @@ class GroupViewSet(viewsets.ModelViewSet):
 	# API endpoint that allows groups to be viewed or edited.
 	queryset = Group.objects.all().order_by('name')
 	serializer_class = GroupSerializer
-	permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+	permission_classes = [permissions.IsAuthenticated]
+	query_budget = {'GET': 4}
\ No newline at end of file
@@ -1,3 +1,33 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 
-# Register your models here.
+from .models import HEAVY_FIELDS, Snippet
+
+
+# The changelist only shows metadata, so it leaves the
+# code and HTML of each snippet out of its query; the
+# change form still loads them.
+class SnippetChangeList(ChangeList):
+  def get_queryset(self, request):
+    return super().get_queryset(request).defer(*HEAVY_FIELDS)
+
+
+class SnippetAdmin(admin.ModelAdmin):
+  list_display = ["title", "owner", "language", "style", "render_state", "created"]
+  list_filter = ["render_state", "language"]
+  list_select_related = ["owner"]
+  search_fields = ["title"]
+
+  # Generated from the code, not edited by hand.
+  readonly_fields = ["highlighted_html", "render_state", "render_digest"]
+  exclude = ["highlighted"]
+
+  @admin.display(description="highlighted")
+  def highlighted_html(self, snippet):
+    return snippet.highlighted_html()
+
+  def get_changelist(self, request, **kwargs):
+    return SnippetChangeList
+
+
+admin.site.register(Snippet, SnippetAdmin)
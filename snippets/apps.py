@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SnippetsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'snippets'
+
+    def ready(self):
+        # Register the system checks, and the signal handlers
+        # that keep the search index up to date.
+        from . import checks, search  # noqa: F401
@@ -0,0 +1,124 @@
+"""
+Saving many snippets at once, for imports.
+
+Saving snippets one at a time runs a transaction, an
+INSERT or UPDATE and a render cache lookup each, and in
+SYNC mode a render each. save_snippets() instead:
+
+* looks all of their renders up in the render cache at
+  once, and renders each distinct miss once;
+* writes them with bulk_create() and bulk_update(), in
+  batches of BATCH_SIZE, in one transaction;
+* adds them to the search index, which is not updated by
+  bulk writes otherwise (see snippets/search.py);
+* adds the revisions of the new snippets and of the
+  changed ones whose revised fields changed, at once (see
+  snippets/revisions.py).
+
+As with Snippet.save(), the misses are rendered inline
+with SNIPPETS_RENDER["SYNC"]. Otherwise they are stored
+as "pending" and, once the transaction commits, rendered
+in parallel by the render pipeline's worker pool, in
+tasks of RENDER_BATCH_SIZE renders, each stored in one
+transaction.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from snippets.highlighting import render_html
+from snippets.html_store import highlighted_column
+from snippets.models import Snippet
+from snippets.render_cache import render_cache
+from snippets.rendering import render_pipeline, render_synchronously
+from snippets.revisions import REVISED_FIELDS, record_revisions
+from snippets.search import index_snippets
+
+BATCH_SIZE = 500
+
+# Renders handed to a worker process, and stored, at once.
+RENDER_BATCH_SIZE = 50
+
+# The fields save_snippets() writes to changed snippets.
+UPDATE_FIELDS = [
+  'title', 'code', 'linenos', 'language', 'style', 'highlighted',
+  'render_state', 'render_digest', 'content_hash', 'modified',
+]
+
+
+def save_snippets(snippets):
+  """
+  Save `snippets`, a list of new (unsaved) and changed
+  Snippets. Returns the list, with the new ones' ids set.
+  """
+  created = [snippet for snippet in snippets if snippet.pk is None]
+  # As with Snippet.save(), loaded snippets that did not
+  # change are not written, and ones whose render inputs did
+  # not change are not rendered again.
+  changed_fields = {
+    snippet.pk: snippet.changed_fields()
+    for snippet in snippets if snippet.pk is not None}
+  changed = [
+    snippet for snippet in snippets
+    if snippet.pk is not None and changed_fields[snippet.pk] != set()]
+
+  revised = [
+    snippet for snippet in changed
+    if changed_fields[snippet.pk] is None
+    or changed_fields[snippet.pk] & set(REVISED_FIELDS)]
+  saved_versions = {
+    snippet.pk: snippet.saved_version() for snippet in revised
+    if snippet.saved_version() is not None}
+
+  inputs = {}
+  to_render = []
+  for snippet in created + changed:
+    rendered_from = snippet.render_digest
+    snippet_inputs = snippet.update_digests()
+    if snippet.pk is None or snippet.render_digest != rendered_from:
+      inputs[snippet.render_digest] = snippet_inputs
+      to_render.append(snippet)
+
+  rendered = render_cache.get_many(inputs)
+  if render_synchronously():
+    misses = {
+      digest: render_html(*inputs[digest])
+      for digest in inputs if digest not in rendered}
+    render_cache.set_many(misses)
+    rendered.update(misses)
+
+  for snippet in to_render:
+    highlighted = rendered.get(snippet.render_digest)
+    if highlighted is None:
+      snippet.highlighted = ''
+      snippet.render_state = Snippet.PENDING
+    else:
+      snippet.highlighted = highlighted_column(
+        snippet.render_digest, highlighted)
+      snippet.render_state = Snippet.READY
+
+  now = timezone.now()
+  for snippet in changed:
+    # bulk_update() does not apply auto_now.
+    snippet.modified = now
+
+  with transaction.atomic():
+    Snippet.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    Snippet.objects.bulk_update(changed, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+    index_snippets(
+      (snippet.pk, snippet.title, snippet.code)
+      for snippet in created + changed)
+    record_revisions(created + revised, saved_versions)
+
+    pending = defaultdict(list)
+    for snippet in to_render:
+      if snippet.render_state == Snippet.PENDING:
+        pending[snippet.render_digest].append(snippet.pk)
+    jobs = [(pks, digest, inputs[digest]) for digest, pks in pending.items()]
+    for start in range(0, len(jobs), RENDER_BATCH_SIZE):
+      transaction.on_commit(
+        lambda batch=jobs[start:start + RENDER_BATCH_SIZE]:
+          render_pipeline.submit_batch(batch))
+
+  return snippets
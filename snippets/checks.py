@@ -0,0 +1,45 @@
+from django.core.checks import Warning, register
+
+from .choices import LANGUAGE_CHOICES, read_manifest, manifest_is_current
+from .detection import get_detection_settings
+
+
+@register()
+def check_pygments_manifest(app_configs, **kwargs):
+  """
+  The snippet language and style choices are read from a
+  manifest made for one Pygments version; with any other,
+  they are rebuilt from Pygments on every start instead.
+  """
+  manifest = read_manifest()
+  if manifest_is_current(manifest):
+    return []
+
+  made_for = "is missing" if manifest is None else \
+    f"was made for Pygments {manifest['pygments']}"
+  return [Warning(
+    f"snippets/pygments_manifest.json {made_for}.",
+    hint="Run \"python manage.py update_pygments_manifest\" to "
+         "regenerate it; until then every start-up lists the "
+         "Pygments lexers and styles itself.",
+    id="snippets.W001",
+  )]
+
+
+@register()
+def check_detection_candidates(app_configs, **kwargs):
+  """
+  Language detection can only pick languages snippets may
+  have."""
+  languages = dict(LANGUAGE_CHOICES)
+  unknown = [
+    language for language in get_detection_settings()["CANDIDATES"]
+    if language not in languages]
+  if not unknown:
+    return []
+  return [Warning(
+    "SNIPPETS_LANGUAGE_DETECTION[\"CANDIDATES\"] names unknown "
+    f"languages: {', '.join(unknown)}.",
+    hint="Use the names of snippets' language choices, such as \"python\".",
+    id="snippets.W002",
+  )]
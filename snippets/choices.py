@@ -0,0 +1,80 @@
+"""
+The language and style choices of Snippet.
+
+Listing them means asking Pygments for every lexer, which
+loads each lexer module's metadata and scans the plugin
+entry points, and takes about half a second. Rather than
+doing that whenever the app is imported, the lists are
+read from pygments_manifest.json, which is generated by
+
+  python manage.py update_pygments_manifest
+
+and records the Pygments version it was made with. If the
+installed version differs, the lists are worked out from
+Pygments as before and the snippets.W001 system check
+says the manifest needs regenerating. It should also be
+regenerated after installing or removing a Pygments plugin.
+"""
+import json
+from pathlib import Path
+
+import pygments
+
+MANIFEST_PATH = Path(__file__).with_name("pygments_manifest.json")
+
+
+def build_manifest():
+  """Work out the choices from the installed Pygments."""
+  from pygments.lexers import get_all_lexers
+  from pygments.styles import get_all_styles
+
+  lexers = [item for item in get_all_lexers() if item[1]]
+  return {
+    "pygments": pygments.__version__,
+    "languages": sorted([item[1][0], item[0]] for item in lexers),
+    "styles": sorted(get_all_styles()),
+  }
+
+
+def read_manifest():
+  """Return the saved manifest, or None if there is none."""
+  try:
+    with open(MANIFEST_PATH) as manifest_file:
+      return json.load(manifest_file)
+  except FileNotFoundError:
+    return None
+
+
+def write_manifest(manifest):
+  # One choice per line, so that upgrades make readable diffs.
+  def items(values):
+    return ",\n".join("    " + json.dumps(value) for value in values)
+
+  with open(MANIFEST_PATH, "w") as manifest_file:
+    manifest_file.write(
+      "{\n"
+      f'  "pygments": {json.dumps(manifest["pygments"])},\n'
+      f'  "languages": [\n{items(manifest["languages"])}\n  ],\n'
+      f'  "styles": [\n{items(manifest["styles"])}\n  ]\n'
+      "}\n")
+
+
+def manifest_is_current(manifest):
+  return manifest is not None and manifest["pygments"] == pygments.__version__
+
+
+def load_choices():
+  """Return (LANGUAGE_CHOICES, STYLE_CHOICES)."""
+  manifest = read_manifest()
+  if not manifest_is_current(manifest):
+    manifest = build_manifest()
+
+  # Tuples, as model field choices are compared with the
+  # ones recorded in migrations.
+  return (
+    [tuple(language) for language in manifest["languages"]],
+    [(style, style) for style in manifest["styles"]],
+  )
+
+
+LANGUAGE_CHOICES, STYLE_CHOICES = load_choices()
@@ -0,0 +1,131 @@
+"""
+Highlighted HTML of long snippets, in ranges of lines.
+
+Unless SNIPPETS_RENDER["STORAGE"] is "files", a render of
+more than SNIPPETS_RENDER["CHUNK_LINES"] lines of code is
+stored as RenderChunk rows rather than in
+Snippet.highlighted, keyed by its render_digest like the
+render cache: chunk 0 holds the HTML before the code, the
+chunks after it CHUNK_LINES lines each, and the last one
+the HTML after the code. /snippets/<pk>/highlighted/ then
+reads only the chunks of the lines asked for with
+?lines=, and streams the whole document a few chunks at a
+time. The render cache's RenderCacheEntry table reads
+such renders back from their chunks too, rather than
+keeping a second copy.
+
+Pygments lexers carry state from line to line (e.g. in a
+string that spans lines), so the code is still tokenized
+in one go; the HTML is cut at line boundaries afterwards
+(see highlighting.split_lines()).
+
+Chunks no snippet refers to any more are deleted by
+
+  python manage.py collect_snippet_html
+"""
+from django.apps import apps
+
+from .highlighting import split_lines
+
+# Chunks read per query when streaming a document.
+STREAM_BATCH_SIZE = 20
+
+
+def _chunk_lines():
+  # Imported here, as snippets.rendering imports this module
+  # through snippets.html_store.
+  from .rendering import get_render_settings
+  return get_render_settings()["CHUNK_LINES"]
+
+
+def _split_long(html, chunk_lines):
+  # split_lines(html), or None if it is not long enough to
+  # be chunked. Counting newlines is cheaper than splitting,
+  # and never gives less.
+  if html.count("\n") <= chunk_lines:
+    return None
+  head, lines, tail = split_lines(html)
+  if len(lines) <= chunk_lines:
+    return None
+  return head, lines, tail
+
+
+def is_long(html):
+  """Whether store_chunks() stores `html` in chunks."""
+  return _split_long(html, _chunk_lines()) is not None
+
+
+def store_chunks(digest, html):
+  """
+  Store `html`, rendered for `digest`, in chunks if it is
+  long enough. Returns whether it is stored in chunks.
+  """
+  chunk_lines = _chunk_lines()
+  split = _split_long(html, chunk_lines)
+  if split is None:
+    return False
+  head, lines, tail = split
+
+  RenderChunk = apps.get_model("snippets", "RenderChunk")
+  if RenderChunk.objects.filter(digest=digest).exists():
+    return True
+
+  chunks = [RenderChunk(digest=digest, number=0, html=head)]
+  for start in range(0, len(lines), chunk_lines):
+    chunk = lines[start:start + chunk_lines]
+    chunks.append(RenderChunk(
+      digest=digest, number=len(chunks), first_line=start + 1,
+      last_line=start + len(chunk), html="".join(chunk)))
+  chunks.append(RenderChunk(digest=digest, number=len(chunks), html=tail))
+  # Another process may be storing the same render.
+  RenderChunk.objects.bulk_create(
+    chunks, batch_size=100, ignore_conflicts=True)
+  return True
+
+
+def read_lines(digest, first_line, last_line):
+  """
+  Return the HTML of lines `first_line` to `last_line` of
+  the render of `digest`, as a list with one item per
+  line; empty if none of them is stored in chunks.
+  """
+  RenderChunk = apps.get_model("snippets", "RenderChunk")
+  chunks = RenderChunk.objects.filter(
+    digest=digest, first_line__lte=last_line, last_line__gte=first_line,
+  ).order_by("number").values_list("first_line", "html")
+
+  lines = []
+  for chunk_first_line, html in chunks:
+    *chunk, last = html.split("\n")
+    chunk = [line + "\n" for line in chunk] + ([last] if last else [])
+    skip = max(first_line - chunk_first_line, 0)
+    lines += chunk[skip:last_line - chunk_first_line + 1]
+  return lines
+
+
+def is_chunked(digest):
+  RenderChunk = apps.get_model("snippets", "RenderChunk")
+  return RenderChunk.objects.filter(digest=digest).exists()
+
+
+def iter_chunks(digest):
+  """
+  Yield the HTML of the chunks of `digest`'s render in
+  order, reading STREAM_BATCH_SIZE of them at a time.
+  """
+  RenderChunk = apps.get_model("snippets", "RenderChunk")
+  number = -1
+  while True:
+    batch = list(RenderChunk.objects.filter(
+      digest=digest, number__gt=number,
+    ).order_by("number").values_list("number", "html")[:STREAM_BATCH_SIZE])
+    for number, html in batch:
+      yield html
+    if len(batch) < STREAM_BATCH_SIZE:
+      return
+
+
+def join_chunks(digest):
+  """The whole HTML of `digest`'s render, or None."""
+  html = "".join(iter_chunks(digest))
+  return html or None
@@ -0,0 +1,186 @@
+"""
+Guessing the language of a snippet's code, for snippets
+created with language "auto".
+
+Pygments' guess_lexer() asks every one of its hundreds of
+lexers to rate the code, and only by their analyse_text()
+heuristics, which most lexers do not have. Here only the
+CANDIDATES of SNIPPETS_LANGUAGE_DETECTION in
+storefront/settings.py are tried, most common first: each
+tokenizes the first SAMPLE_SIZE characters of the code and
+is scored by what it recognised in them (see
+TOKEN_WEIGHTS) and by its analyse_text(). Once TIME_BUDGET
+seconds have gone, the rest are skipped and the best so far
+wins. JSON is recognised by parsing it.
+
+Guesses are remembered by the hash of the code, for up to
+MEMO_ENTRIES snippets per process, so saving the same
+code again costs nothing.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from pygments.lexers import get_lexer_by_name
+from pygments.token import Token
+
+from .highlighting import PLAIN_LANGUAGE
+
+# The language value that asks for a guess.
+AUTO_LANGUAGE = 'auto'
+
+# Default values used when SNIPPETS_LANGUAGE_DETECTION in
+# storefront/settings.py leaves a key out. The budget is
+# only checked between candidates, so lexers that can take
+# minutes over unlucky text are left out: Perl's does over
+# some Markdown.
+DEFAULTS = {
+  'CANDIDATES': [
+    'python', 'javascript', 'typescript', 'java', 'c', 'cpp', 'csharp',
+    'go', 'rust', 'php', 'ruby', 'bash', 'sql', 'html', 'xml', 'css',
+    'yaml', 'json', 'markdown', 'toml', 'ini',
+  ],
+  'TIME_BUDGET': 0.1,
+  'SAMPLE_SIZE': 2048,
+  'MEMO_ENTRIES': 1024,
+}
+
+# Points per character of each kind of token. Keywords and
+# builtins tell languages apart best; a lexer that fails to
+# make sense of the code says so with Error tokens. Names,
+# punctuation and plain text are in every language.
+TOKEN_WEIGHTS = [
+  (Token.Error, -5),
+  (Token.Keyword, 3),
+  (Token.Generic.Heading, 3),
+  (Token.Generic.Subheading, 3),
+  (Token.Name.Builtin, 2),
+  (Token.Comment.Preproc, 2),
+  (Token.Name.Decorator, 1),
+  (Token.Name.Tag, 0.5),
+  (Token.Comment, 0.5),
+  (Token.Literal.String, 0.2),
+]
+
+# How much a lexer's analyse_text(), from 0 to 1, counts.
+ANALYSE_TEXT_WEIGHT = 2
+
+# A candidate must beat the best one before it by this
+# factor, so that near ties go to the more common language,
+# e.g. JavaScript rather than TypeScript.
+MARGIN = 1.1
+
+# Below this score nothing was recognised; the code is
+# shown as plain text.
+MINIMUM_SCORE = 0.05
+
+
+def get_detection_settings():
+  """
+  Return the SNIPPETS_LANGUAGE_DETECTION settings merged
+  on top of the defaults."""
+  return {**DEFAULTS, **getattr(settings, 'SNIPPETS_LANGUAGE_DETECTION', {})}
+
+
+@lru_cache(maxsize=None)
+def _lexer(language):
+  return get_lexer_by_name(language)
+
+
+@lru_cache(maxsize=None)
+def _token_weight(token_type):
+  for kind, weight in TOKEN_WEIGHTS:
+    if token_type in kind:
+      return weight
+  return 0
+
+
+def score(lexer, sample):
+  """How much `sample` looks like code for `lexer`."""
+  points = sum(
+    _token_weight(token_type) * len(value)
+    for token_type, value in lexer.get_tokens(sample))
+  return (points / max(len(sample), 1)
+          + ANALYSE_TEXT_WEIGHT * lexer.analyse_text(sample))
+
+
+def _is_json(code):
+  if not code.lstrip().startswith(('{', '[')):
+    return False
+  try:
+    json.loads(code)
+  except ValueError:
+    return False
+  return True
+
+
+def guess_language(code, candidates, time_budget, sample_size):
+  """
+  Return the language of `candidates` that `code` looks
+  most like, trying them in order until `time_budget`
+  seconds have gone, or "text" if none fits.
+  """
+  if 'json' in candidates and _is_json(code):
+    return 'json'
+
+  sample = code[:sample_size]
+  if len(code) > sample_size and '\n' in sample:
+    # Whole lines, so that the last token is not cut.
+    sample = sample[:sample.rindex('\n') + 1]
+
+  # Loading the lexers' modules takes longer than the
+  # budget, the first time; it is not counted.
+  lexers = [(language, _lexer(language)) for language in candidates]
+
+  deadline = time.perf_counter() + time_budget
+  best, best_score = PLAIN_LANGUAGE, MINIMUM_SCORE
+  for language, lexer in lexers:
+    language_score = score(lexer, sample)
+    if language_score > best_score * MARGIN:
+      best, best_score = language, language_score
+    if time.perf_counter() > deadline:
+      break
+  return best
+
+
+class LanguageDetector:
+  """
+  guess_language() with the settings, and the guesses
+  remembered as described in the module docstring.
+  """
+
+  def __init__(self):
+    self._memo = OrderedDict()
+    self._lock = threading.Lock()
+
+  def detect(self, code):
+    config = get_detection_settings()
+    candidates = tuple(config['CANDIDATES'])
+    key = (hashlib.sha256(code.encode()).hexdigest(), candidates)
+
+    with self._lock:
+      language = self._memo.get(key)
+      if language is not None:
+        self._memo.move_to_end(key)
+        return language
+
+    language = guess_language(
+      code, candidates, config['TIME_BUDGET'], config['SAMPLE_SIZE'])
+
+    with self._lock:
+      self._memo[key] = language
+      while len(self._memo) > config['MEMO_ENTRIES']:
+        self._memo.popitem(last=False)
+    return language
+
+  def clear(self):
+    with self._lock:
+      self._memo.clear()
+
+
+# The detector used by SnippetSerializer.
+language_detector = LanguageDetector()
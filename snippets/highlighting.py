@@ -0,0 +1,113 @@
+"""
+Rendering of code snippets to highlighted HTML.
+
+Nothing in this module uses Django, so that it can be
+imported by the worker processes of the render pipeline
+(see snippets/rendering.py) without setting Django up.
+"""
+import hashlib
+import json
+import traceback
+from functools import lru_cache
+
+from pygments import highlight
+from pygments.formatters.html import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+
+
+# The CSS class of the element wrapping a fragment, which
+# the rules of style_css() are scoped to.
+CSS_CLASS = 'highlight'
+
+# The lexer of code too long to highlight, which only
+# escapes it (see SNIPPETS_RENDER["HIGHLIGHT_LINES"]).
+PLAIN_LANGUAGE = 'text'
+
+# What HtmlFormatter starts the block of code with, in
+# documents and fragments and with or without line numbers.
+_CODE_START = '<pre><span></span>'
+
+
+def render_digest(code, language, style, linenos, title, full=True):
+  """
+  Return a hash of everything the highlighted HTML of a
+  snippet depends on."""
+  inputs = [code, language, style, bool(linenos), title]
+  if not full:
+    inputs.append('fragment')
+  return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+
+def render_html(code, language, style, linenos, title, full=True):
+  """
+  Use the `pygments` library to create a highlighted
+  HTML representation of a code snippet.
+
+  With `full`, the result is a complete HTML document that
+  embeds the CSS of the style. Otherwise it is only the
+  highlighted code, a fragment to be shown with the
+  stylesheet from style_css(), and `title` is not used.
+  """
+  lexer = get_lexer_by_name(language)
+  linenos = 'table' if linenos else False
+  options = {'title': title} if title and full else {}
+  formatter = HtmlFormatter(style=style, linenos=linenos,
+                            full=full, cssclass=CSS_CLASS, **options)
+  return highlight(code, lexer, formatter)
+
+
+def render_many(inputs):
+  """
+  Render several snippets, given a list of the arguments
+  of render_html() for each. Returns a list of (HTML, None)
+  for those rendered, and (None, traceback) for the others,
+  so that one failure does not lose the other renders.
+  """
+  results = []
+  for snippet_inputs in inputs:
+    try:
+      results.append((render_html(*snippet_inputs), None))
+    except Exception:
+      results.append((None, traceback.format_exc()))
+  return results
+
+
+def split_lines(html):
+  """
+  Split HTML from render_html() into the part before the
+  code, a list of the HTML of each line of code, and the
+  part after it; together they are `html` again.
+
+  HtmlFormatter closes the spans open at the end of each
+  line and opens them again on the next, so every line is
+  well-formed on its own. Lines are split at "\\n" only,
+  as the formatter does.
+  """
+  start = html.index(_CODE_START) + len(_CODE_START)
+  end = html.index('</pre>', start)
+  lines = [line + '\n' for line in html[start:end].split('\n')]
+  # The code ends with a newline, which is not a line.
+  lines[-1] = lines[-1][:-1]
+  if not lines[-1]:
+    lines.pop()
+  return html[:start], lines, html[end:]
+
+
+def render_window(lines, first_line, linenos):
+  """
+  Wrap lines from split_lines(), the first of them being
+  line `first_line` of the code, in a fragment to be shown
+  with the stylesheet from style_css().
+  """
+  if linenos:
+    width = len(str(first_line + len(lines) - 1))
+    lines = [
+      f'<span class="linenos">{number:>{width}}</span>{line}'
+      for number, line in enumerate(lines, first_line)]
+  return f'<div class="{CSS_CLASS}">{_CODE_START}{"".join(lines)}</pre></div>\n'
+
+
+@lru_cache(maxsize=None)
+def style_css(style):
+  """The stylesheet for fragments rendered in `style`."""
+  return HtmlFormatter(style=style).get_style_defs('.' + CSS_CLASS)
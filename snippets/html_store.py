@@ -0,0 +1,128 @@
+"""
+A content-addressed store of highlighted snippet HTML on
+disk.
+
+With SNIPPETS_RENDER["STORAGE"] set to "files", the HTML of
+each render is written to a file named by its render
+digest under SNIPPETS_RENDER["FILE_ROOT"], and rows keep
+only the digest: Snippet.highlighted is left empty, and
+the file store takes the place of the render cache's
+RenderCacheEntry table. Large documents then stay out of
+db.sqlite3 and its page cache, and /snippets/<pk>/highlighted/
+hands the file to the server with FileResponse instead of
+reading it into a string.
+
+A file is shared by every snippet with its digest. It is
+written whole, under a temporary name that is then
+renamed, and never changed afterwards; files no snippet
+refers to any more are deleted by
+
+  python manage.py collect_snippet_html
+
+Rows stored before STORAGE was changed are moved between
+the database and the files by
+
+  python manage.py move_snippet_html --to files
+"""
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from .chunks import store_chunks
+
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class FileStore:
+  def __init__(self, root):
+    self.root = Path(root)
+
+  def path(self, digest):
+    # Digests come from the database; never let one name a
+    # path outside the root.
+    if not DIGEST_PATTERN.fullmatch(digest):
+      raise ValueError(f'Not a render digest: {digest!r}')
+    # Spread over 256 directories, to keep each one small.
+    return self.root / digest[:2] / f'{digest}.html'
+
+  def exists(self, digest):
+    return self.path(digest).exists()
+
+  def read(self, digest):
+    """Return the HTML stored for `digest`, or None."""
+    try:
+      return self.path(digest).read_text(encoding='utf-8')
+    except FileNotFoundError:
+      return None
+
+  def open(self, digest):
+    """Open the file of `digest` for reading, in binary."""
+    return open(self.path(digest), 'rb')
+
+  def write(self, digest, html):
+    """Store `html` for `digest`, unless it already is."""
+    path = self.path(digest)
+    if path.exists():
+      return
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Readers never see a partly written file.
+    fd, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'w', encoding='utf-8') as html_file:
+        html_file.write(html)
+      os.replace(temporary, path)
+    except BaseException:
+      os.unlink(temporary)
+      raise
+
+  def delete(self, digest):
+    try:
+      self.path(digest).unlink()
+    except FileNotFoundError:
+      pass
+
+  def files(self):
+    """Yield (digest, path) for every stored file."""
+    for path in self.root.glob('??/*.html'):
+      if DIGEST_PATTERN.fullmatch(path.stem):
+        yield path.stem, path
+
+
+def _render_settings():
+  # Imported here, as snippets.rendering imports this module.
+  from .rendering import get_render_settings
+  return get_render_settings()
+
+
+def stores_files():
+  """Whether new renders are written to the file store."""
+  return _render_settings()['STORAGE'] == 'files'
+
+
+def get_file_store():
+  """
+  The file store under SNIPPETS_RENDER["FILE_ROOT"]. It is
+  read from whatever STORAGE is, as rows stored while it
+  was "files" refer to it."""
+  root = _render_settings()['FILE_ROOT'] \
+    or Path(settings.BASE_DIR) / 'snippet_html'
+  return FileStore(root)
+
+
+def highlighted_column(digest, html):
+  """
+  Return the value of Snippet.highlighted for `html`,
+  rendered for `digest`: the HTML itself, or nothing once
+  it is in its file (with files storage) or, otherwise, in
+  chunks (if it is long; see snippets/chunks.py).
+  """
+  if stores_files():
+    # The render cache writes most renders to the store
+    # already; this is cheap if so. ?lines= reads the file.
+    get_file_store().write(digest, html)
+    return ''
+  return '' if store_chunks(digest, html) else html
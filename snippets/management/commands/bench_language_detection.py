@@ -0,0 +1,173 @@
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from pygments.lexers import guess_lexer
+from pygments.util import ClassNotFound
+
+from snippets.detection import (
+  LanguageDetector, get_detection_settings, guess_language)
+
+# The language of the corpus files, by extension.
+EXTENSIONS = {
+  ".py": "python",
+  ".js": "javascript",
+  ".c": "c",
+  ".cpp": "cpp",
+  ".hpp": "cpp",
+  ".pl": "perl",
+  ".pm": "perl",
+  ".sh": "bash",
+  ".html": "html",
+  ".xml": "xml",
+  ".css": "css",
+  ".json": "json",
+  ".md": "markdown",
+  ".toml": "toml",
+  ".yaml": "yaml",
+  ".yml": "yaml",
+  ".sql": "sql",
+  ".rb": "ruby",
+  ".go": "go",
+  ".rs": "rust",
+  ".java": "java",
+  ".php": "php",
+}
+
+# Where source files in those languages usually are.
+DEFAULT_CORPUS = [
+  Path(sys.prefix) / "lib", Path("/usr/include"), Path("/usr/share"),
+  Path("/usr/lib"), Path("/etc"),
+]
+
+
+class Command(BaseCommand):
+  help = (
+    "Report the accuracy and latency of guessing the language of "
+    "snippets (language \"auto\") on a corpus of files whose language "
+    "is known from their extension, next to Pygments' guess_lexer()."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--corpus", type=Path, action="append",
+      help="A directory of source files; repeat for several. Defaults to "
+           "the Python installation and system directories.")
+    parser.add_argument(
+      "--per-language", type=int, default=20,
+      help="Files picked at random per language.")
+    parser.add_argument(
+      "--max-size", type=int, default=200000,
+      help="Largest file included, in bytes.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+      "--time-budget", type=float,
+      help="Seconds per guess, instead of the TIME_BUDGET setting.")
+    parser.add_argument(
+      "--sample-size", type=int,
+      help="Characters per guess, instead of the SAMPLE_SIZE setting.")
+
+  def handle(self, *args, **options):
+    corpus = self.corpus(
+      options["corpus"] or DEFAULT_CORPUS, options["per_language"],
+      options["max_size"], options["seed"])
+    config = get_detection_settings()
+    if options["time_budget"] is not None:
+      config["TIME_BUDGET"] = options["time_budget"]
+    if options["sample_size"] is not None:
+      config["SAMPLE_SIZE"] = options["sample_size"]
+    candidates = config["CANDIDATES"]
+
+    # Imports the lexers, which only the first guess of a
+    # process pays for.
+    guess_language("", candidates, config["TIME_BUDGET"], config["SAMPLE_SIZE"])
+    guess_lexer("x")
+
+    correct = defaultdict(lambda: [0, 0])
+    latencies = {"detection": [], "guess_lexer": []}
+    confusions = defaultdict(int)
+    for language, code in corpus:
+      started = time.perf_counter()
+      guess = guess_language(
+        code, candidates, config["TIME_BUDGET"], config["SAMPLE_SIZE"])
+      latencies["detection"].append(time.perf_counter() - started)
+      correct[language][0] += guess == language
+      if guess != language:
+        confusions[language, guess] += 1
+
+      started = time.perf_counter()
+      try:
+        aliases = guess_lexer(code).aliases
+      except ClassNotFound:
+        aliases = []
+      latencies["guess_lexer"].append(time.perf_counter() - started)
+      correct[language][1] += language in aliases
+
+    counts = defaultdict(int)
+    for language, _ in corpus:
+      counts[language] += 1
+
+    self.stdout.write(
+      f"{len(corpus)} files, up to {options['per_language']} per language, "
+      f"{len(candidates)} candidates, budget {config['TIME_BUDGET'] * 1000:.0f} "
+      f"ms, sample {config['SAMPLE_SIZE']} characters\n")
+    self.stdout.write(f"{'language':<12} {'files':>6} {'detection':>10} {'guess_lexer':>12}")
+    for language in sorted(counts):
+      ours, theirs = correct[language]
+      self.stdout.write(
+        f"{language:<12} {counts[language]:>6} {ours:>10} {theirs:>12}")
+    ours = sum(right for right, _ in correct.values())
+    theirs = sum(right for _, right in correct.values())
+    self.stdout.write(
+      f"{'accuracy':<12} {'':>6} {ours / len(corpus):>10.0%} "
+      f"{theirs / len(corpus):>12.0%}\n")
+
+    for name, times in latencies.items():
+      times = sorted(times)
+      self.stdout.write(
+        f"{name:<12} median {statistics.median(times) * 1000:6.1f} ms, "
+        f"p95 {times[int(len(times) * 0.95)] * 1000:6.1f} ms, "
+        f"max {times[-1] * 1000:6.1f} ms")
+    self.stdout.write(
+      f"{'memo hit':<12} median {self.memo_hit(corpus) * 1e6:6.1f} µs\n")
+
+    self.stdout.write("Most common mistakes:")
+    for (language, guess), count in sorted(
+        confusions.items(), key=lambda item: -item[1])[:10]:
+      self.stdout.write(f"  {language} taken for {guess}: {count}")
+
+  def corpus(self, roots, per_language, max_size, seed):
+    """(language, code) for files picked from `roots`."""
+    files = defaultdict(list)
+    for root in roots:
+      for path in root.rglob("*"):
+        language = EXTENSIONS.get(path.suffix)
+        if language is None or not path.is_file():
+          continue
+        if 0 < path.stat().st_size <= max_size:
+          files[language].append(path)
+
+    picker = random.Random(seed)
+    corpus = []
+    for language, paths in sorted(files.items()):
+      paths.sort()
+      for path in picker.sample(paths, min(per_language, len(paths))):
+        try:
+          corpus.append((language, path.read_text(encoding="utf-8")))
+        except (UnicodeDecodeError, OSError):
+          pass
+    return corpus
+
+  def memo_hit(self, corpus):
+    detector = LanguageDetector()
+    times = []
+    for _, code in corpus:
+      detector.detect(code)
+      started = time.perf_counter()
+      detector.detect(code)
+      times.append(time.perf_counter() - started)
+    return statistics.median(times)
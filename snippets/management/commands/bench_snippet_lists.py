@@ -0,0 +1,125 @@
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from polls.management.commands._bench import scratch_database
+from snippets.highlighting import render_html
+from snippets.models import Snippet
+from snippets.pagination import KeysetPagination
+from snippets.views import SnippetList
+
+# The ?expand= values compared, from the default listing
+# to the one that loads every heavy column.
+EXPANSIONS = ["", "code", "code,highlighted"]
+
+KB = 1024
+MB = 1024 * KB
+
+
+class Command(BaseCommand):
+  help = (
+    "Measure the memory, column bytes and latency of a page of the "
+    "snippets list with and without the heavy columns. Runs against "
+    "a scratch database, never db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--rows", type=int, default=20, help="Snippets to create.")
+    parser.add_argument(
+      "--size", type=float, default=10,
+      help="Megabytes of code in each snippet.")
+    parser.add_argument(
+      "--page-size", type=int, default=KeysetPagination.page_size,
+      help="Snippets per page.")
+    parser.add_argument(
+      "--repeat", type=int, default=5, help="Requests timed per listing.")
+
+  def handle(self, *args, **options):
+    self.repeat = options["repeat"]
+    self.page_size = page_size = options["page_size"]
+
+    with scratch_database():
+      owner = User.objects.create_user("bench")
+
+      # Highlighting megabytes of code takes Pygments a long
+      # time, so a small block is rendered once and repeated
+      # up to the size asked for. The rows are the same size
+      # as real renders would be, which is what is measured.
+      block = "".join(
+        f"def function_{n}(value):\n    return value * {n}\n\n"
+        for n in range(100))
+      copies = max(1, int(options["size"] * MB) // len(block))
+      code = block * copies
+      highlighted = render_html(block, "python", "friendly", False, "") * copies
+      # One row per INSERT, as several would exceed SQLite's
+      # statement size limit.
+      Snippet.objects.bulk_create(
+        (Snippet(owner=owner, title=f"Snippet {n}", code=code,
+                 highlighted=highlighted, render_state=Snippet.READY)
+         for n in range(options["rows"])),
+        batch_size=1)
+
+      self.factory = APIRequestFactory()
+      self.view = SnippetList.as_view()
+
+      self.stdout.write(
+        f"{options['rows']} snippets of {len(code) / MB:.1f} MB code and "
+        f"{len(highlighted) / MB:.1f} MB HTML, first page of {page_size}, "
+        f"median of {self.repeat} requests\n")
+      self.stdout.write(
+        f"{'expand':<18} {'column KB':>10} {'response KB':>12} "
+        f"{'peak KB':>10} {'ms':>8}")
+
+      for expand in EXPANSIONS:
+        read = self.column_bytes(expand, page_size)
+        response_size, peak = self.measure_memory(expand)
+        latency = self.time(expand)
+        self.stdout.write(
+          f"{expand or '(none)':<18} {read / KB:>10,.1f} "
+          f"{response_size / KB:>12,.1f} {peak / KB:>10,.1f} {latency:>8.2f}")
+
+  def query(self, expand):
+    query = {"page_size": self.page_size}
+    if expand:
+      query["expand"] = expand
+    return query
+
+  def column_bytes(self, expand, page_size):
+    """
+    The size of the column values the page's query loads,
+    which is what the database hands over for it."""
+    expand = [name for name in expand.split(",") if name]
+    snippets = Snippet.objects.summaries(expand).order_by(
+      "created", "id")[:page_size]
+    attnames = {field.attname for field in Snippet._meta.concrete_fields}
+    return sum(
+      len(str(value))
+      for snippet in snippets
+      for name, value in vars(snippet).items() if name in attnames)
+
+  def measure_memory(self, expand):
+    """The response size and peak memory of one request."""
+    tracemalloc.start()
+    try:
+      response = self.view(self.factory.get("/snippets/", self.query(expand)))
+      response.render()
+      _, peak = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+    assert response.status_code == 200, response.data
+    return len(response.content), peak
+
+  def time(self, expand):
+    latencies = []
+    for _ in range(self.repeat):
+      request = self.factory.get("/snippets/", self.query(expand))
+      started = time.perf_counter()
+      response = self.view(request)
+      response.render()
+      latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000
@@ -0,0 +1,93 @@
+import statistics
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIRequestFactory
+
+from polls.management.commands._bench import scratch_database
+from snippets.highlighting import render_html
+from snippets.models import Snippet
+from snippets.pagination import KeysetPagination
+from snippets.views import SnippetList
+
+
+class Command(BaseCommand):
+  help = (
+    "Compare the latency of deep pages of the snippets list with "
+    "page number and keyset pagination. Runs against a scratch "
+    "database, never db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--rows", type=int, default=20000, help="Snippets to create.")
+    parser.add_argument(
+      "--pages", default="1,100,1000",
+      help="Comma separated page numbers to time.")
+    parser.add_argument(
+      "--repeat", type=int, default=20, help="Requests timed per page.")
+    parser.add_argument(
+      "--lines", type=int, default=60,
+      help="Lines of code in each snippet, which sets the row size.")
+
+  def handle(self, *args, **options):
+    pages = [int(page) for page in options["pages"].split(",")]
+    self.repeat = options["repeat"]
+    page_size = KeysetPagination.page_size
+
+    with scratch_database():
+      owner = User.objects.create_user("bench")
+
+      # bulk_create() skips Snippet.save(), so every row gets
+      # the same code and HTML, rendered once.
+      code = "".join(
+        f"def function_{n}(value):\n    return value * {n}\n\n"
+        for n in range(options["lines"] // 3))
+      highlighted = render_html(code, "python", "friendly", False, "")
+      Snippet.objects.bulk_create(
+        (Snippet(owner=owner, title=f"Snippet {n}", code=code,
+                 highlighted=highlighted, render_state=Snippet.READY)
+         for n in range(options["rows"])),
+        batch_size=1000)
+
+      self.factory = APIRequestFactory()
+      page_number_view = SnippetList.as_view(
+        pagination_class=PageNumberPagination)
+      keyset_view = SnippetList.as_view()
+
+      self.stdout.write(
+        f"{options['rows']} snippets, {page_size} per page, "
+        f"median of {self.repeat} requests\n")
+      self.stdout.write(f"{'page':>6} {'page number ms':>15} {'keyset ms':>10}")
+
+      for page in pages:
+        before = self.time(page_number_view, {"page": page})
+        after = self.time(keyset_view, self.keyset_query(page, page_size))
+        self.stdout.write(f"{page:>6} {before:>15.2f} {after:>10.2f}")
+
+  def keyset_query(self, page, page_size):
+    """The query string of the keyset link to `page`."""
+    if page == 1:
+      return {}
+    # The last snippet of the previous page.
+    last = Snippet.objects.order_by("created", "id")[
+      (page - 1) * page_size - 1]
+
+    paginator = KeysetPagination()
+    paginator.request = self.factory.get("/snippets/")
+    link = paginator.encode_cursor("next", last)
+    return {"cursor": parse_qs(urlsplit(link).query)["cursor"][0]}
+
+  def time(self, view, query):
+    latencies = []
+    for _ in range(self.repeat):
+      request = self.factory.get("/snippets/", query)
+      started = time.perf_counter()
+      response = view(request)
+      response.render()
+      latencies.append(time.perf_counter() - started)
+      assert response.status_code == 200, response.data
+    return statistics.median(latencies) * 1000
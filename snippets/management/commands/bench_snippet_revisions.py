@@ -0,0 +1,119 @@
+import random
+import statistics
+import textwrap
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from polls.management.commands._bench import percentile, scratch_database
+from snippets.models import Snippet, SnippetRevision, content_digest
+from snippets.revisions import record_revisions, revision_code
+
+KB = 1024
+
+
+class Command(BaseCommand):
+  help = (
+    "Report the storage taken by a snippet's revision history, and "
+    "the time taken to record and to rebuild its revisions, for several "
+    "checkpoint intervals, over a series of random edits to a source "
+    "file. Runs against a scratch database, never db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--edits", type=int, default=1000, help="Edits made to the snippet.")
+    parser.add_argument(
+      "--source", type=Path, default=Path(textwrap.__file__),
+      help="The snippet's first version. Defaults to textwrap.py.")
+    parser.add_argument(
+      "--intervals", default="1,10,25,50,100",
+      help="Comma-separated CHECKPOINT_INTERVAL values; 1 stores every "
+           "revision whole.")
+    parser.add_argument("--seed", type=int, default=1)
+
+  def handle(self, *args, **options):
+    versions = self.versions(
+      options["source"].read_text(encoding="utf-8"), options["edits"],
+      options["seed"])
+    copies = sum(len(code.encode()) for code in versions)
+
+    self.stdout.write(
+      f"{len(versions)} versions of {options['source'].name}, "
+      f"{len(versions[0].encode()) / KB:,.1f} KB at first; "
+      f"full copies take {copies / KB:,.1f} KB\n")
+    self.stdout.write(
+      f"{'interval':>8} {'stored KB':>10} {'of copies':>10} "
+      f"{'record ms':>10} {'rebuild ms':>11} {'p95':>7} {'max':>7}")
+
+    with scratch_database():
+      owner = User.objects.create_user("bench")
+      for interval in [int(value) for value in options["intervals"].split(",")]:
+        revision_settings = {"CHECKPOINT_INTERVAL": interval}
+        with override_settings(SNIPPETS_REVISIONS=revision_settings):
+          record, stored, rebuild = self.measure(owner, versions)
+        self.stdout.write(
+          f"{interval:>8} {stored / KB:>10,.1f} {stored / copies:>10.1%} "
+          f"{statistics.median(record) * 1000:>10.2f} "
+          f"{statistics.median(rebuild) * 1000:>11.2f} "
+          f"{percentile(rebuild, 0.95) * 1000:>7.2f} "
+          f"{max(rebuild) * 1000:>7.2f}")
+
+  def measure(self, owner, versions):
+    """
+    Record `versions` as the revisions of a new snippet.
+    Returns the seconds taken to record each, the bytes
+    stored, and the seconds taken to rebuild each."""
+    # Neither rendered nor given a revision.
+    [snippet] = Snippet.objects.bulk_create([Snippet(
+      owner=owner, code=versions[0], render_state=Snippet.READY)])
+
+    record = []
+    saved_version = None
+    for code in versions:
+      snippet.code = code
+      snippet.content_hash = content_digest(
+        snippet.title, code, snippet.linenos, snippet.language, snippet.style)
+      started = time.perf_counter()
+      record_revisions(
+        [snippet], {snippet.pk: saved_version} if saved_version else None)
+      record.append(time.perf_counter() - started)
+      saved_version = snippet.content_hash, code
+
+    stored = sum(
+      len(data) for data in
+      SnippetRevision.objects.filter(snippet=snippet).values_list(
+        "data", flat=True))
+
+    rebuild = []
+    for number, code in enumerate(versions, 1):
+      started = time.perf_counter()
+      rebuilt = revision_code(snippet.pk, number)
+      rebuild.append(time.perf_counter() - started)
+      assert rebuilt == code, f"revision {number} was not rebuilt"
+    snippet.delete()
+    return record, stored, rebuild
+
+  def versions(self, code, edits, seed):
+    """
+    `code` and `edits` versions after it, each changing,
+    adding or removing one to three lines of the one before.
+    """
+    picker = random.Random(seed)
+    versions = [code]
+    lines = code.splitlines(keepends=True)
+    for edit in range(edits):
+      for _ in range(picker.randint(1, 3)):
+        position = picker.randrange(len(lines))
+        action = picker.random()
+        if action < 0.6:
+          lines[position] = lines[position].rstrip("\n") + f"  # edit {edit}\n"
+        elif action < 0.85 or len(lines) < 10:
+          lines.insert(position, f"    step_{edit} = step_{edit - 1} + 1\n")
+        else:
+          del lines[position]
+      versions.append("".join(lines))
+    return versions
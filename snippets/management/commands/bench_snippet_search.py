@@ -0,0 +1,87 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from polls.management.commands._bench import scratch_database
+from snippets.models import Snippet
+from snippets.search import search_snippets
+
+# Searched words, from one found in every snippet to one
+# found in none; --rows sets how many snippets each is in.
+QUERIES = ["render", "topic_042", "marker_54321", "zebra"]
+
+
+class Command(BaseCommand):
+  help = (
+    "Compare the latency of a page of search results from the "
+    "full-text index with a code__icontains filter. Runs against a "
+    "scratch database, never db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--rows", type=int, default=100000, help="Snippets to create.")
+    parser.add_argument(
+      "--repeat", type=int, default=10, help="Searches timed per query.")
+    parser.add_argument(
+      "--page-size", type=int, default=10, help="Results per search.")
+
+  def handle(self, *args, **options):
+    self.repeat = options["repeat"]
+    page_size = options["page_size"]
+
+    with scratch_database():
+      owner = User.objects.create_user("bench")
+
+      # bulk_create() skips the index, which is then built
+      # the way rebuild_snippet_search does it.
+      Snippet.objects.bulk_create(
+        (Snippet(owner=owner, title=f"Snippet {n}", code=self.code(n),
+                 render_state=Snippet.READY)
+         for n in range(options["rows"])),
+        batch_size=1000)
+      started = time.perf_counter()
+      call_command("rebuild_snippet_search", stdout=self.stdout)
+      self.stdout.write(
+        f"Indexing took {time.perf_counter() - started:.1f} s.\n")
+
+      self.stdout.write(
+        f"{options['rows']} snippets, first {page_size} results, "
+        f"median of {self.repeat} searches\n")
+      self.stdout.write(
+        f"{'query':<14} {'matches':>8} {'icontains ms':>13} {'fts5 ms':>8}")
+
+      for query in QUERIES:
+        matches = Snippet.objects.filter(code__icontains=query).count()
+        before = self.time(lambda: list(
+          Snippet.objects.summaries().filter(code__icontains=query)
+          .order_by("created", "id")[:page_size]))
+        after = self.time(
+          lambda: search_snippets(query, limit=page_size))
+        self.stdout.write(
+          f"{query:<14} {matches:>8} {before:>13.2f} {after:>8.2f}")
+
+  def code(self, n):
+    """About 1 KB of code, with the words of QUERIES in it."""
+    lines = [
+      f"def view_{n}(request):",
+      f"    # topic_{n % 1000:03d}, marker_{n}",
+      "    context = {",
+    ]
+    lines += [f"        'field_{i}': request.GET.get('field_{i}')," for i in range(12)]
+    lines += [
+      "    }",
+      "    return render(request, 'template.html', context)",
+    ]
+    return "\n".join(lines) + "\n"
+
+  def time(self, search):
+    latencies = []
+    for _ in range(self.repeat):
+      started = time.perf_counter()
+      search()
+      latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000
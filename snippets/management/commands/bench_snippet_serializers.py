@@ -0,0 +1,77 @@
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from polls.management.commands._bench import scratch_database
+from snippets.models import Snippet
+from snippets.serializers import SnippetRowSerializer, SnippetSummarySerializer
+
+KB = 1024
+
+
+class Command(BaseCommand):
+  help = (
+    "Compare the CPU time and peak memory of listing snippets with "
+    "SnippetSummarySerializer(many=True) and with SnippetRowSerializer "
+    "over .values() rows. Runs against a scratch database, never "
+    "db.sqlite3."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--rows", type=int, default=10000, help="Snippets to create and list.")
+    parser.add_argument(
+      "--repeat", type=int, default=5, help="Listings timed per serializer.")
+
+  def handle(self, *args, **options):
+    self.repeat = options["repeat"]
+
+    with scratch_database():
+      owner = User.objects.create_user("bench")
+      Snippet.objects.bulk_create(
+        (Snippet(owner=owner, title=f"Snippet {n}", code=f"print({n})\n",
+                 linenos=n % 2 == 0, render_state=Snippet.READY)
+         for n in range(options["rows"])),
+        batch_size=1000)
+
+      row_serializer = SnippetRowSerializer()
+      listings = {
+        "serializer": lambda: SnippetSummarySerializer(
+          Snippet.objects.summaries(), many=True).data,
+        "rows": lambda: row_serializer.to_representation(
+          Snippet.objects.values(*row_serializer.value_fields)),
+      }
+
+      renderer = JSONRenderer()
+      outputs = {name: renderer.render(list_()) for name, list_ in listings.items()}
+      assert outputs["rows"] == outputs["serializer"]
+
+      self.stdout.write(
+        f"{options['rows']} snippets, fetched and serialized, "
+        f"median of {self.repeat} listings\n")
+      self.stdout.write(f"{'path':<12} {'cpu ms':>9} {'peak KB':>10}")
+      for name, list_ in listings.items():
+        cpu = self.cpu_time(list_)
+        peak = self.peak_memory(list_)
+        self.stdout.write(f"{name:<12} {cpu:>9.1f} {peak / KB:>10,.1f}")
+
+  def cpu_time(self, list_):
+    times = []
+    for _ in range(self.repeat):
+      started = time.process_time()
+      list_()
+      times.append(time.process_time() - started)
+    return statistics.median(times) * 1000
+
+  def peak_memory(self, list_):
+    tracemalloc.start()
+    try:
+      list_()
+      _, peak = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+    return peak
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from snippets.html_store import get_file_store
+from snippets.models import RenderChunk, Snippet
+
+
+class Command(BaseCommand):
+  help = (
+    "Delete the files of the snippet HTML file store, and the chunks of "
+    "long renders, that no snippet refers to any more, e.g. after "
+    "snippets were edited or deleted, or their HTML was moved back to "
+    "the database."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--min-age", type=int, default=3600,
+      help="Seconds since a file or chunk was stored before it may be deleted.")
+    parser.add_argument(
+      "--dry-run", action="store_true",
+      help="Report what would be deleted without deleting it.")
+
+  def handle(self, *args, **options):
+    dry_run = options["dry_run"]
+    store = get_file_store()
+
+    # A render's file is written before the snippet that
+    # refers to it is committed, so recent files are kept
+    # even when no snippet has their digest yet.
+    written_before = time.time() - options["min_age"]
+    # Rows that hold their HTML need no file; pending ones
+    # may be about to get theirs.
+    referenced = set(
+      Snippet.objects.filter(highlighted="").values_list(
+        "render_digest", flat=True))
+
+    deleted = freed = 0
+    for digest, path in store.files():
+      if digest in referenced:
+        continue
+      try:
+        stat = path.stat()
+      except FileNotFoundError:
+        continue
+      if stat.st_mtime > written_before:
+        continue
+
+      if not dry_run:
+        store.delete(digest)
+      deleted += 1
+      freed += stat.st_size
+      if options["verbosity"] > 1:
+        self.stdout.write(f"{'Would delete' if dry_run else 'Deleted'} {path}")
+
+    # Likewise for chunks.
+    chunks = RenderChunk.objects.filter(
+      created__lte=datetime.fromtimestamp(written_before, timezone.utc),
+    ).exclude(digest__in=Snippet.objects.values("render_digest"))
+    renders = chunks.values("digest").distinct().count()
+    if not dry_run:
+      chunks.delete()
+
+    self.stdout.write(
+      f"{'Would delete' if dry_run else 'Deleted'} {deleted} "
+      f"file{'s' if deleted != 1 else ''}, {freed} bytes, and the chunks "
+      f"of {renders} render{'s' if renders != 1 else ''}.")
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from snippets.html_store import get_file_store, stores_files
+from snippets.models import RenderChunk, Snippet
+
+
+class Command(BaseCommand):
+  help = (
+    "Move the highlighted HTML of rendered snippets from the database "
+    "to the file store, or back, e.g. after changing "
+    "SNIPPETS_RENDER[\"STORAGE\"]."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--to", choices=["files", "database"], required=True,
+      help="Where to move the HTML.")
+    parser.add_argument(
+      "--batch-size", type=int, default=200,
+      help="Snippets read and written per transaction.")
+
+  def handle(self, *args, **options):
+    to_files = options["to"] == "files"
+    batch_size = options["batch_size"]
+    store = get_file_store()
+
+    if to_files != stores_files():
+      self.stderr.write(
+        f"SNIPPETS_RENDER[\"STORAGE\"] is not \"{options['to']}\", so new "
+        "renders will still be stored the other way.")
+
+    # Rows still holding their HTML, or pointing at a file.
+    # Long renders stay in their chunks (see snippets/chunks.py).
+    snippets = Snippet.objects.filter(render_state=Snippet.READY)
+    if to_files:
+      snippets = snippets.exclude(highlighted="")
+    else:
+      snippets = snippets.filter(highlighted="").exclude(
+        render_digest__in=RenderChunk.objects.values("digest"))
+
+    moved = 0
+    last_pk = 0
+    while True:
+      batch = list(
+        snippets.filter(pk__gt=last_pk).order_by("pk").values_list(
+          "pk", "render_digest", "highlighted")[:batch_size])
+      if not batch:
+        break
+      last_pk = batch[-1][0]
+
+      with transaction.atomic():
+        for pk, digest, html in batch:
+          if to_files:
+            store.write(digest, html)
+            html = ""
+          else:
+            html = store.read(digest)
+            if html is None:
+              self.stderr.write(f"Snippet {pk} has no file; skipped.")
+              continue
+          # Skipped if the snippet was saved again meanwhile.
+          moved += Snippet.objects.filter(
+            pk=pk, render_digest=digest,
+          ).update(highlighted=html)
+
+      if options["verbosity"] > 1:
+        self.stdout.write(f"Moved {moved} snippets.")
+
+    self.stdout.write(
+      f"Moved the HTML of {moved} snippet{'s' if moved != 1 else ''} "
+      f"to the {options['to']}.")
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from snippets.models import Snippet
+from snippets.search import clear_index, index_snippets
+
+
+class Command(BaseCommand):
+  help = (
+    "Rebuild the full-text search index of snippets from scratch, "
+    "e.g. after snippets were written with bulk_create() or "
+    "QuerySet.update(), which do not update it."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--batch-size", type=int, default=1000,
+      help="Snippets read and indexed per transaction.")
+
+  def handle(self, *args, **options):
+    batch_size = options["batch_size"]
+
+    # The whole rebuild is one transaction, so that searches
+    # never see a partial index; the batches only bound the
+    # snippets held in memory at once.
+    indexed = 0
+    with transaction.atomic():
+      clear_index()
+
+      last_pk = 0
+      while True:
+        batch = list(
+          Snippet.objects.filter(pk__gt=last_pk).order_by("pk").values_list(
+            "pk", "title", "code")[:batch_size])
+        if not batch:
+          break
+        index_snippets(batch)
+        indexed += len(batch)
+        last_pk = batch[-1][0]
+
+        if options["verbosity"] > 1:
+          self.stdout.write(f"Indexed {indexed} snippets.")
+
+    self.stdout.write(
+      f"Indexed {indexed} snippet{'s' if indexed != 1 else ''}.")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from snippets.models import Snippet
+from snippets.rendering import render_snippets
+
+
+class Command(BaseCommand):
+  help = (
+    "Highlight the snippets whose rendering is pending or failed, "
+    "in this process."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--all", action="store_true",
+      help="Re-render every snippet, e.g. after upgrading Pygments.")
+
+  def handle(self, *args, **options):
+    snippets = Snippet.objects.all()
+    if not options["all"]:
+      snippets = snippets.exclude(render_state=Snippet.READY)
+
+    rendered = render_snippets(snippets)
+    self.stdout.write(self.style.SUCCESS(
+      f"Rendered {rendered} snippet{'s' if rendered != 1 else ''}."))
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from snippets.highlighting import render_digest, render_html
+from snippets.html_store import highlighted_column
+from snippets.models import Snippet, stored_html
+from snippets.render_cache import render_cached
+
+
+class Command(BaseCommand):
+  help = (
+    "Re-render the stored HTML of every snippet that was not "
+    "rendered the way SNIPPETS_RENDER[\"FULL_DOCUMENT\"] now asks "
+    "for, e.g. full documents as fragments, and report the space "
+    "saved."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      "--batch-size", type=int, default=200,
+      help="Snippets read and written per transaction.")
+    parser.add_argument(
+      "--dry-run", action="store_true",
+      help="Report the sizes without writing anything.")
+
+  def handle(self, *args, **options):
+    batch_size = options["batch_size"]
+    dry_run = options["dry_run"]
+
+    # The old HTML is only measured, not loaded, unless it
+    # is kept in a file or in chunks.
+    snippets = Snippet.objects.defer("highlighted").annotate(
+      html_size=Length("highlighted")).order_by("pk")
+
+    rewritten = size_before = size_after = 0
+    batch = []
+    for snippet in snippets.iterator(chunk_size=batch_size):
+      inputs = snippet.render_inputs()
+      digest = render_digest(*inputs)
+      if snippet.render_digest == digest and \
+          snippet.render_state == Snippet.READY:
+        continue
+
+      # A dry run writes nothing, not even to the render
+      # cache.
+      html = render_html(*inputs) if dry_run else render_cached(inputs)
+      # Rows whose HTML is in a file or in chunks have an
+      # empty column; measure it where highlighted_html()
+      # would read it.
+      size_before += snippet.html_size or len(stored_html(
+        '', snippet.render_state, snippet.render_digest))
+      size_after += len(html)
+      batch.append((snippet.pk, snippet.render_digest, digest, html))
+
+      if len(batch) == batch_size:
+        rewritten += self.write(batch, dry_run)
+        batch = []
+    rewritten += self.write(batch, dry_run)
+
+    saved = size_before - size_after
+    self.stdout.write(
+      f"{'Would rewrite' if dry_run else 'Rewrote'} {rewritten} "
+      f"snippet{'s' if rewritten != 1 else ''}: {size_before} characters "
+      f"of HTML became {size_after}, saving {saved}"
+      + (f" ({saved / size_before:.0%})." if size_before else "."))
+
+  def write(self, batch, dry_run):
+    if dry_run:
+      return len(batch)
+
+    written = 0
+    with transaction.atomic():
+      for pk, old_digest, digest, html in batch:
+        # Skipped if the snippet was saved again meanwhile.
+        written += Snippet.objects.filter(
+          pk=pk, render_digest=old_digest,
+        ).update(
+          highlighted=highlighted_column(digest, html), render_digest=digest,
+          render_state=Snippet.READY, modified=timezone.now())
+    return written
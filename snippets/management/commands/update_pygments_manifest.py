@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from snippets.choices import MANIFEST_PATH, build_manifest, write_manifest
+
+
+class Command(BaseCommand):
+  help = (
+    "Regenerate the list of Pygments languages and styles that "
+    "Snippet offers (snippets/pygments_manifest.json). Run it "
+    "after upgrading Pygments or changing its plugins."
+  )
+
+  def handle(self, *args, **options):
+    manifest = build_manifest()
+    write_manifest(manifest)
+    self.stdout.write(self.style.SUCCESS(
+      f"Wrote {len(manifest['languages'])} languages and "
+      f"{len(manifest['styles'])} styles for Pygments "
+      f"{manifest['pygments']} to {MANIFEST_PATH}."))
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0002_render_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderCacheEntry',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('html', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0003_render_cache'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='snippet',
+            options={'ordering': ['created', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['created', 'id'], name='snippet_created_id'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0004_created_id_index'),
+    ]
+
+    # The full-text index of snippets/search.py, filled with
+    # the snippets that already exist.
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE snippets_search USING fts5(title, code)",
+                "INSERT INTO snippets_search (rowid, title, code) "
+                "SELECT id, title, code FROM snippets_snippet",
+            ],
+            reverse_sql="DROP TABLE snippets_search",
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:13
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    # As snippets.models.content_digest() computed it when
+    # this migration was written.
+    Snippet = apps.get_model('snippets', 'Snippet')
+    snippets = Snippet.objects.only(
+        'title', 'code', 'linenos', 'language', 'style')
+    for snippet in snippets.iterator():
+        fields = [snippet.title, snippet.code, bool(snippet.linenos),
+                  snippet.language, snippet.style]
+        Snippet.objects.filter(pk=snippet.pk).update(
+            content_hash=hashlib.sha256(
+                json.dumps(fields).encode()).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0005_snippet_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snippet',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0006_snippet_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64)),
+                ('number', models.PositiveIntegerField()),
+                ('first_line', models.PositiveIntegerField(null=True)),
+                ('last_line', models.PositiveIntegerField(null=True)),
+                ('html', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='renderchunk',
+            constraint=models.UniqueConstraint(fields=('digest', 'number'), name='render_chunk_number'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.20 on 2026-10-18 21:33
+
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_first_revisions(apps, schema_editor):
+    # Each existing snippet's history starts with its
+    # current version, stored whole, as
+    # snippets.revisions.record_revisions() stored
+    # checkpoints when this migration was written.
+    Snippet = apps.get_model('snippets', 'Snippet')
+    SnippetRevision = apps.get_model('snippets', 'SnippetRevision')
+    snippets = Snippet.objects.only(
+        'title', 'code', 'linenos', 'language', 'style', 'content_hash')
+    revisions = []
+    for snippet in snippets.iterator():
+        revisions.append(SnippetRevision(
+            snippet_id=snippet.pk, number=1, checkpoint=1,
+            data=zlib.compress(snippet.code.encode(), 6),
+            size=len(snippet.code), title=snippet.title,
+            linenos=snippet.linenos, language=snippet.language,
+            style=snippet.style, content_hash=snippet.content_hash))
+        if len(revisions) == 500:
+            SnippetRevision.objects.bulk_create(revisions)
+            revisions = []
+    SnippetRevision.objects.bulk_create(revisions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0007_render_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('title', models.CharField(blank=True, default='', max_length=100)),
+                ('linenos', models.BooleanField(default=False)),
+                ('language', models.CharField(max_length=100)),
+                ('style', models.CharField(max_length=100)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('size', models.PositiveIntegerField()),
+                ('checkpoint', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('snippet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='snippets.snippet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='snippetrevision',
+            constraint=models.UniqueConstraint(fields=('snippet', 'number'), name='snippet_revision_number'),
+        ),
+        migrations.RunPython(add_first_revisions, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,50 @@
-from django.db import models
-from pygments.lexers import get_all_lexers, get_lexer_by_name
-from pygments.styles import get_all_styles
-from pygments.formatters.html import HtmlFormatter
-from pygments import highlight
+import hashlib
+import json
+
+from django.db import models, transaction
+
+from snippets.choices import LANGUAGE_CHOICES, STYLE_CHOICES
+from snippets.highlighting import render_digest
+from snippets.chunks import join_chunks
+from snippets.html_store import get_file_store, highlighted_column
+from snippets.render_cache import render_cache, render_cached
+from snippets.rendering import (
+  render_full_document, render_language, render_pipeline,
+  render_synchronously)
+from snippets.revisions import REVISED_FIELDS, record_revisions
+
+def content_digest(title, code, linenos, language, style):
+  """
+  Return a hash of the fields a client can edit, from
+  which the ETags of a snippet are made."""
+  fields = [title, code, bool(linenos), language, style]
+  return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+# The columns that hold a whole snippet's code or HTML,
+# which can run to megabytes each.
+HEAVY_FIELDS = ('code', 'highlighted')
+
+
+class SnippetQuerySet(models.QuerySet):
+  def summaries(self, expand=()):
+    """
+    Leave out the HEAVY_FIELDS not named in `expand`, for
+    listings that only show titles and metadata. Reading a
+    left out field of a snippet costs a query of its own.
+    """
+    return self.defer(*[name for name in HEAVY_FIELDS if name not in expand])
+
+
+def stored_html(highlighted, render_state, render_digest):
+  """
+  Snippet.highlighted_html() of a snippet with these
+  values, e.g. from a .values() row."""
+  if highlighted or render_state != Snippet.READY:
+    return highlighted
+  return (get_file_store().read(render_digest)
+          or join_chunks(render_digest) or '')
 
-LEXERS = [item for item in get_all_lexers() if item[1]]
-LANGUAGE_CHOICES = sorted([(item[1][0], item[0]) for item in LEXERS])
-STYLE_CHOICES = sorted([(item, item) for item in get_all_styles()])
 
 # Purpose: To store code snippets.
 class Snippet(models.Model):
@@ -23,19 +61,278 @@ class Snippet(models.Model):
   owner = models.ForeignKey(
     'auth.User', related_name='snippets', on_delete=models.CASCADE)
 
-  # The highlighted HTML representation of the code.
+  # The highlighted HTML representation of the code. Empty
+  # with SNIPPETS_RENDER["STORAGE"] "files", where the HTML
+  # is in the file named by render_digest instead, and for
+  # long code, kept in RenderChunks (see highlighted_html()).
   highlighted = models.TextField()
 
+  # Whether `highlighted` is up to date with the code. It is
+  # "pending" while a background worker renders it (see
+  # snippets/rendering.py).
+  PENDING = 'pending'
+  READY = 'ready'
+  FAILED = 'failed'
+  RENDER_STATE_CHOICES = [
+    (PENDING, 'Pending'),
+    (READY, 'Ready'),
+    (FAILED, 'Failed'),
+  ]
+  render_state = models.CharField(
+    choices=RENDER_STATE_CHOICES, default=PENDING, max_length=10)
+
+  # A hash of the inputs `highlighted` is rendered from.
+  render_digest = models.CharField(max_length=64, blank=True, default='')
+
+  # A hash of the editable fields (see content_digest()),
+  # and when the snippet or its rendering last changed; the
+  # validators of conditional GETs (see snippets/views.py).
+  content_hash = models.CharField(max_length=64, blank=True, default='')
+  modified = models.DateTimeField(auto_now=True)
+
+  objects = SnippetQuerySet.as_manager()
+
+  def render_inputs(self):
+    """
+    The arguments of render_html() for this snippet. The
+    title only shows in full HTML documents (see
+    SNIPPETS_RENDER["FULL_DOCUMENT"]), and code too long
+    to highlight is rendered as plain text (see
+    SNIPPETS_RENDER["HIGHLIGHT_LINES"])."""
+    full = render_full_document()
+    title = self.title if full else ''
+    language = render_language(self.code, self.language)
+    return (self.code, language, self.style, self.linenos, title, full)
+
+  def highlighted_html(self):
+    """
+    The highlighted HTML, from the row, the file store or
+    its chunks, or '' if the snippet has not been rendered.
+    """
+    return stored_html(self.highlighted, self.render_state, self.render_digest)
+
+  def etag(self, representation=''):
+    """
+    A strong ETag for the snippet's current version, as
+    shown in `representation` (e.g. a DRF format)."""
+    return f'"{self.content_hash}-{self.render_state}-{representation}"'
+
+  def update_digests(self):
+    """
+    Set content_hash and render_digest from the current
+    fields. Returns the render inputs."""
+    self.content_hash = content_digest(
+      self.title, self.code, self.linenos, self.language, self.style)
+    inputs = self.render_inputs()
+    self.render_digest = render_digest(*inputs)
+    return inputs
+
+  # The fields' values as loaded from or last saved to the
+  # database, to tell which have changed since; None until
+  # then.
+  _saved_values = None
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    instance._saved_values = dict(zip(field_names, values))
+    return instance
+
+  def refresh_from_db(self, using=None, fields=None):
+    # Also called with `fields` to load a deferred field,
+    # which must not make the other fields' unsaved changes
+    # look saved.
+    super().refresh_from_db(using=using, fields=fields)
+    self._remember_saved_values(fields)
+
+  def _remember_saved_values(self, fields=None):
+    # Only the `fields` given (names or attnames), if any.
+    # Deferred fields that have not been loaded are left out.
+    if fields is not None:
+      fields = {self._meta.get_field(name).attname for name in fields}
+    saved_values = {
+      field.attname: self.__dict__[field.attname]
+      for field in self._meta.concrete_fields
+      if field.attname in self.__dict__
+      and (fields is None or field.attname in fields)}
+    if fields is None or self._saved_values is None:
+      self._saved_values = saved_values
+    else:
+      self._saved_values = {**self._saved_values, **saved_values}
+
+  def saved_version(self):
+    """
+    Return the (content_hash, code) the snippet was loaded
+    or last saved with, or None if its code was not loaded.
+    """
+    if self._saved_values is None or 'code' not in self._saved_values:
+      return None
+    return self._saved_values.get('content_hash'), self._saved_values['code']
+
+  def changed_fields(self):
+    """
+    Return the names of the fields that changed since the
+    snippet was loaded or saved, or None if it never was.
+    """
+    if self._saved_values is None or self._state.adding:
+      return None
+    return {
+      field.name for field in self._meta.concrete_fields
+      if field.attname in self.__dict__ and (
+        field.attname not in self._saved_values
+        or self.__dict__[field.attname] != self._saved_values[field.attname])}
+
   def save(self, *args, **kwargs):
-    # Use the `pygments` library to create a highlighted
-    # HTML representation of the code snippet.
-    lexer = get_lexer_by_name(self.language)
-    linenos = 'table' if self.linenos else False
-    options = {'title': self.title} if self.title else {}
-    formatter = HtmlFormatter(style=self.style, linenos=linenos,
-                              full=True, **options)
-    self.highlighted = highlight(self.code, lexer, formatter)
-    super().save(*args, **kwargs)
+    """
+    Save the snippet, and highlight it if it is new or its
+    render inputs changed. A new snippet, or a change to
+    the fields its revisions keep, adds a revision (see
+    snippets/revisions.py).
+
+    A snippet loaded from the database only writes the
+    fields that changed (unless given `update_fields`), and
+    nothing if none did.
+    """
+    changed = self.changed_fields()
+    if changed is not None and kwargs.get('update_fields') is None:
+      if not changed:
+        # E.g. a PUT of the values it has.
+        return
+      kwargs['update_fields'] = changed
+
+    revised = changed is None or bool(changed & set(REVISED_FIELDS))
+    saved_version = self.saved_version()
+
+    def write(*fields):
+      if kwargs.get('update_fields') is not None:
+        kwargs['update_fields'] = {
+          *kwargs['update_fields'], 'content_hash', 'modified', *fields}
+      if not revised:
+        super(Snippet, self).save(*args, **kwargs)
+      else:
+        with transaction.atomic(using=kwargs.get('using')):
+          super(Snippet, self).save(*args, **kwargs)
+          record_revisions(
+            [self], {self.pk: saved_version} if saved_version else None)
+      self._remember_saved_values(kwargs.get('update_fields'))
+
+    rendered_from = self.render_digest
+    inputs = self.update_digests()
+    render_fields = ('highlighted', 'render_state', 'render_digest')
+
+    if changed is not None and self.render_digest == rendered_from:
+      # Its HTML is, or is being, rendered from these inputs
+      # already, e.g. if only the owner changed.
+      write()
+      return
+
+    if render_synchronously():
+      # Use the `pygments` library to create a highlighted
+      # HTML representation of the code snippet, unless the
+      # same one has been rendered before.
+      self.highlighted = highlighted_column(
+        self.render_digest, render_cached(inputs))
+      self.render_state = self.READY
+      write(*render_fields)
+      return
+
+    # A snippet that was rendered before needs no worker.
+    highlighted = render_cache.get(self.render_digest)
+    if highlighted is not None:
+      self.highlighted = highlighted_column(self.render_digest, highlighted)
+      self.render_state = self.READY
+      write(*render_fields)
+      return
+
+    # Store the code now and highlight it in the background
+    # once it is committed.
+    self.highlighted = ''
+    self.render_state = self.PENDING
+    write(*render_fields)
+
+    pk, digest = self.pk, self.render_digest
+    transaction.on_commit(
+      lambda: render_pipeline.submit(pk, digest, inputs),
+      using=kwargs.get('using'))
+
+  class Meta:
+    # id breaks ties between snippets created at the same
+    # moment, so that every snippet has a fixed position;
+    # keyset pagination (snippets/pagination.py) relies on
+    # that and on this index.
+    ordering = ['created', 'id']
+    indexes = [
+      models.Index(fields=['created', 'id'], name='snippet_created_id'),
+    ]
+
+
+# Purpose: To keep the highlighted HTML of every rendered
+# snippet, keyed by its render_digest, so that identical
+# snippets are only rendered once (see snippets/render_cache.py).
+class RenderCacheEntry(models.Model):
+  digest = models.CharField(max_length=64, primary_key=True)
+  html = models.TextField()
+
+  # When the entry was added, for FIFO eviction.
+  created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+  # When the entry was last read, for LRU eviction.
+  last_used = models.DateTimeField(db_index=True)
+
+
+# Purpose: To keep the highlighted HTML of long renders in
+# ranges of lines, keyed by their render_digest, so that a
+# few lines can be read without the rest (see
+# snippets/chunks.py).
+class RenderChunk(models.Model):
+  digest = models.CharField(max_length=64)
+  # The chunk's place in the document, from 0.
+  number = models.PositiveIntegerField()
+  # The lines of code in the chunk, from 1; None for the
+  # HTML before and after the code.
+  first_line = models.PositiveIntegerField(null=True)
+  last_line = models.PositiveIntegerField(null=True)
+  html = models.TextField()
+
+  # When the chunk was stored, for collect_snippet_html.
+  created = models.DateTimeField(auto_now_add=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=['digest', 'number'], name='render_chunk_number'),
+    ]
+
+
+# Purpose: To keep every version of a snippet's editable
+# fields, with its code stored as a compressed delta
+# against the version before it or, at checkpoints, whole
+# (see snippets/revisions.py).
+class SnippetRevision(models.Model):
+  snippet = models.ForeignKey(
+    Snippet, related_name='revisions', on_delete=models.CASCADE)
+  # The revision's place in the snippet's history, from 1.
+  number = models.PositiveIntegerField()
+  created = models.DateTimeField(auto_now_add=True)
+
+  title = models.CharField(max_length=100, blank=True, default='')
+  linenos = models.BooleanField(default=False)
+  language = models.CharField(max_length=100)
+  style = models.CharField(max_length=100)
+  # The snippet's content_hash for these values.
+  content_hash = models.CharField(max_length=64, blank=True, default='')
+
+  # The length of the code, in characters.
+  size = models.PositiveIntegerField()
+  # The number of the revision holding the whole code this
+  # one is rebuilt from; its own number if that is itself.
+  checkpoint = models.PositiveIntegerField()
+  # The code, or the delta from the previous revision's
+  # code, compressed.
+  data = models.BinaryField()
 
   class Meta:
-    ordering = ['created']
\ No newline at end of file
+    constraints = [
+      models.UniqueConstraint(
+        fields=['snippet', 'number'], name='snippet_revision_number'),
+    ]
@@ -0,0 +1,233 @@
+"""
+Keyset ("cursor") pagination for the snippets API.
+
+PageNumberPagination pages with COUNT(*) and OFFSET, so
+page n costs a scan of every row before it. Here a page is
+instead fetched as "the next page_size rows after the last
+row of the previous page", using the row's values of the
+ordering fields:
+
+  WHERE created >= %s AND (created > %s OR (created = %s AND id > %s))
+  ORDER BY created, id LIMIT page_size + 1
+
+With an index on the ordering fields, every page costs the
+same. The cursor in the next/previous links holds those
+values, so a page never repeats or skips rows when others
+are inserted or deleted meanwhile.
+
+Fields of the ordering may be descending ('-id'), in which
+case "after" means a lower value.
+
+There is no page count, and no total unless the client
+asks for it with ?count=true.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _field_name(field):
+  # 'id' for '-id'.
+  return field.lstrip('-')
+
+
+def _reverse(field):
+  return field[1:] if field.startswith('-') else '-' + field
+
+
+class KeysetPagination(BasePagination):
+  # Must end with a unique field, so that every row has
+  # a distinct position.
+  ordering = ('created', 'id')
+
+  page_size = api_settings.PAGE_SIZE
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+  cursor_query_param = 'cursor'
+  count_query_param = 'count'
+  invalid_cursor_message = 'Invalid cursor.'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    page_size = self.get_page_size(request)
+
+    # COUNT(*) is what this pagination avoids; only run it
+    # when the client asks for the total.
+    self.count = None
+    if request.query_params.get(self.count_query_param) in ('1', 'true'):
+      self.count = queryset.count()
+
+    cursor = self.decode_cursor(request)
+    if cursor is None:
+      direction, position = 'next', None
+    else:
+      direction, position = cursor
+      position = self.clean_position(queryset.model, position)
+
+    if direction == 'next':
+      if position is not None:
+        queryset = queryset.filter(self.keyset_filter(position, 'gt'))
+      rows = list(queryset.order_by(*self.ordering)[:page_size + 1])
+      self.has_next = len(rows) > page_size
+      self.has_previous = position is not None
+      rows = rows[:page_size]
+    else:
+      # Read backwards from the position, then put the
+      # page back in order.
+      queryset = queryset.filter(self.keyset_filter(position, 'lt'))
+      reversed_ordering = [_reverse(field) for field in self.ordering]
+      rows = list(queryset.order_by(*reversed_ordering)[:page_size + 1])
+      self.has_previous = len(rows) > page_size
+      self.has_next = True
+      rows = rows[:page_size][::-1]
+
+    self.page = rows
+    return rows
+
+  def get_page_size(self, request):
+    if self.page_size_query_param:
+      try:
+        return _positive_int(
+          request.query_params[self.page_size_query_param],
+          strict=True, cutoff=self.max_page_size)
+      except (KeyError, ValueError):
+        pass
+    return self.page_size
+
+  def keyset_filter(self, position, lookup):
+    """
+    Return the Q for rows after (lookup 'gt') or before
+    ('lt') `position`, in the order of self.ordering:
+
+      (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+
+    The first field is also given a plain range (a >= x),
+    which lets the database start reading the index at the
+    position instead of filtering it from the beginning.
+    Descending fields compare the other way round.
+    """
+    def field_lookup(field):
+      if not field.startswith('-'):
+        return _field_name(field), lookup
+      return _field_name(field), 'lt' if lookup == 'gt' else 'gt'
+
+    condition = None
+    for field, value in reversed(list(zip(self.ordering, position))):
+      name, op = field_lookup(field)
+      strict = Q(**{f'{name}__{op}': value})
+      condition = strict if condition is None else \
+        strict | (Q(**{name: value}) & condition)
+
+    first_name, first_op = field_lookup(self.ordering[0])
+    return Q(**{f'{first_name}__{first_op}e': position[0]}) & condition
+
+  def position(self, row):
+    values = []
+    for field in map(_field_name, self.ordering):
+      # Rows are instances, or dicts from .values().
+      value = row[field] if isinstance(row, dict) else getattr(row, field)
+      values.append(value.isoformat() if isinstance(value, datetime) else value)
+    return values
+
+  def encode_cursor(self, direction, row):
+    cursor = json.dumps({'d': direction, 'p': self.position(row)})
+    encoded = urlsafe_b64encode(cursor.encode()).decode()
+    return replace_query_param(
+      self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+  def decode_cursor(self, request):
+    """
+    Return the (direction, position) of the cursor in the
+    request, or None for the first page."""
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+
+    try:
+      cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+      direction, position = cursor['d'], cursor['p']
+    except (TypeError, ValueError, KeyError):
+      raise NotFound(self.invalid_cursor_message)
+
+    if direction not in ('next', 'previous') or \
+        not isinstance(position, list) or \
+        len(position) != len(self.ordering):
+      raise NotFound(self.invalid_cursor_message)
+    return direction, position
+
+  def clean_position(self, model, position):
+    """
+    Return a cursor's `position` as values of the ordering
+    fields of `model`; anything else would fail in the
+    query, rather than here with a 404."""
+    values = []
+    for name, value in zip(self.ordering, position):
+      field = model._meta.get_field(_field_name(name))
+      try:
+        if value is None:
+          raise ValidationError('Empty position.')
+        value = field.to_python(value)
+        # E.g. the range of the database's integers, which
+        # Django leaves unchecked on SQLite.
+        field.run_validators(value)
+        if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+          raise ValidationError('Out of range.')
+      except (ValidationError, TypeError, ValueError):
+        raise NotFound(self.invalid_cursor_message)
+      values.append(value)
+    return values
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+    return self.encode_cursor('next', self.page[-1])
+
+  def get_previous_link(self):
+    if not self.has_previous or not self.page:
+      return None
+    return self.encode_cursor('previous', self.page[0])
+
+  def get_paginated_response(self, data):
+    response = {
+      'next': self.get_next_link(),
+      'previous': self.get_previous_link(),
+      'results': data,
+    }
+    if self.count is not None:
+      response = {'count': self.count, **response}
+    return Response(response)
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'count': {'type': 'integer', 'example': 123},
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
+
+
+class UserKeysetPagination(KeysetPagination):
+  ordering = ('id',)
+
+
+class NewestUserKeysetPagination(KeysetPagination):
+  # Newest first: users' ids grow with their date_joined,
+  # which is not indexed.
+  ordering = ('-id',)
+
+
+class RevisionKeysetPagination(KeysetPagination):
+  # The revisions of one snippet.
+  ordering = ('number',)
@@ -0,0 +1,268 @@
+"""
+A content-addressed cache of highlighted snippet HTML.
+
+Renders are keyed by their render_digest, a hash of the
+code, language, style, linenos and title (and of whether
+a full document was made), so identical snippets are
+rendered by Pygments only once. There are two tiers:
+
+* an in-process tier, holding up to MEMORY_ENTRIES
+  renders and MEMORY_SIZE characters of HTML;
+* a persistent tier, the RenderCacheEntry table, shared
+  by all processes and kept across restarts, holding up
+  to PERSISTENT_ENTRIES renders. Renders long enough to
+  be stored in chunks (snippets/chunks.py) are read back
+  from their chunks, their entries keeping no HTML. With
+  SNIPPETS_RENDER["STORAGE"] set to "files" it is the file
+  store of snippets/html_store.py instead, which keeps
+  every render that a snippet refers to.
+
+Both tiers evict by EVICTION: "lru" drops the entries
+read least recently, "fifo" the ones added first. All of
+these are keys of SNIPPETS_RENDER_CACHE in
+storefront/settings.py.
+"""
+import threading
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from .chunks import is_long, join_chunks
+from .highlighting import render_digest, render_html
+from .html_store import get_file_store, stores_files
+
+
+# Default values used when SNIPPETS_RENDER_CACHE in
+# storefront/settings.py leaves a key out.
+DEFAULTS = {
+  "MEMORY_ENTRIES": 256,
+  "MEMORY_SIZE": 16 * 1024 * 1024,
+  "PERSISTENT": True,
+  "PERSISTENT_ENTRIES": 10000,
+  "EVICTION": "lru",
+}
+
+
+def get_render_cache_settings():
+  """
+  Return the SNIPPETS_RENDER_CACHE settings merged
+  on top of the defaults."""
+  return {**DEFAULTS, **getattr(settings, "SNIPPETS_RENDER_CACHE", {})}
+
+
+class RenderCache:
+  """
+  The two tiers described in the module docstring, and
+  hit/miss counts for each of them. The counts are kept
+  per process.
+  """
+
+  def __init__(self):
+    self._memory = OrderedDict()
+    self._memory_size = 0
+    self._lock = threading.Lock()
+    self._stats = {
+      "memory_hits": 0,
+      "persistent_hits": 0,
+      "misses": 0,
+    }
+
+  def get(self, digest):
+    """Return the HTML rendered for `digest`, or None."""
+    config = get_render_cache_settings()
+
+    with self._lock:
+      html = self._memory.get(digest)
+      if html is not None:
+        if config["EVICTION"] == "lru":
+          self._memory.move_to_end(digest)
+        self._stats["memory_hits"] += 1
+        return html
+
+    html = self._get_persistent(digest, config)
+    if html is None:
+      with self._lock:
+        self._stats["misses"] += 1
+      return None
+
+    with self._lock:
+      self._stats["persistent_hits"] += 1
+      self._remember(digest, html, config)
+    return html
+
+  def get_many(self, digests):
+    """
+    Return {digest: HTML} for those of `digests` that have
+    been rendered, reading the persistent tier in batches
+    rather than once per digest."""
+    config = get_render_cache_settings()
+    found = {}
+
+    with self._lock:
+      for digest in set(digests):
+        html = self._memory.get(digest)
+        if html is not None:
+          if config["EVICTION"] == "lru":
+            self._memory.move_to_end(digest)
+          self._stats["memory_hits"] += 1
+          found[digest] = html
+    missing = set(digests) - found.keys()
+
+    persistent = self._get_many_persistent(missing, config)
+    with self._lock:
+      self._stats["persistent_hits"] += len(persistent)
+      self._stats["misses"] += len(missing) - len(persistent)
+      for digest, html in persistent.items():
+        self._remember(digest, html, config)
+    found.update(persistent)
+    return found
+
+  def set(self, digest, html):
+    """Store the HTML rendered for `digest` in both tiers."""
+    self.set_many({digest: html})
+
+  def set_many(self, rendered):
+    """
+    Store {digest: HTML} in both tiers, writing the
+    persistent tier in batches."""
+    config = get_render_cache_settings()
+    with self._lock:
+      for digest, html in rendered.items():
+        self._remember(digest, html, config)
+    self._set_persistent(rendered, config)
+
+  def _remember(self, digest, html, config):
+    if digest in self._memory:
+      self._memory_size -= len(self._memory.pop(digest))
+    if len(html) > config["MEMORY_SIZE"]:
+      # It would push everything else out.
+      return
+
+    self._memory[digest] = html
+    self._memory_size += len(html)
+
+    while (len(self._memory) > config["MEMORY_ENTRIES"]
+        or self._memory_size > config["MEMORY_SIZE"]):
+      _, evicted = self._memory.popitem(last=False)
+      self._memory_size -= len(evicted)
+
+  def _get_persistent(self, digest, config):
+    if stores_files():
+      return get_file_store().read(digest)
+    if not config["PERSISTENT"]:
+      return None
+
+    RenderCacheEntry = apps.get_model("snippets", "RenderCacheEntry")
+    html = RenderCacheEntry.objects.filter(
+      digest=digest).values_list("html", flat=True).first()
+    if html is not None and config["EVICTION"] == "lru":
+      RenderCacheEntry.objects.filter(digest=digest).update(
+        last_used=timezone.now())
+    return join_chunks(digest) if html == "" else html
+
+  def _get_many_persistent(self, digests, config):
+    if stores_files():
+      store = get_file_store()
+      found = {digest: store.read(digest) for digest in digests}
+      return {
+        digest: html for digest, html in found.items() if html is not None}
+    if not config["PERSISTENT"] or not digests:
+      return {}
+
+    RenderCacheEntry = apps.get_model("snippets", "RenderCacheEntry")
+    digests = list(digests)
+    found = {}
+    # Batches stay under SQLite's limit on query parameters.
+    for start in range(0, len(digests), 500):
+      batch = digests[start:start + 500]
+      found.update(RenderCacheEntry.objects.filter(
+        digest__in=batch).values_list("digest", "html"))
+      if config["EVICTION"] == "lru":
+        RenderCacheEntry.objects.filter(digest__in=batch).update(
+          last_used=timezone.now())
+
+    for digest in [digest for digest, html in found.items() if html == ""]:
+      html = join_chunks(digest)
+      if html is None:
+        del found[digest]
+      else:
+        found[digest] = html
+    return found
+
+  def _set_persistent(self, rendered, config):
+    if stores_files():
+      # Never evicted; see collect_snippet_html.
+      store = get_file_store()
+      for digest, html in rendered.items():
+        store.write(digest, html)
+      return
+    if not config["PERSISTENT"] or not rendered:
+      return
+
+    RenderCacheEntry = apps.get_model("snippets", "RenderCacheEntry")
+    now = timezone.now()
+    # Entries that exist keep their "created". Long renders
+    # are kept in chunks instead; their empty entries still
+    # count towards PERSISTENT_ENTRIES and are evicted like
+    # the others.
+    RenderCacheEntry.objects.bulk_create(
+      [RenderCacheEntry(
+         digest=digest, html="" if is_long(html) else html, last_used=now)
+       for digest, html in rendered.items()],
+      batch_size=500, update_conflicts=True, unique_fields=["digest"],
+      update_fields=["html", "last_used"])
+
+    excess = RenderCacheEntry.objects.count() - config["PERSISTENT_ENTRIES"]
+    if excess > 0:
+      # Evict a tenth more than needed, so that the table
+      # is not culled again by every following render.
+      order = "last_used" if config["EVICTION"] == "lru" else "created"
+      evicted = RenderCacheEntry.objects.order_by(order).values_list(
+        "digest", flat=True)[:excess + config["PERSISTENT_ENTRIES"] // 10]
+      RenderCacheEntry.objects.filter(digest__in=list(evicted)).delete()
+
+  def stats(self):
+    with self._lock:
+      stats = dict(self._stats)
+      stats["memory_entries"] = len(self._memory)
+      stats["memory_size"] = self._memory_size
+
+    lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+    stats["hit_ratio"] = (
+      (stats["memory_hits"] + stats["persistent_hits"]) / lookups
+      if lookups else None)
+    return stats
+
+  def clear(self, persistent=False):
+    """
+    Empty the in-process tier and reset the counts, and
+    the persistent tier too if `persistent` is set. The
+    file store is left alone, as snippets refer to it."""
+    with self._lock:
+      self._memory.clear()
+      self._memory_size = 0
+      for key in self._stats:
+        self._stats[key] = 0
+
+    if persistent:
+      apps.get_model("snippets", "RenderCacheEntry").objects.all().delete()
+
+
+# The cache used by the snippets app.
+render_cache = RenderCache()
+
+
+def render_cached(inputs):
+  """
+  Return the highlighted HTML for a snippet's `inputs`
+  (see Snippet.render_inputs()), from the cache if it has
+  been rendered before."""
+  digest = render_digest(*inputs)
+
+  html = render_cache.get(digest)
+  if html is None:
+    html = render_html(*inputs)
+    render_cache.set(digest, html)
+  return html
@@ -0,0 +1,211 @@
+"""
+Background highlighting of snippets.
+
+Running Pygments over a large file takes seconds, so by
+default Snippet.save() does not do it inline. It stores
+the code with render_state "pending", and once the
+transaction commits, hands the rendering to a pool of
+worker processes. When a worker is done, the highlighted
+HTML is written to the row (or, with STORAGE "files", to
+a file; see snippets/html_store.py) and render_state
+becomes "ready" (or "failed").
+
+Each render is tagged with the snippet's render_digest,
+a hash of the code and options it was made from. A render
+is only stored if the row still has that digest, so a
+slow render never overwrites a newer one.
+
+With SNIPPETS_RENDER["SYNC"] set, snippets are rendered
+inline as before, e.g. for tests.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .highlighting import PLAIN_LANGUAGE, render_digest, render_many
+from .html_store import highlighted_column
+from .render_cache import render_cache, render_cached
+
+logger = logging.getLogger(__name__)
+
+
+# Default values used when SNIPPETS_RENDER in
+# storefront/settings.py leaves a key out.
+DEFAULTS = {
+  "SYNC": False,
+  "WORKERS": 2,
+  "FULL_DOCUMENT": True,
+  "STORAGE": "database",
+  # None for BASE_DIR / "snippet_html".
+  "FILE_ROOT": None,
+  "CHUNK_LINES": 1000,
+  "HIGHLIGHT_LINES": 20000,
+  "HIGHLIGHT_SIZE": 1024 * 1024,
+}
+
+
+def get_render_settings():
+  """
+  Return the SNIPPETS_RENDER settings merged
+  on top of the defaults."""
+  return {**DEFAULTS, **getattr(settings, "SNIPPETS_RENDER", {})}
+
+
+def render_synchronously():
+  return get_render_settings()["SYNC"]
+
+
+def render_full_document():
+  return get_render_settings()["FULL_DOCUMENT"]
+
+
+def render_language(code, language):
+  """
+  The lexer to render `code` with: `language`, or plain
+  text if the code is over HIGHLIGHT_LINES lines or
+  HIGHLIGHT_SIZE characters long."""
+  config = get_render_settings()
+  if (len(code) > config["HIGHLIGHT_SIZE"]
+      or code.count("\n") >= config["HIGHLIGHT_LINES"]):
+    return PLAIN_LANGUAGE
+  return language
+
+
+class RenderPipeline:
+  """
+  Renders snippets in a pool of worker processes and
+  stores the results.
+
+  The pool is started on first use. Its processes are
+  spawned rather than forked, as the server process may
+  be running other threads.
+  """
+
+  def __init__(self, workers=None):
+    self._workers = workers
+    self._executor = None
+    self._lock = threading.Lock()
+
+  def _get_executor(self):
+    with self._lock:
+      if self._executor is None:
+        self._executor = ProcessPoolExecutor(
+          max_workers=self._workers or get_render_settings()["WORKERS"],
+          mp_context=multiprocessing.get_context("spawn"))
+      return self._executor
+
+  def submit(self, pk, digest, inputs):
+    """
+    Render a snippet's `inputs` (see Snippet.render_inputs())
+    in the background. Returns a Future that is done once
+    the result has been stored."""
+    return self.submit_batch([([pk], digest, inputs)])
+
+  def submit_batch(self, jobs):
+    """
+    Like submit(), for many renders at once: `jobs` is a
+    list of (pks, digest, inputs), each rendered once for
+    all the snippets in `pks`. The renders are made by one
+    worker in one task, and stored in one transaction.
+    """
+    stored = Future()
+    inputs = [job_inputs for _, _, job_inputs in jobs]
+
+    try:
+      rendering = self._get_executor().submit(render_many, inputs)
+    except BrokenProcessPool:
+      # A worker died, which breaks the whole pool; start
+      # a new one.
+      self.shutdown(wait=False)
+      rendering = self._get_executor().submit(render_many, inputs)
+
+    def done(rendering):
+      try:
+        self._store(jobs, rendering)
+      except BaseException as error:
+        stored.set_exception(error)
+      else:
+        stored.set_result(None)
+
+    rendering.add_done_callback(done)
+    return stored
+
+  def _store(self, jobs, rendering):
+    Snippet = apps.get_model("snippets", "Snippet")
+
+    try:
+      results = rendering.result()
+    except Exception:
+      # The worker itself failed, e.g. it was killed.
+      logger.exception("Rendering snippets %s failed", ", ".join(
+        str(pk) for pks, _, _ in jobs for pk in pks))
+      results = [(None, None)] * len(jobs)
+
+    try:
+      rendered = {}
+      with transaction.atomic():
+        for (pks, digest, _), (highlighted, error) in zip(jobs, results):
+          if highlighted is None:
+            if error is not None:
+              logger.error("Rendering snippet %s failed:\n%s",
+                           ", ".join(map(str, pks)), error)
+            highlighted = ""
+            render_state = Snippet.FAILED
+          else:
+            rendered[digest] = highlighted
+            highlighted = highlighted_column(digest, highlighted)
+            render_state = Snippet.READY
+
+          Snippet.objects.filter(pk__in=pks, render_digest=digest).update(
+            highlighted=highlighted, render_state=render_state,
+            modified=timezone.now())
+        render_cache.set_many(rendered)
+    finally:
+      # Runs on the pool's own thread, which would
+      # otherwise keep a connection open forever.
+      connection.close()
+
+  def shutdown(self, wait=True):
+    with self._lock:
+      executor, self._executor = self._executor, None
+    if executor is not None:
+      executor.shutdown(wait=wait)
+
+
+def render_snippets(queryset):
+  """
+  Render the snippets in `queryset` in this process, e.g.
+  those left "pending" by a server that stopped before its
+  workers were done. Returns the number rendered."""
+  Snippet = apps.get_model("snippets", "Snippet")
+  rendered = 0
+
+  for snippet in queryset.iterator():
+    inputs = snippet.render_inputs()
+    digest = render_digest(*inputs)
+    try:
+      highlighted = highlighted_column(digest, render_cached(inputs))
+      render_state = Snippet.READY
+    except Exception:
+      logger.exception("Rendering snippet %s failed", snippet.pk)
+      highlighted = ""
+      render_state = Snippet.FAILED
+
+    # Skipped if the snippet was saved again meanwhile.
+    rendered += Snippet.objects.filter(
+      pk=snippet.pk, render_digest=snippet.render_digest,
+    ).update(
+      highlighted=highlighted, render_state=render_state,
+      render_digest=digest, modified=timezone.now())
+  return rendered
+
+
+# The pipeline used by Snippet.save().
+render_pipeline = RenderPipeline()
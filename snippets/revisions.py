@@ -0,0 +1,179 @@
+"""
+The revision history of snippets.
+
+Every save that changes a snippet's title, code, linenos,
+language or style adds a SnippetRevision, numbered from 1,
+with those fields as they were saved. The code, which can
+run to megabytes, is not copied into each revision: most
+revisions store a delta against the revision before them,
+the line ranges kept from its code and the lines put in
+between, compressed with zlib. A revision is rebuilt from
+the checkpoint before it, the latest revision that stores
+its whole code, by applying the deltas after it in order.
+
+A revision is a checkpoint if it is the first one, if
+CHECKPOINT_INTERVAL revisions have gone since the last
+one, or if its delta would take no less room than its
+code. Rebuilding any revision therefore reads one
+checkpoint and at most CHECKPOINT_INTERVAL - 1 deltas, in
+one query, however long the history is.
+
+Snippets saved with bulk writes get their revisions from
+snippets/bulk.py; writes that skip save() and
+save_snippets(), such as QuerySet.update(), add none.
+"""
+import difflib
+import json
+import zlib
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+# Default values used when SNIPPETS_REVISIONS in
+# storefront/settings.py leaves a key out.
+DEFAULTS = {
+  'CHECKPOINT_INTERVAL': 50,
+  'COMPRESSION_LEVEL': 6,
+}
+
+# The fields of a snippet a revision keeps; all but the
+# code are copied as they are.
+REVISED_FIELDS = ('title', 'code', 'linenos', 'language', 'style')
+
+# Revisions written per INSERT.
+BATCH_SIZE = 500
+
+
+def get_revision_settings():
+  """
+  Return the SNIPPETS_REVISIONS settings merged on top of
+  the defaults."""
+  return {**DEFAULTS, **getattr(settings, 'SNIPPETS_REVISIONS', {})}
+
+
+def make_delta(old, new):
+  """
+  Return the delta that turns the code `old` into `new`:
+  a list whose items are either [start, end], lines
+  `start` to `end` (excluded) of `old`, or a string of
+  lines put in as they are.
+  """
+  old_lines = old.splitlines(keepends=True)
+  new_lines = new.splitlines(keepends=True)
+  delta = []
+  matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+  for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+    if tag == 'equal':
+      delta.append([old_start, old_end])
+    elif new_start < new_end:
+      delta.append(''.join(new_lines[new_start:new_end]))
+  return delta
+
+
+def apply_delta(old, delta):
+  """Return the code `delta`, from make_delta(), turns `old` into."""
+  return ''.join(_apply_to_lines(old.splitlines(keepends=True), delta))
+
+
+def _apply_to_lines(old_lines, delta):
+  # The lines of the new code, as make_delta() split them.
+  lines = []
+  for item in delta:
+    if isinstance(item, str):
+      lines += item.splitlines(keepends=True)
+    else:
+      lines += old_lines[item[0]:item[1]]
+  return lines
+
+
+def _compress(text, level):
+  return zlib.compress(text.encode(), level)
+
+
+def _decompress(data):
+  return zlib.decompress(data).decode()
+
+
+def _latest_revisions(snippet_ids):
+  """
+  {snippet id: its latest SnippetRevision}, without the
+  revisions' data, for those of `snippet_ids` that have one.
+  """
+  SnippetRevision = apps.get_model('snippets', 'SnippetRevision')
+  latest_number = SnippetRevision.objects.filter(
+    snippet_id=OuterRef('snippet_id'),
+  ).order_by('-number').values('number')[:1]
+  revisions = SnippetRevision.objects.filter(
+    snippet_id__in=snippet_ids, number=Subquery(latest_number),
+  ).only('snippet_id', 'number', 'checkpoint', 'content_hash')
+  return {revision.snippet_id: revision for revision in revisions}
+
+
+def record_revisions(snippets, previous=None):
+  """
+  Add a revision to each of `snippets`, saved Snippets,
+  whose fields differ from its latest revision. Returns
+  the new revisions.
+
+  `previous` maps snippet ids to the (content_hash, code)
+  their snippets had before they were saved, where known
+  (see Snippet.saved_version()); the code of the latest
+  revision of the others is rebuilt when a delta against
+  it is stored.
+  """
+  SnippetRevision = apps.get_model('snippets', 'SnippetRevision')
+  previous = previous or {}
+  config = get_revision_settings()
+  level, interval = config['COMPRESSION_LEVEL'], config['CHECKPOINT_INTERVAL']
+
+  latest = _latest_revisions([snippet.pk for snippet in snippets])
+  revisions = []
+  for snippet in snippets:
+    last = latest.get(snippet.pk)
+    if last is not None and last.content_hash == snippet.content_hash:
+      continue
+
+    number = last.number + 1 if last is not None else 1
+    checkpoint, data = number, _compress(snippet.code, level)
+    if last is not None and number - last.checkpoint < interval:
+      content_hash, code = previous.get(snippet.pk, (None, None))
+      if code is None or content_hash != last.content_hash:
+        code = revision_code(snippet.pk, last.number)
+      delta = make_delta(code, snippet.code)
+      delta = _compress(json.dumps(delta, separators=(',', ':')), level)
+      if len(delta) < len(data):
+        checkpoint, data = last.checkpoint, delta
+
+    revisions.append(SnippetRevision(
+      snippet_id=snippet.pk, number=number, checkpoint=checkpoint, data=data,
+      size=len(snippet.code), content_hash=snippet.content_hash,
+      **{name: getattr(snippet, name)
+         for name in REVISED_FIELDS if name != 'code'}))
+
+  SnippetRevision.objects.bulk_create(revisions, batch_size=BATCH_SIZE)
+  return revisions
+
+
+def revision_code(snippet_id, number):
+  """
+  Return the code of revision `number` of the snippet
+  `snippet_id`, or None if it has no such revision.
+  """
+  SnippetRevision = apps.get_model('snippets', 'SnippetRevision')
+  checkpoint = SnippetRevision.objects.filter(
+    snippet_id=snippet_id, number=number).values('checkpoint')
+  rows = SnippetRevision.objects.filter(
+    snippet_id=snippet_id, number__gte=Subquery(checkpoint),
+    number__lte=number,
+  ).order_by('number').values_list('number', 'checkpoint', 'data')
+
+  # The deltas are applied to lists of lines, which are
+  # only joined at the end.
+  lines = None
+  for row_number, row_checkpoint, data in rows:
+    if row_number == row_checkpoint:
+      lines = _decompress(data).splitlines(keepends=True)
+    else:
+      lines = _apply_to_lines(lines, json.loads(_decompress(data)))
+  return None if lines is None else ''.join(lines)
@@ -0,0 +1,134 @@
+"""
+Full-text search over the title and code of snippets.
+
+The index is the snippets_search table, an SQLite FTS5
+virtual table whose rowid is the snippet's id (see
+migration 0005). It keeps its own copy of the text, so
+that a snippet's entry can be replaced knowing only its
+id. Saving or deleting a Snippet updates its entry; writes
+that skip save() and delete(), such as bulk_create() or
+QuerySet.update(), leave the index stale until
+
+  python manage.py rebuild_snippet_search
+
+The default unicode61 tokenizer splits identifiers at
+underscores and dots, so "lexer" finds get_lexer_by_name.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from snippets.models import Snippet
+
+TABLE = 'snippets_search'
+
+# Weights of the title and code columns in the ranking.
+TITLE_WEIGHT = 10.0
+CODE_WEIGHT = 1.0
+
+# Tokens of context in each excerpt.
+EXCERPT_TOKENS = 16
+
+# Marks around the matched terms in an excerpt, before the
+# excerpt is escaped and they are turned into <mark> tags.
+_MATCH_START, _MATCH_END = '\x02', '\x03'
+
+# Control characters, which are never part of a word; FTS5
+# reads a NUL as the end of the expression.
+_CONTROL_CHARACTERS = re.compile('[\x00-\x1f\x7f-\x9f]')
+
+
+def index_snippets(rows):
+  """Add or replace the entries for (id, title, code) rows."""
+  rows = list(rows)
+  with connection.cursor() as cursor:
+    cursor.executemany(
+      f'DELETE FROM {TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+    cursor.executemany(
+      f'INSERT INTO {TABLE} (rowid, title, code) VALUES (%s, %s, %s)', rows)
+
+
+def unindex_snippets(ids):
+  with connection.cursor() as cursor:
+    cursor.executemany(
+      f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+
+def clear_index():
+  with connection.cursor() as cursor:
+    cursor.execute(f'DELETE FROM {TABLE}')
+
+
+@receiver(post_save, sender=Snippet)
+def index_saved_snippet(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+  if raw:
+    # Loading a fixture; see rebuild_snippet_search.
+    return
+  if update_fields is not None and not {'title', 'code'} & update_fields:
+    return
+  index_snippets([(instance.pk, instance.title, instance.code)])
+
+
+# Also sent for snippets deleted along with their owner.
+@receiver(post_delete, sender=Snippet)
+def unindex_deleted_snippet(sender, instance, **kwargs):
+  unindex_snippets([instance.pk])
+
+
+def match_expression(query):
+  """
+  Turn a search box query into an FTS5 MATCH expression
+  matching snippets that contain every word of it.
+
+  Each word is quoted, so that punctuation and FTS5
+  operators in it are searched for rather than parsed.
+  A trailing * keeps its meaning of "words starting with".
+  Control characters separate words.
+  """
+  terms = []
+  for word in _CONTROL_CHARACTERS.sub(' ', query).split():
+    prefix = word.endswith('*') and len(word) > 1
+    word = word.rstrip('*') if prefix else word
+    terms.append('"%s"%s' % (word.replace('"', '""'), '*' if prefix else ''))
+  return ' '.join(terms)
+
+
+def search_snippets(query, language=None, limit=10, offset=0):
+  """
+  Return the snippets matching `query`, best first, with
+  two extra attributes:
+
+  * score: how well the snippet matches, higher is better;
+  * excerpt: HTML of the best matching part of the title
+    or code, with the matched terms in <mark> tags.
+
+  The snippets' code and highlighted HTML are not loaded.
+  """
+  expression = match_expression(query)
+  if not expression:
+    return []
+
+  language_filter = 'AND s.language = %s' if language else ''
+  sql = f'''
+    SELECT s.id, s.created, s.title, s.linenos, s.language, s.style,
+           s.owner_id, s.render_state, s.render_digest,
+           -bm25({TABLE}, %s, %s) AS score,
+           snippet({TABLE}, -1, %s, %s, '…', %s) AS excerpt
+    FROM {TABLE} JOIN snippets_snippet s ON s.id = {TABLE}.rowid
+    WHERE {TABLE} MATCH %s {language_filter}
+    ORDER BY score DESC, s.id
+    LIMIT %s OFFSET %s
+  '''
+  params = [
+    TITLE_WEIGHT, CODE_WEIGHT, _MATCH_START, _MATCH_END, EXCERPT_TOKENS,
+    expression, *([language] if language else []), limit, offset]
+
+  snippets = list(Snippet.objects.raw(sql, params))
+  for snippet in snippets:
+    snippet.excerpt = html.escape(snippet.excerpt).replace(
+      _MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+  return snippets
@@ -1,6 +1,56 @@
+import operator
+
 from rest_framework import serializers
-from snippets.models import Snippet, LANGUAGE_CHOICES, STYLE_CHOICES
+from snippets.models import (
+  HEAVY_FIELDS, Snippet, SnippetRevision, LANGUAGE_CHOICES, STYLE_CHOICES,
+  stored_html)
 from django.contrib.auth.models import User
+from snippets.bulk import save_snippets
+from snippets.detection import AUTO_LANGUAGE, language_detector
+
+# Purpose: To create or update many snippets in one request
+# (SnippetSerializer(..., many=True)). Every item is
+# validated before any is saved, and the errors are listed
+# item by item; the snippets are then saved in bulk (see
+# snippets/bulk.py).
+class SnippetListSerializer(serializers.ListSerializer):
+  def to_internal_value(self, data):
+    # The ids of the items validated so far.
+    self._updated_ids = set()
+    return super().to_internal_value(data)
+
+  def run_child_validation(self, data):
+    if self.instance is None:
+      return super().run_child_validation(data)
+
+    # Updates name the snippet they update by its id.
+    snippet = self.instance.get(data.get('id')) \
+      if isinstance(data, dict) and isinstance(data.get('id'), int) else None
+    if snippet is None:
+      raise serializers.ValidationError({'id': ['No such snippet.']})
+    if snippet.pk in self._updated_ids:
+      # Its search entry and revision would be written twice.
+      raise serializers.ValidationError(
+        {'id': ['This snippet is updated by an earlier item.']})
+    self._updated_ids.add(snippet.pk)
+    self.child.instance = snippet
+    return {**super().run_child_validation(data), 'id': data['id']}
+
+  def create(self, validated_data):
+    return save_snippets([Snippet(**attrs) for attrs in validated_data])
+
+  def update(self, instance, validated_data):
+    """
+    Update the snippets of `instance`, {id: Snippet}, from
+    the validated items."""
+    snippets = []
+    for attrs in validated_data:
+      snippet = instance[attrs.pop('id')]
+      for name, value in attrs.items():
+        setattr(snippet, name, value)
+      snippets.append(snippet)
+    return save_snippets(snippets)
+
 
 # Purpose: To serialize and deserialize the snippet
 # instances into representations such as json.
@@ -20,12 +70,27 @@ class SnippetSerializer(serializers.Serializer):
 
   linenos = serializers.BooleanField(required=False)
 
+  # "auto" guesses it from the code (see snippets/detection.py).
   language = serializers.ChoiceField(
-    choices=LANGUAGE_CHOICES, default='python')
+    choices=[(AUTO_LANGUAGE, 'Detect automatically'), *LANGUAGE_CHOICES],
+    default='python')
 
   style = serializers.ChoiceField(
     choices=STYLE_CHOICES, default='friendly')
 
+  # "pending" until the highlighted HTML has been rendered
+  # in the background, then "ready" (or "failed").
+  render_state = serializers.CharField(read_only=True)
+
+  class Meta:
+    list_serializer_class = SnippetListSerializer
+
+  def validate(self, attrs):
+    if attrs.get('language') == AUTO_LANGUAGE:
+      code = attrs.get('code', self.instance.code if self.instance else '')
+      attrs['language'] = language_detector.detect(code)
+    return attrs
+
   # Note that either create() or update() is
   # invoked when serializer.save() is called.
 
@@ -49,6 +114,106 @@ class SnippetSerializer(serializers.Serializer):
     instance.save()
     return instance
 
+# Purpose: To list snippets without their code, so that
+# listings only read the lightweight columns (see
+# SnippetQuerySet.summaries()).
+class SnippetSummarySerializer(SnippetSerializer):
+  # Only shown when asked for with ?expand=highlighted.
+  highlighted = serializers.CharField(
+    source='highlighted_html', read_only=True)
+
+  def __init__(self, *args, expand=(), **kwargs):
+    super().__init__(*args, **kwargs)
+    for name in HEAVY_FIELDS:
+      if name not in expand:
+        self.fields.pop(name)
+
+# Purpose: To list snippets quickly. For each .values() row
+# of snippets, it returns what SnippetSummarySerializer
+# would for the snippet, using a converter chosen once per
+# field rather than DRF's per field, per row dispatch
+# through get_attribute() and to_representation(), which
+# costs most of the time of a large page.
+class SnippetRowSerializer:
+  # Sources of SnippetSummarySerializer that are computed
+  # rather than columns: the columns they are computed from,
+  # and how.
+  computed_sources = {
+    'highlighted_html': (
+      ('highlighted', 'render_state', 'render_digest'),
+      lambda row: stored_html(
+        row['highlighted'], row['render_state'], row['render_digest'])),
+  }
+
+  def __init__(self, expand=()):
+    self.value_fields = []
+    self.accessors = []
+    for name, field in SnippetSummarySerializer(expand=expand).fields.items():
+      if field.write_only:
+        continue
+      if field.source in self.computed_sources:
+        columns, get = self.computed_sources[field.source]
+      else:
+        columns, get = (field.source,), operator.itemgetter(field.source)
+      self.value_fields += [
+        column for column in columns if column not in self.value_fields]
+      self.accessors.append((name, get, self.converter(field)))
+
+  @staticmethod
+  def converter(field):
+    """
+    A function returning field.to_representation(value),
+    for the values a .values() row holds."""
+    if type(field) in (serializers.IntegerField, serializers.CharField):
+      return int if type(field) is serializers.IntegerField else str
+    if type(field) is serializers.BooleanField and not field.allow_null:
+      # Columns hold bools; to_representation() also
+      # accepts strings such as "yes".
+      return bool
+    if type(field) is serializers.ChoiceField:
+      choices = field.choice_strings_to_values
+      return lambda value: choices.get(str(value), value) \
+        if value != '' else value
+    return field.to_representation
+
+  def to_representation(self, rows):
+    """The representation of each of `rows`, as a list."""
+    accessors = self.accessors
+    data = []
+    for row in rows:
+      item = {}
+      for name, get, convert in accessors:
+        value = get(row)
+        # As Serializer.to_representation() does.
+        item[name] = None if value is None else convert(value)
+      data.append(item)
+    return data
+
+# Purpose: To list the results of a full-text search (see
+# snippets/search.py), with how well each one matched.
+class SnippetSearchResultSerializer(SnippetSummarySerializer):
+  score = serializers.FloatField(read_only=True)
+  excerpt = serializers.CharField(read_only=True)
+
+# Purpose: To list the revisions of a snippet (see
+# snippets/revisions.py), without their code, which is
+# rebuilt from deltas for each one shown.
+class SnippetRevisionSerializer(serializers.ModelSerializer):
+  class Meta:
+    model = SnippetRevision
+    fields = [
+      'number', 'created', 'title', 'linenos', 'language', 'style', 'size']
+    read_only_fields = fields
+
+# Purpose: To show one revision of a snippet, with its
+# code, as rebuilt by revisions.revision_code().
+class SnippetRevisionDetailSerializer(SnippetRevisionSerializer):
+  code = serializers.CharField(read_only=True)
+
+  class Meta(SnippetRevisionSerializer.Meta):
+    fields = [*SnippetRevisionSerializer.Meta.fields, 'code']
+    read_only_fields = fields
+
 # ModelSerializer classes are simply a shortcut
 # for creating serializer classes:
 # An automatically determined set of fields.
@@ -62,13 +227,13 @@ class SnippetSerializer(serializers.Serializer):
 #     model = Snippet
 #     fields = ['id', 'title', 'code', 'linenos', 'language', 'style', 'owner']
 
-# class UserSerializer(serializers.ModelSerializer):
-#     snippets = serializers.PrimaryKeyRelatedField(many=True, queryset=Snippet.objects.all())
+class UserSerializer(serializers.ModelSerializer):
+    snippets = serializers.PrimaryKeyRelatedField(many=True, queryset=Snippet.objects.all())
 
-#     class Meta:
-#       model = User
-#       # Because 'snippets' is a reverse relationship on the
-#       # User model, it will not be included by default when
-#       # using the ModelSerializer class, so we needed to add
-#       # an explicit field for it.
-#       fields = ['id', 'username', 'snippets']
\ No newline at end of file
+    class Meta:
+      model = User
+      # Because 'snippets' is a reverse relationship on the
+      # User model, it will not be included by default when
+      # using the ModelSerializer class, so we needed to add
+      # an explicit field for it.
+      fields = ['id', 'username', 'snippets']
\ No newline at end of file
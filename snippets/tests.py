@@ -1,3 +1,1462 @@
-from django.test import TestCase
+import json
+import tempfile
+from base64 import urlsafe_b64encode
+from io import StringIO
+from itertools import combinations
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from snippets.bulk import save_snippets
+from snippets.checks import check_detection_candidates
+from snippets.choices import build_manifest, read_manifest
+from snippets.detection import language_detector
+from snippets.highlighting import (
+  render_digest, render_html, render_window, split_lines, style_css)
+from snippets.html_store import get_file_store
+from snippets.models import (
+  RenderCacheEntry, RenderChunk, Snippet, SnippetRevision)
+from snippets.render_cache import render_cache, render_cached
+from snippets.rendering import render_pipeline, render_snippets
+from snippets.revisions import apply_delta, make_delta, revision_code
+from snippets.search import search_snippets
+from snippets.serializers import (
+  SnippetRowSerializer, SnippetSerializer, SnippetSummarySerializer)
+from snippets.views import SnippetBulk
+
+CODE = "def hello():\n    return 'world'\n"
+
+
+def create_snippet(owner, **fields):
+  return Snippet.objects.create(owner=owner, **{"code": CODE, **fields})
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class SynchronousRenderTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+
+  def test_save_renders_inline(self):
+    owner = User.objects.create_user("owner")
+    snippet = create_snippet(owner, title="Hello")
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertEqual(
+      snippet.highlighted, render_html(CODE, "python", "friendly", False, "Hello"))
+    self.assertEqual(
+      snippet.render_digest,
+      render_digest(CODE, "python", "friendly", False, "Hello"))
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": False})
+class BackgroundRenderTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+
+  def test_save_stores_pending_snippet(self):
+    with self.captureOnCommitCallbacks() as callbacks:
+      snippet = create_snippet(self.owner)
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.PENDING)
+    self.assertEqual(snippet.highlighted, "")
+    # The render is handed to the pool once committed.
+    self.assertEqual(len(callbacks), 1)
+
+  def test_render_snippets_command(self):
+    snippet = create_snippet(self.owner)
+
+    call_command("render_snippets", stdout=StringIO())
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertIn("hello", snippet.highlighted)
+
+  def test_api_exposes_render_state(self):
+    snippet = create_snippet(self.owner)
+
+    response = self.client.get(f"/snippets/{snippet.pk}/")
+    self.assertEqual(response.json()["render_state"], Snippet.PENDING)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": False, "WORKERS": 1})
+class RenderPipelineTests(TransactionTestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+    self.addCleanup(render_pipeline.shutdown)
+
+  def test_worker_renders_snippet(self):
+    snippet = create_snippet(self.owner)
+    render_pipeline.submit(
+      snippet.pk, snippet.render_digest, snippet.render_inputs()).result(30)
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertEqual(snippet.highlighted, render_html(*snippet.render_inputs()))
+
+  def test_stale_render_is_discarded(self):
+    snippet = create_snippet(self.owner)
+    stale = (snippet.pk, snippet.render_digest, snippet.render_inputs())
+
+    snippet.code = "print('newer')\n"
+    snippet.save()
+    render_pipeline.submit(*stale).result(30)
+    # Let the newer render, queued by save(), finish too.
+    render_pipeline.shutdown()
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertIn("newer", snippet.highlighted)
+    self.assertNotIn("hello", snippet.highlighted)
+
+
+class RenderCacheTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True})
+  def test_identical_snippets_are_rendered_once(self):
+    first = create_snippet(self.owner)
+    second = create_snippet(self.owner)
+
+    self.assertEqual(first.highlighted, second.highlighted)
+    stats = render_cache.stats()
+    self.assertEqual(stats["misses"], 1)
+    self.assertEqual(stats["memory_hits"], 1)
+    self.assertEqual(stats["hit_ratio"], 0.5)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True})
+  def test_render_options_are_part_of_the_key(self):
+    first = create_snippet(self.owner)
+    second = create_snippet(self.owner, title="Titled")
+
+    self.assertNotEqual(first.highlighted, second.highlighted)
+    self.assertEqual(render_cache.stats()["misses"], 2)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": False})
+  def test_cached_render_skips_the_pipeline(self):
+    render_cache.set(
+      render_digest(CODE, "python", "friendly", False, ""), "<pre>cached</pre>")
+
+    with self.captureOnCommitCallbacks() as callbacks:
+      snippet = create_snippet(self.owner)
+
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertEqual(snippet.highlighted, "<pre>cached</pre>")
+    self.assertEqual(callbacks, [])
+
+  @override_settings(SNIPPETS_RENDER_CACHE={
+    "MEMORY_ENTRIES": 2, "PERSISTENT": False, "EVICTION": "lru"})
+  def test_lru_eviction(self):
+    render_cache.set("a", "A")
+    render_cache.set("b", "B")
+    render_cache.get("a")
+    render_cache.set("c", "C")
+
+    self.assertEqual(render_cache.get("a"), "A")
+    self.assertIsNone(render_cache.get("b"))
+    self.assertEqual(render_cache.get("c"), "C")
+
+  @override_settings(SNIPPETS_RENDER_CACHE={
+    "MEMORY_ENTRIES": 2, "PERSISTENT": False, "EVICTION": "fifo"})
+  def test_fifo_eviction(self):
+    render_cache.set("a", "A")
+    render_cache.set("b", "B")
+    render_cache.get("a")
+    render_cache.set("c", "C")
+
+    self.assertIsNone(render_cache.get("a"))
+    self.assertEqual(render_cache.get("b"), "B")
+
+  @override_settings(SNIPPETS_RENDER_CACHE={
+    "MEMORY_SIZE": 10, "PERSISTENT": False})
+  def test_memory_size_limit(self):
+    render_cache.set("a", "A" * 6)
+    render_cache.set("b", "B" * 6)
+    render_cache.set("huge", "H" * 11)
+
+    self.assertIsNone(render_cache.get("a"))
+    self.assertIsNone(render_cache.get("huge"))
+    self.assertEqual(render_cache.stats()["memory_size"], 6)
+
+  def test_persistent_tier(self):
+    render_cache.set("a", "A")
+    render_cache.clear()
+
+    self.assertEqual(render_cache.get("a"), "A")
+    self.assertEqual(render_cache.stats()["persistent_hits"], 1)
+    # Now back in memory.
+    self.assertEqual(render_cache.get("a"), "A")
+    self.assertEqual(render_cache.stats()["memory_hits"], 1)
+
+  def test_get_many(self):
+    render_cache.set("a", "A")
+    render_cache.set("b", "B")
+    render_cache.clear()
+    render_cache.get("a")
+
+    with self.assertNumQueries(2):
+      found = render_cache.get_many(["a", "b", "c"])
+    self.assertEqual(found, {"a": "A", "b": "B"})
+    stats = render_cache.stats()
+    self.assertEqual(
+      (stats["memory_hits"], stats["persistent_hits"], stats["misses"]),
+      (1, 2, 1))
+
+  @override_settings(SNIPPETS_RENDER_CACHE={"PERSISTENT_ENTRIES": 2})
+  def test_persistent_eviction(self):
+    for digest in "abc":
+      render_cache.set(digest, digest.upper())
+
+    self.assertEqual(
+      list(RenderCacheEntry.objects.values_list("digest", flat=True)
+           .order_by("digest")),
+      ["b", "c"])
+
+  def test_stats_endpoint_is_staff_only(self):
+    self.assertEqual(self.client.get("/render-cache/").status_code, 403)
+
+    self.client.force_login(
+      User.objects.create_superuser("admin", "admin@example.com", "x"))
+    response = self.client.get("/render-cache/")
+    self.assertEqual(response.status_code, 200)
+    self.assertIn("hit_ratio", response.json())
+
+
+class ChoicesTests(TestCase):
+  def test_manifest_matches_installed_pygments(self):
+    # Fails after a Pygments upgrade until the manifest is
+    # regenerated with "manage.py update_pygments_manifest".
+    self.assertEqual(read_manifest(), build_manifest())
+
+  def test_serializer_validates_choices(self):
+    valid = SnippetSerializer(
+      data={"code": CODE, "language": "rust", "style": "monokai"})
+    self.assertTrue(valid.is_valid(), valid.errors)
+
+    invalid = SnippetSerializer(
+      data={"code": CODE, "language": "klingon", "style": "nope"})
+    self.assertFalse(invalid.is_valid())
+    self.assertEqual(set(invalid.errors), {"language", "style"})
+
+  def test_serializer_defaults(self):
+    serializer = SnippetSerializer(data={"code": CODE})
+    self.assertTrue(serializer.is_valid(), serializer.errors)
+    self.assertEqual(serializer.validated_data["language"], "python")
+    self.assertEqual(serializer.validated_data["style"], "friendly")
+
+
+SAMPLES = {
+  "python": "import os\n\n\ndef main():\n    for name in os.listdir('.'):\n"
+            "        print(name)\n    return None\n",
+  "javascript": "function main() {\n  const names = [];\n"
+                "  for (let i = 0; i < 3; i++) {\n    names.push(i);\n  }\n"
+                "  return names;\n}\n",
+  "c": "#include <stdio.h>\n\nint main(void) {\n  printf(\"hi\\n\");\n"
+       "  return 0;\n}\n",
+  "json": '{"name": "snippets", "tags": ["a", "b"], "count": 2}\n',
+}
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class LanguageDetectionTests(TestCase):
+  def setUp(self):
+    language_detector.clear()
+
+  def test_guesses(self):
+    for language, code in SAMPLES.items():
+      self.assertEqual(language_detector.detect(code), language)
+    # Nothing any candidate recognises.
+    self.assertEqual(language_detector.detect(""), "text")
+
+  def test_guesses_are_remembered(self):
+    language_detector.detect(SAMPLES["python"])
+    with patch("snippets.detection.score") as score:
+      self.assertEqual(language_detector.detect(SAMPLES["python"]), "python")
+    score.assert_not_called()
+
+  @override_settings(SNIPPETS_LANGUAGE_DETECTION={"TIME_BUDGET": 0})
+  def test_time_budget(self):
+    with patch("snippets.detection.score", return_value=1) as score:
+      self.assertEqual(language_detector.detect(SAMPLES["c"]), "python")
+    # The budget is checked after each candidate.
+    self.assertEqual(score.call_count, 1)
+
+  @override_settings(SNIPPETS_LANGUAGE_DETECTION={"MEMO_ENTRIES": 1})
+  def test_memo_is_bounded(self):
+    language_detector.detect(SAMPLES["python"])
+    language_detector.detect(SAMPLES["c"])
+    with patch("snippets.detection.score", return_value=1) as score:
+      language_detector.detect(SAMPLES["python"])
+    score.assert_called()
+
+  def test_auto_language(self):
+    serializer = SnippetSerializer(
+      data={"code": SAMPLES["javascript"], "language": "auto"})
+    self.assertTrue(serializer.is_valid(), serializer.errors)
+    self.assertEqual(serializer.validated_data["language"], "javascript")
+
+    owner = User.objects.create_superuser("owner")
+    self.client.force_login(owner)
+    with self.settings(QUERY_BUDGET_ACTION="log"):
+      response = self.client.post(
+        "/snippets/", {"code": SAMPLES["c"], "language": "auto"},
+        content_type="application/json")
+    self.assertEqual(response.json()["language"], "c")
+
+    # An update with "auto" guesses from the code it keeps.
+    snippet = Snippet.objects.get()
+    serializer = SnippetSerializer(
+      snippet, data={"language": "auto"}, partial=True)
+    self.assertTrue(serializer.is_valid(), serializer.errors)
+    self.assertEqual(serializer.validated_data["language"], "c")
+
+  @override_settings(SNIPPETS_LANGUAGE_DETECTION={"CANDIDATES": ["python", "klingon"]})
+  def test_unknown_candidates_are_reported(self):
+    [warning] = check_detection_candidates(None)
+    self.assertEqual(warning.id, "snippets.W002")
+    self.assertIn("klingon", warning.msg)
+
+
+class FragmentTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "FULL_DOCUMENT": False})
+  def test_fragment_mode_stores_no_css(self):
+    snippet = create_snippet(self.owner, title="Hello")
+
+    self.assertTrue(snippet.highlighted.startswith('<div class="highlight">'))
+    self.assertNotIn("<style", snippet.highlighted)
+    self.assertNotIn("Hello", snippet.highlighted)
+
+  def test_style_stylesheet(self):
+    response = self.client.get("/snippets/styles/monokai.css")
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["Content-Type"], "text/css")
+    self.assertEqual(response.content.decode(), style_css("monokai"))
+    self.assertIn("max-age=86400", response["Cache-Control"])
+
+    cached = self.client.get(
+      "/snippets/styles/monokai.css", HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(cached.status_code, 304)
+
+  def test_unknown_style(self):
+    response = self.client.get("/snippets/styles/nope.css")
+    self.assertEqual(response.status_code, 404)
+
+  def test_rewrite_command(self):
+    with override_settings(SNIPPETS_RENDER={"SYNC": True}):
+      full = create_snippet(self.owner, title="Full")
+
+    stdout = StringIO()
+    with override_settings(SNIPPETS_RENDER={"FULL_DOCUMENT": False}):
+      call_command("rewrite_snippet_html", stdout=stdout)
+      full.refresh_from_db()
+      self.assertEqual(full.render_digest, render_digest(*full.render_inputs()))
+
+    self.assertEqual(full.render_state, Snippet.READY)
+    self.assertTrue(full.highlighted.startswith('<div class="highlight">'))
+    self.assertIn("Rewrote 1 snippet:", stdout.getvalue())
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True})
+  def test_rewrite_command_skips_current_rows(self):
+    create_snippet(self.owner)
+
+    stdout = StringIO()
+    call_command("rewrite_snippet_html", "--dry-run", stdout=stdout)
+    self.assertIn("Would rewrite 0 snippets", stdout.getvalue())
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "CHUNK_LINES": 3})
+  def test_rewrite_dry_run_writes_nothing(self):
+    snippet = create_snippet(self.owner, code=LONG_CODE)
+    html = Snippet.objects.get(pk=snippet.pk).highlighted_html()
+    entries = set(RenderCacheEntry.objects.values_list("digest", flat=True))
+
+    stdout = StringIO()
+    with self.settings(
+        SNIPPETS_RENDER={"FULL_DOCUMENT": False, "CHUNK_LINES": 3}):
+      call_command("rewrite_snippet_html", "--dry-run", stdout=stdout)
+    # The chunked HTML is measured, not the empty column.
+    self.assertIn(f"{len(html)} characters of HTML", stdout.getvalue())
+    self.assertEqual(
+      set(RenderCacheEntry.objects.values_list("digest", flat=True)), entries)
+    self.assertEqual(
+      Snippet.objects.get(pk=snippet.pk).render_digest, snippet.render_digest)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class SnippetListTests(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    cls.owner = User.objects.create_superuser("owner")
+    for n in range(3):
+      create_snippet(cls.owner, title=f"Snippet {n}")
+
+  def get_selected_columns(self, url):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(url)
+    self.assertEqual(response.status_code, 200)
+    snippet_queries = [
+      query["sql"] for query in queries
+      if 'FROM "snippets_snippet"' in query["sql"]]
+    return response, " ".join(snippet_queries)
+
+  def test_list_leaves_out_heavy_fields(self):
+    response, sql = self.get_selected_columns("/snippets/")
+    self.assertNotIn('"code"', sql)
+    self.assertNotIn('"highlighted"', sql)
+
+    snippet = response.json()["results"][0]
+    self.assertEqual(snippet["title"], "Snippet 0")
+    self.assertNotIn("code", snippet)
+    self.assertNotIn("highlighted", snippet)
+
+  def test_list_runs_no_query_per_snippet(self):
+    with self.assertNumQueries(1):
+      self.client.get("/snippets/")
+
+  def test_expand(self):
+    response, sql = self.get_selected_columns("/snippets/?expand=code")
+    self.assertIn('"code"', sql)
+    self.assertNotIn('"highlighted"', sql)
+    snippet = response.json()["results"][0]
+    self.assertEqual(snippet["code"], CODE)
+    self.assertNotIn("highlighted", snippet)
+
+    response = self.client.get("/snippets/?expand=code,highlighted")
+    snippet = response.json()["results"][0]
+    self.assertIn("<pre", snippet["highlighted"])
+
+  def test_expand_unknown_field(self):
+    response = self.client.get("/snippets/?expand=owner")
+    self.assertEqual(response.status_code, 400)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "CHUNK_LINES": 2})
+  def test_row_serializer_matches_summary_serializer(self):
+    create_snippet(
+      self.owner, title="Ünïcödé \"quoted\" <b>", code="x = '€'\n" * 3,
+      linenos=True, language="javascript", style="monokai")
+    create_snippet(self.owner, title="", code="  indented\t\n")
+    pending = create_snippet(self.owner, code="pending()")
+    failed = create_snippet(self.owner, code="failed()")
+    Snippet.objects.filter(pk=pending.pk).update(
+      render_state=Snippet.PENDING, highlighted="")
+    Snippet.objects.filter(pk=failed.pk).update(render_state=Snippet.FAILED)
+
+    renderer = JSONRenderer()
+    for expand in [(), ("code",), ("highlighted",), ("code", "highlighted")]:
+      serializer = SnippetRowSerializer(expand=expand)
+      rows = Snippet.objects.values(*serializer.value_fields)
+      snippets = Snippet.objects.all()
+      self.assertEqual(
+        renderer.render(serializer.to_representation(rows)),
+        renderer.render(
+          SnippetSummarySerializer(snippets, many=True, expand=expand).data),
+        expand)
+
+    # And as the list's pages.
+    response = self.client.get("/snippets/?expand=code,highlighted&page_size=3")
+    self.assertEqual(
+      response.json()["results"],
+      SnippetSummarySerializer(
+        Snippet.objects.all()[:3], many=True,
+        expand=("code", "highlighted")).data)
+    response = self.client.get(response.json()["next"])
+    self.assertEqual(len(response.json()["results"]), 3)
+
+  # Creating a snippet runs more queries than listing them,
+  # which is all SnippetList's budget covers.
+  @override_settings(QUERY_BUDGET_ACTION="log")
+  def test_detail_and_create_include_code(self):
+    snippet = Snippet.objects.first()
+    self.assertEqual(
+      self.client.get(f"/snippets/{snippet.pk}/").json()["code"], CODE)
+
+    self.client.force_login(self.owner)
+    response = self.client.post(
+      "/snippets/", {"code": "print(1)"}, content_type="application/json")
+    self.assertEqual(response.json()["code"], "print(1)")
+
+  def test_admin_changelist_leaves_out_heavy_fields(self):
+    self.client.force_login(self.owner)
+    response, sql = self.get_selected_columns("/admin/snippets/snippet/")
+    self.assertContains(response, "Snippet 0")
+    self.assertNotIn('"code"', sql)
+    self.assertNotIn('"highlighted"', sql)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class KeysetPaginationTests(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    cls.owner = User.objects.create_user("owner")
+    cls.snippets = [
+      create_snippet(cls.owner, title=f"Snippet {n}") for n in range(7)]
+
+  def walk(self, url):
+    """Follow the next links from `url`; return the pages' ids."""
+    pages = []
+    while url:
+      data = self.client.get(url).json()
+      pages.append([snippet["id"] for snippet in data["results"]])
+      url = data["next"]
+    return pages
+
+  def test_walks_every_snippet_once(self):
+    pages = self.walk("/snippets/?page_size=3")
+    self.assertEqual(
+      pages, [[s.pk for s in self.snippets[i:i + 3]] for i in (0, 3, 6)])
+
+  def test_ties_are_broken_by_id(self):
+    Snippet.objects.update(created=timezone.now())
+    pages = self.walk("/snippets/?page_size=2")
+    self.assertEqual(
+      sum(pages, []), sorted(snippet.pk for snippet in self.snippets))
+
+  def test_stable_across_inserts(self):
+    first = self.client.get("/snippets/?page_size=3").json()
+
+    # A snippet inserted before the cursor does not shift the
+    # next page, as an offset would.
+    earliest = create_snippet(self.owner, title="Late but early")
+    Snippet.objects.filter(pk=earliest.pk).update(
+      created=self.snippets[0].created - timezone.timedelta(days=1))
+
+    second = self.client.get(first["next"]).json()
+    self.assertEqual(
+      [snippet["id"] for snippet in second["results"]],
+      [snippet.pk for snippet in self.snippets[3:6]])
+
+  def test_previous_link(self):
+    first = self.client.get("/snippets/?page_size=3").json()
+    self.assertIsNone(first["previous"])
+
+    second = self.client.get(first["next"]).json()
+    back = self.client.get(second["previous"]).json()
+    self.assertEqual(back["results"], first["results"])
+    self.assertIsNone(back["previous"])
+
+  def test_count_is_opt_in(self):
+    self.assertNotIn("count", self.client.get("/snippets/").json())
+    self.assertEqual(
+      self.client.get("/snippets/?count=true").json()["count"], 7)
+
+  def test_invalid_cursor(self):
+    response = self.client.get("/snippets/?cursor=nonsense")
+    self.assertEqual(response.status_code, 404)
+
+  def test_cursor_values_are_validated(self):
+    created = self.snippets[0].created.isoformat()
+    for position in [
+        ["garbage", 1], [None, None], [created, "one"], [created, 2 ** 80],
+        [created, [1]], [{}, 1]]:
+      cursor = urlsafe_b64encode(
+        json.dumps({"d": "next", "p": position}).encode()).decode()
+      with self.subTest(position=position):
+        response = self.client.get("/snippets/", {"cursor": cursor})
+        self.assertEqual(response.status_code, 404)
+
+    cursor = urlsafe_b64encode(json.dumps(
+      {"d": "next", "p": [created, self.snippets[0].pk]}).encode()).decode()
+    response = self.client.get("/snippets/", {"cursor": cursor})
+    self.assertEqual(
+      [snippet["id"] for snippet in response.json()["results"]],
+      [snippet.pk for snippet in self.snippets[1:]])
+
+  def test_users_are_paginated_by_id(self):
+    """
+    /users/, served by the router's UserViewSet, pages newest
+    first by id, without COUNT(*) or OFFSET.
+    """
+    for n in range(3):
+      User.objects.create_user(f"user{n}")
+    self.client.force_login(self.owner)
+
+    names, url = [], "/users/?page_size=2"
+    while url:
+      with CaptureQueriesContext(connection) as queries:
+        data = self.client.get(url).json()
+      self.assertFalse([
+        query for query in queries
+        if "COUNT(" in query["sql"] or "OFFSET" in query["sql"]])
+      names += [user["username"] for user in data["results"]]
+      last, url = data, data["next"]
+    self.assertEqual(names, list(User.objects.order_by("-id").values_list(
+      "username", flat=True)))
+
+    previous = self.client.get(last["previous"]).json()
+    self.assertEqual(
+      [user["username"] for user in previous["results"]], names[-4:-2])
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class SearchTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+
+  def search(self, query, **kwargs):
+    return [snippet.pk for snippet in search_snippets(query, **kwargs)]
+
+  def test_saving_indexes_the_snippet(self):
+    snippet = create_snippet(self.owner, code="def get_lexer_by_name(): pass")
+    self.assertEqual(self.search("lexer"), [snippet.pk])
+    self.assertEqual(self.search("LEXER name"), [snippet.pk])
+    self.assertEqual(self.search("lexer missing"), [])
+
+  def test_updating_reindexes_the_snippet(self):
+    snippet = create_snippet(self.owner, code="alpha = 1")
+    snippet.code = "beta = 2"
+    snippet.save()
+    self.assertEqual(self.search("alpha"), [])
+    self.assertEqual(self.search("beta"), [snippet.pk])
+
+  def test_deleting_unindexes_the_snippet(self):
+    snippet = create_snippet(self.owner, code="alpha = 1")
+    snippet.delete()
+    create_snippet(self.owner, code="alpha = 2")
+    self.owner.delete()
+    self.assertEqual(self.search("alpha"), [])
+
+  def test_title_matches_rank_first(self):
+    in_code = create_snippet(self.owner, title="Other", code="parser = 1")
+    in_title = create_snippet(self.owner, title="Parser", code="x = 1")
+    self.assertEqual(self.search("parser"), [in_title.pk, in_code.pk])
+
+    scores = [snippet.score for snippet in search_snippets("parser")]
+    self.assertGreater(scores[0], scores[1])
+
+  def test_language_filter(self):
+    create_snippet(self.owner, code="print('hi')")
+    ruby = create_snippet(self.owner, code="print('hi')", language="ruby")
+    self.assertEqual(self.search("print", language="ruby"), [ruby.pk])
+
+  def test_excerpt_is_escaped(self):
+    create_snippet(self.owner, code="<script>alert(1)</script>")
+    [snippet] = search_snippets("alert")
+    self.assertEqual(
+      snippet.excerpt, "&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt;")
+
+  def test_query_syntax_is_not_parsed(self):
+    snippet = create_snippet(self.owner, code='x = "a" AND b - c')
+    for query in ['"a', "AND", "b -c", "NEAR(", "x:"]:
+      self.search(query)
+    self.assertEqual(self.search("hel*"), [])
+    self.assertEqual(self.search("an*"), [snippet.pk])
+
+  def test_control_characters_separate_words(self):
+    snippet = create_snippet(self.owner, code="needle = haystack")
+    self.assertEqual(self.search("needle\x00haystack"), [snippet.pk])
+    self.assertEqual(self.search("\x00"), [])
+
+  def test_rebuild_command(self):
+    # bulk_create() does not index the snippets.
+    Snippet.objects.bulk_create(
+      [Snippet(owner=self.owner, code=f"value_{n} = {n}") for n in range(5)])
+    self.assertEqual(self.search("value_3"), [])
+
+    out = StringIO()
+    call_command("rebuild_snippet_search", batch_size=2, stdout=out)
+    self.assertIn("Indexed 5 snippets.", out.getvalue())
+    self.assertEqual(len(self.search("value_3")), 1)
+
+  def test_search_endpoint(self):
+    for n in range(3):
+      create_snippet(self.owner, title=f"Snippet {n}", code="needle = 1")
+    create_snippet(self.owner, code="haystack = 1")
+
+    first = self.client.get("/snippets/search/?q=needle&page_size=2").json()
+    self.assertEqual(len(first["results"]), 2)
+    self.assertIsNone(first["previous"])
+    result = first["results"][0]
+    self.assertEqual(result["excerpt"], "<mark>needle</mark> = 1")
+    self.assertNotIn("code", result)
+
+    second = self.client.get(first["next"]).json()
+    self.assertEqual(len(second["results"]), 1)
+    self.assertIsNone(second["next"])
+    self.assertEqual(self.client.get(second["previous"]).json(), first)
+
+    self.assertEqual(self.client.get("/snippets/search/").status_code, 400)
+    self.assertEqual(
+      self.client.get("/snippets/search/?q=%00%01").status_code, 400)
+    self.assertEqual(self.client.get(
+      "/snippets/search/?q=needle&offset=9223372036854775808").status_code, 400)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class ConditionalGetTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+    self.snippet = create_snippet(self.owner, title="Hello")
+    self.url = f"/snippets/{self.snippet.pk}/"
+
+  def test_detail_validators(self):
+    response = self.client.get(self.url, HTTP_ACCEPT="application/json")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+      response["ETag"], f'"{self.snippet.content_hash}-ready-json"')
+    self.assertIn("Last-Modified", response)
+    self.assertIn("Accept", response["Vary"])
+
+  def test_detail_not_modified(self):
+    etag = self.client.get(self.url)["ETag"]
+
+    # Only the snippet's version is read.
+    with self.assertNumQueries(1):
+      response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response.content, b"")
+
+    last_modified = self.client.get(self.url)["Last-Modified"]
+    response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    self.assertEqual(response.status_code, 304)
+
+  def test_detail_etag_changes_with_the_snippet(self):
+    etag = self.client.get(self.url)["ETag"]
+
+    self.snippet.code = "print(2)"
+    self.snippet.save()
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response["ETag"], etag)
+
+    # As when a background render finishes.
+    etag = response["ETag"]
+    Snippet.objects.filter(pk=self.snippet.pk).update(
+      render_state=Snippet.FAILED)
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()["render_state"], Snippet.FAILED)
+
+  def test_detail_browsable_api_is_not_cached(self):
+    response = self.client.get(self.url, HTTP_ACCEPT="text/html")
+    self.assertNotIn("ETag", response)
+    self.assertNotIn("Last-Modified", response)
+
+  def test_highlighted(self):
+    url = f"/snippets/{self.snippet.pk}/highlighted/"
+    response = self.client.get(url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response["Content-Type"], "text/html; charset=utf-8")
+    self.assertEqual(response.content.decode(), self.snippet.highlighted)
+    self.assertEqual(response["ETag"], f'"{self.snippet.render_digest}"')
+    self.assertIn("public", response["Cache-Control"])
+    self.assertNotIn("Link", response)
+
+    with self.assertNumQueries(1):
+      response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(response.status_code, 304)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "FULL_DOCUMENT": False})
+  def test_highlighted_fragment_links_its_stylesheet(self):
+    snippet = create_snippet(self.owner, style="monokai")
+    response = self.client.get(f"/snippets/{snippet.pk}/highlighted/")
+    self.assertEqual(
+      response["Link"], "</snippets/styles/monokai.css>; rel=stylesheet")
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": False})
+  def test_highlighted_pending(self):
+    snippet = create_snippet(self.owner, code="print('pending')")
+    response = self.client.get(f"/snippets/{snippet.pk}/highlighted/")
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response["Retry-After"], "5")
+    self.assertNotIn("ETag", response)
+    self.assertIn("no-store", response["Cache-Control"])
+    self.assertNotIn("public", response["Cache-Control"])
+
+    response = self.client.get("/snippets/0/highlighted/")
+    self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class BulkTests(TestCase):
+  url = "/snippets/bulk/"
+
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_superuser("owner")
+    self.client.force_login(self.owner)
+
+  def send(self, method, items):
+    return getattr(self.client, method)(
+      self.url, items, content_type="application/json")
+
+  def test_create(self):
+    items = [{"title": f"File {n}", "code": f"x = {n}"} for n in range(3)]
+    items.append({"code": "x = 0", "language": "ruby"})
+    response = self.send("post", items)
+    self.assertEqual(response.status_code, 201)
+
+    results = response.json()
+    self.assertEqual([result["title"] for result in results][:3],
+                     ["File 0", "File 1", "File 2"])
+    self.assertNotIn("code", results[0])
+
+    snippet = Snippet.objects.get(pk=results[1]["id"])
+    self.assertEqual(snippet.owner, self.owner)
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertEqual(
+      snippet.highlighted, render_html("x = 1", "python", "friendly", False,
+                                       "File 1"))
+    self.assertEqual(snippet.content_hash, Snippet.objects.get(
+      pk=snippet.pk).content_hash)
+    self.assertEqual(
+      [s.pk for s in search_snippets("file 2")], [results[2]["id"]])
+
+  def test_identical_snippets_are_rendered_once(self):
+    self.send("post", [{"code": "x = 1"}] * 5)
+    self.assertEqual(render_cache.stats()["misses"], 1)
+    self.assertEqual(Snippet.objects.filter(render_state=Snippet.READY).count(), 5)
+
+  def test_errors_are_listed_by_item(self):
+    response = self.send(
+      "post", [{"code": "x = 1"}, {"language": "nonsense"}, {"code": "y"}])
+    self.assertEqual(response.status_code, 400)
+    errors = response.json()
+    self.assertEqual(errors[0], {})
+    self.assertEqual(set(errors[1]), {"code", "language"})
+    self.assertEqual(errors[2], {})
+    self.assertFalse(Snippet.objects.exists())
+
+  def test_limits(self):
+    self.assertEqual(self.send("post", {"code": "x"}).status_code, 400)
+    with patch.object(SnippetBulk, "max_items", 2):
+      response = self.send("post", [{"code": "x"}] * 3)
+    self.assertEqual(response.status_code, 400)
+
+    self.client.force_login(User.objects.create_user("reader"))
+    self.assertEqual(self.send("post", [{"code": "x"}]).status_code, 403)
+    self.assertEqual(self.send("put", [{"code": "x"}]).status_code, 403)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": False})
+  def test_create_renders_misses_in_the_background(self):
+    cached = create_snippet(self.owner, code="cached = 1")
+    render_cache.set(cached.render_digest, "<pre>cached</pre>")
+
+    with self.captureOnCommitCallbacks() as callbacks:
+      response = self.send("post", [
+        {"code": "cached = 1"}, {"code": "new = 1"}, {"code": "new = 1"}])
+    states = [result["render_state"] for result in response.json()]
+    self.assertEqual(states, [Snippet.READY, Snippet.PENDING, Snippet.PENDING])
+    # One render for both "new = 1" snippets.
+    self.assertEqual(len(callbacks), 1)
+
+  def test_update(self):
+    first, second = [create_snippet(self.owner, code=f"old_{n} = 1")
+                     for n in range(2)]
+    old_modified = first.modified
+
+    response = self.send("put", [
+      {"id": first.pk, "code": "new_0 = 1", "title": "First"},
+      {"id": second.pk, "code": "new_1 = 1", "style": "monokai"},
+    ])
+    self.assertEqual(response.status_code, 200)
+
+    first.refresh_from_db()
+    self.assertEqual((first.title, first.code), ("First", "new_0 = 1"))
+    self.assertGreater(first.modified, old_modified)
+    self.assertEqual(
+      first.highlighted, render_html("new_0 = 1", "python", "friendly", False,
+                                     "First"))
+    second.refresh_from_db()
+    self.assertEqual(second.style, "monokai")
+    self.assertEqual([s.pk for s in search_snippets("old_0")], [])
+    self.assertEqual([s.pk for s in search_snippets("new_1")], [second.pk])
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "FULL_DOCUMENT": False})
+  def test_update_leaves_unchanged_snippets_alone(self):
+    same = create_snippet(self.owner, code="same = 1")
+    renamed = create_snippet(self.owner, code="renamed = 1")
+    render_cache.clear()
+
+    self.send("put", [
+      {"id": same.pk, "code": "same = 1"},
+      {"id": renamed.pk, "code": "renamed = 1", "title": "Renamed"},
+    ])
+    # Neither snippet's render inputs changed; fragments do
+    # not show the title.
+    self.assertEqual(render_cache.stats()["misses"], 0)
+    self.assertEqual(Snippet.objects.get(pk=same.pk).modified, same.modified)
+    self.assertGreater(
+      Snippet.objects.get(pk=renamed.pk).modified, renamed.modified)
+
+  def test_update_unknown_snippet(self):
+    snippet = create_snippet(self.owner)
+    response = self.send("put", [
+      {"id": snippet.pk, "code": "x"}, {"id": 0, "code": "y"}, {"code": "z"}])
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json(), [
+      {}, {"id": ["No such snippet."]}, {"id": ["No such snippet."]}])
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.code, CODE)
+
+  def test_update_same_snippet_twice(self):
+    snippet = create_snippet(self.owner)
+    response = self.send("put", [
+      {"id": snippet.pk, "code": "x = 1"}, {"id": snippet.pk, "code": "y = 1"}])
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json(), [
+      {}, {"id": ["This snippet is updated by an earlier item."]}])
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.code, CODE)
+    self.assertEqual(snippet.revisions.count(), 1)
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True})
+class DirtyFieldTests(TestCase):
+  # A new value for each field a client can change.
+  CHANGES = {
+    "title": "Changed",
+    "code": "print(2)\n",
+    "linenos": True,
+    "language": "ruby",
+    "style": "monokai",
+    "owner": None,  # Set to another user in setUp().
+  }
+  RENDER_INPUTS = {"code", "linenos", "language", "style"}
+  RENDER_FIELDS = {"highlighted", "render_state", "render_digest"}
+
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+    self.changes = {**self.CHANGES, "owner": User.objects.create_user("other")}
+
+    self.written = []
+    def record(sender, update_fields, **kwargs):
+      self.written.append(update_fields)
+    post_save.connect(record, sender=Snippet)
+    self.addCleanup(post_save.disconnect, record, sender=Snippet)
+
+  def load_snippet(self):
+    snippet = create_snippet(self.owner, title="Hello")
+    self.written.clear()
+    return Snippet.objects.get(pk=snippet.pk)
+
+  def check_combinations(self, full_document):
+    render_inputs = self.RENDER_INPUTS | ({"title"} if full_document else set())
+
+    for size in range(len(self.changes) + 1):
+      for fields in combinations(self.changes, size):
+        with self.subTest(fields=fields):
+          snippet = self.load_snippet()
+          for field in fields:
+            setattr(snippet, field, self.changes[field])
+
+          with patch("snippets.models.render_cached",
+                     wraps=render_cached) as render:
+            snippet.save()
+
+          rerendered = bool(render_inputs & set(fields))
+          self.assertEqual(render.called, rerendered)
+          if not fields:
+            self.assertEqual(self.written, [])
+            continue
+
+          expected = {*fields, "content_hash", "modified"}
+          if rerendered:
+            expected |= self.RENDER_FIELDS
+          self.assertEqual(self.written, [frozenset(expected)])
+
+          stored = Snippet.objects.get(pk=snippet.pk)
+          for field in fields:
+            self.assertEqual(getattr(stored, field), self.changes[field])
+          self.assertEqual(
+            stored.highlighted, render_html(*stored.render_inputs()))
+
+  def test_field_combinations(self):
+    self.check_combinations(full_document=True)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "FULL_DOCUMENT": False})
+  def test_field_combinations_with_fragments(self):
+    self.check_combinations(full_document=False)
+
+  def test_unchanged_snippet_is_not_written(self):
+    snippet = self.load_snippet()
+    snippet.title = "Hello"
+    with self.assertNumQueries(0):
+      snippet.save()
+
+  def test_new_snippet_is_written_in_full(self):
+    create_snippet(self.owner)
+    self.assertEqual(self.written, [None])
+
+  def test_saved_snippet_tracks_its_new_values(self):
+    snippet = self.load_snippet()
+    snippet.code = "print(3)\n"
+    snippet.save()
+    snippet.title = "Again"
+    snippet.save()
+    self.assertEqual(self.written[-1], frozenset(
+      {"title", "content_hash", "modified", *self.RENDER_FIELDS}))
+
+  def test_deferred_fields(self):
+    create_snippet(self.owner)
+    snippet = Snippet.objects.defer("code", "highlighted").get()
+    snippet.style = "monokai"
+    snippet.save()
+    self.assertNotIn("code", self.written[-1])
+    stored = Snippet.objects.get()
+    self.assertEqual(stored.code, CODE)
+    self.assertEqual(stored.highlighted, render_html(*stored.render_inputs()))
+
+  def test_loading_a_deferred_field_keeps_other_changes(self):
+    create_snippet(self.owner, title="Hello")
+    snippet = Snippet.objects.defer("code").get()
+    snippet.title = "New"
+    self.assertEqual(snippet.code, CODE)
+    snippet.save()
+    self.assertEqual(Snippet.objects.get().title, "New")
+
+  def test_explicit_update_fields(self):
+    snippet = self.load_snippet()
+    snippet.title = "Only this"
+    snippet.code = "not this"
+    snippet.save(update_fields=["title"])
+    self.assertEqual(Snippet.objects.get().code, CODE)
+
+    # The code is still unsaved.
+    snippet.save()
+    self.assertEqual(Snippet.objects.get().code, "not this")
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": False, "FULL_DOCUMENT": False})
+  def test_title_change_queues_no_render(self):
+    snippet = self.load_snippet()
+    snippet.title = "Renamed"
+    with self.captureOnCommitCallbacks() as callbacks:
+      snippet.save()
+    self.assertEqual(callbacks, [])
+
+  def test_put_of_the_same_values_keeps_the_etag(self):
+    self.client.force_login(User.objects.create_superuser("admin"))
+    # The serializer strips the code's trailing newline.
+    snippet = create_snippet(self.owner, title="Hello", code="print(1)")
+    self.written.clear()
+    url = f"/snippets/{snippet.pk}/"
+
+    etag = self.client.get(url)["ETag"]
+    response = self.client.put(url, {
+      "title": "Hello", "code": "print(1)", "linenos": False,
+      "language": "python", "style": "friendly",
+    }, content_type="application/json")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.written, [])
+    self.assertEqual(
+      self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class FileStoreTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.root = tempfile.TemporaryDirectory()
+    self.addCleanup(self.root.cleanup)
+    self.use_storage("files")
+    self.store = get_file_store()
+    self.owner = User.objects.create_user("owner")
+
+  def use_storage(self, storage, **render_settings):
+    overridden = self.settings(SNIPPETS_RENDER={
+      "SYNC": True, "STORAGE": storage, "FILE_ROOT": self.root.name,
+      **render_settings})
+    overridden.enable()
+    self.addCleanup(overridden.disable)
+
+  def test_html_is_stored_in_a_file(self):
+    snippet = create_snippet(self.owner, title="Hello")
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.highlighted, "")
+    self.assertEqual(snippet.render_state, Snippet.READY)
+
+    html = render_html(*snippet.render_inputs())
+    self.assertEqual(self.store.read(snippet.render_digest), html)
+    self.assertEqual(snippet.highlighted_html(), html)
+    # The files take the place of the cache table.
+    self.assertFalse(RenderCacheEntry.objects.exists())
+
+    response = self.client.get(
+      "/snippets/", {"expand": "highlighted"}, HTTP_ACCEPT="application/json")
+    self.assertEqual(response.json()["results"][0]["highlighted"], html)
+
+  def test_long_renders_are_not_chunked(self):
+    self.use_storage("files", CHUNK_LINES=3)
+    snippet = create_snippet(self.owner, code=LONG_CODE)
+    self.assertFalse(RenderChunk.objects.exists())
+
+    _, lines, _ = split_lines(self.store.read(snippet.render_digest))
+    response = self.client.get(
+      f"/snippets/{snippet.pk}/highlighted/", {"lines": "3-5"})
+    self.assertEqual(
+      response.content.decode(), render_window(lines[2:5], 3, False))
+
+  def test_render_cache_reads_the_files(self):
+    snippet = create_snippet(self.owner)
+    render_cache.clear()
+    other = create_snippet(self.owner)
+    self.assertEqual(other.render_digest, snippet.render_digest)
+    self.assertEqual(render_cache.stats()["persistent_hits"], 1)
+
+  def test_highlighted_is_served_from_the_file(self):
+    snippet = create_snippet(self.owner)
+    url = f"/snippets/{snippet.pk}/highlighted/"
+
+    response = self.client.get(url)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.streaming)
+    self.assertEqual(response["Content-Type"], "text/html; charset=utf-8")
+    self.assertEqual(
+      b"".join(response.streaming_content).decode(),
+      self.store.read(snippet.render_digest))
+    self.assertEqual(response["ETag"], f'"{snippet.render_digest}"')
+    self.assertIn("public", response["Cache-Control"])
+    self.assertNotIn("Link", response)
+
+    with self.assertNumQueries(1):
+      response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(response.status_code, 304)
+
+  def test_highlighted_fragment_links_its_stylesheet(self):
+    self.use_storage("files", FULL_DOCUMENT=False)
+    snippet = create_snippet(self.owner, style="monokai")
+    response = self.client.get(f"/snippets/{snippet.pk}/highlighted/")
+    response.close()
+    self.assertEqual(
+      response["Link"], "</snippets/styles/monokai.css>; rel=stylesheet")
+
+  def test_missing_file(self):
+    snippet = create_snippet(self.owner)
+    self.store.delete(snippet.render_digest)
+    response = self.client.get(f"/snippets/{snippet.pk}/highlighted/")
+    self.assertEqual(response.status_code, 503)
+
+  def test_bulk_and_background_renders_are_stored_in_files(self):
+    [snippet] = save_snippets([
+      Snippet(owner=self.owner, code="print('bulk')")])
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.highlighted, "")
+    self.assertTrue(self.store.exists(snippet.render_digest))
+
+    self.use_storage("files", SYNC=False)
+    snippet = create_snippet(self.owner, code="print('later')")
+    render_snippets(Snippet.objects.filter(pk=snippet.pk))
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.render_state, Snippet.READY)
+    self.assertEqual(snippet.highlighted, "")
+    self.assertTrue(self.store.exists(snippet.render_digest))
+
+  def test_collect_deletes_unreferenced_files(self):
+    kept = create_snippet(self.owner, code="print('kept')")
+    edited = create_snippet(self.owner, code="print('before')")
+    old_digest = edited.render_digest
+    edited.code = "print('after')"
+    edited.save()
+    deleted = create_snippet(self.owner, code="print('deleted')")
+    deleted_digest = deleted.render_digest
+    deleted.delete()
+
+    # Too recent to be collected yet.
+    call_command("collect_snippet_html", stdout=StringIO())
+    self.assertTrue(self.store.exists(old_digest))
+
+    out = StringIO()
+    call_command("collect_snippet_html", min_age=0, dry_run=True, stdout=out)
+    self.assertIn("Would delete 2 files,", out.getvalue())
+    self.assertTrue(self.store.exists(old_digest))
+
+    call_command("collect_snippet_html", min_age=0, stdout=StringIO())
+    self.assertFalse(self.store.exists(old_digest))
+    self.assertFalse(self.store.exists(deleted_digest))
+    self.assertTrue(self.store.exists(kept.render_digest))
+    self.assertTrue(self.store.exists(edited.render_digest))
+
+  def test_move_between_the_database_and_files(self):
+    self.use_storage("database")
+    snippet = create_snippet(self.owner)
+    html = Snippet.objects.get().highlighted
+    self.assertNotEqual(html, "")
+    self.assertFalse(self.store.exists(snippet.render_digest))
+
+    self.use_storage("files")
+    call_command("move_snippet_html", to="files", stdout=StringIO())
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.highlighted, "")
+    self.assertEqual(self.store.read(snippet.render_digest), html)
+    response = self.client.get(f"/snippets/{snippet.pk}/highlighted/")
+    self.assertEqual(b"".join(response.streaming_content).decode(), html)
+
+    self.use_storage("database")
+    call_command(
+      "move_snippet_html", to="database", stdout=StringIO(),
+      stderr=StringIO())
+    snippet.refresh_from_db()
+    self.assertEqual(snippet.highlighted, html)
+    # Its file is no longer needed.
+    call_command("collect_snippet_html", min_age=0, stdout=StringIO())
+    self.assertFalse(self.store.exists(snippet.render_digest))
+
+  def test_digests_cannot_leave_the_root(self):
+    with self.assertRaises(ValueError):
+      self.store.path("../../etc/passwd")
+
+
+# A string spanning lines 3 to 5, across the chunks of
+# CHUNK_LINES = 3.
+LONG_CODE = "".join([
+  "import os\n",
+  "\n",
+  'TEXT = """one\n',
+  "two\n",
+  'three"""\n',
+  "def main():\n",
+  "    return os.getcwd()\n",
+  "\n",
+  "main()\n",
+  "print(TEXT)\n",
+])
+
+
+@override_settings(SNIPPETS_RENDER={"SYNC": True, "CHUNK_LINES": 3})
+class ChunkTests(TestCase):
+  def setUp(self):
+    render_cache.clear()
+    self.owner = User.objects.create_user("owner")
+    self.snippet = create_snippet(self.owner, code=LONG_CODE)
+    self.html = render_html(*self.snippet.render_inputs())
+    self.url = f"/snippets/{self.snippet.pk}/highlighted/"
+
+  def test_long_renders_are_stored_in_chunks(self):
+    self.snippet.refresh_from_db()
+    self.assertEqual(self.snippet.highlighted, "")
+    chunks = RenderChunk.objects.filter(
+      digest=self.snippet.render_digest).order_by("number")
+    self.assertEqual(
+      [(chunk.first_line, chunk.last_line) for chunk in chunks],
+      [(None, None), (1, 3), (4, 6), (7, 9), (10, 10), (None, None)])
+    self.assertEqual("".join(chunk.html for chunk in chunks), self.html)
+    self.assertEqual(self.snippet.highlighted_html(), self.html)
+
+    # Short ones are not.
+    create_snippet(self.owner, code="print(1)\n")
+    self.assertEqual(RenderChunk.objects.count(), 6)
+
+  def test_full_document_is_streamed(self):
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.streaming)
+    self.assertEqual(b"".join(response.streaming_content).decode(), self.html)
+    self.assertEqual(response["ETag"], f'"{self.snippet.render_digest}"')
+    self.assertNotIn("Link", response)
+
+  def test_lines(self):
+    _, lines, _ = split_lines(self.html)
+    with self.assertNumQueries(2):
+      response = self.client.get(self.url, {"lines": "3-5"})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+      response.content.decode(), render_window(lines[2:5], 3, False))
+    self.assertIn('<span class="s2">two</span>', response.content.decode())
+    self.assertEqual(
+      response["ETag"], f'"{self.snippet.render_digest}-3-5"')
+    self.assertIn("rel=stylesheet", response["Link"])
+
+    response = self.client.get(
+      self.url, {"lines": "3-5"}, HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(response.status_code, 304)
+
+    response = self.client.get(self.url, {"lines": "10"})
+    self.assertEqual(
+      response.content.decode(), render_window(lines[9:], 10, False))
+    response = self.client.get(self.url, {"lines": "11-20"})
+    self.assertEqual(response.content.decode(), render_window([], 11, False))
+
+  def test_persistent_tier_reads_chunked_renders_from_their_chunks(self):
+    digest = self.snippet.render_digest
+    self.assertEqual(
+      RenderCacheEntry.objects.get(digest=digest).html, "")
+
+    render_cache.clear()
+    self.assertEqual(render_cache.get(digest), self.html)
+    render_cache.clear()
+    self.assertEqual(render_cache.get_many([digest]), {digest: self.html})
+
+    RenderChunk.objects.all().delete()
+    render_cache.clear()
+    self.assertIsNone(render_cache.get(digest))
+    self.assertEqual(render_cache.get_many([digest]), {})
+
+  def test_lines_of_a_short_render(self):
+    snippet = create_snippet(self.owner, code=CODE, linenos=True)
+    _, lines, _ = split_lines(render_html(*snippet.render_inputs()))
+    response = self.client.get(
+      f"/snippets/{snippet.pk}/highlighted/", {"lines": "2-9"})
+    self.assertEqual(
+      response.content.decode(), render_window(lines[1:], 2, True))
+    self.assertIn('<span class="linenos">2</span>', response.content.decode())
+
+  def test_invalid_lines(self):
+    for lines in ["", "0-2", "5-3", "a-b", "1-", "1-2147483648", "9" * 30]:
+      response = self.client.get(self.url, {"lines": lines})
+      self.assertEqual(response.status_code, 400, lines)
+
+  @override_settings(SNIPPETS_RENDER={"SYNC": True, "HIGHLIGHT_LINES": 5})
+  def test_code_over_the_limits_is_not_highlighted(self):
+    snippet = create_snippet(self.owner, code=LONG_CODE)
+    self.assertEqual(
+      snippet.render_digest,
+      render_digest(LONG_CODE, "text", "friendly", False, "", True))
+    html = snippet.highlighted_html()
+    self.assertNotIn('class="kn"', html)
+    self.assertIn("TEXT = &quot;&quot;&quot;one", html)
+
+    with self.settings(SNIPPETS_RENDER={"SYNC": True, "HIGHLIGHT_SIZE": 20}):
+      self.assertEqual(snippet.render_inputs()[1], "text")
+      snippet.code = "print(1)\n"
+      self.assertEqual(snippet.render_inputs()[1], "python")
+
+  def test_collect_deletes_unreferenced_chunks(self):
+    digest = self.snippet.render_digest
+    self.snippet.code = LONG_CODE + "main()\n"
+    self.snippet.save()
+
+    call_command("collect_snippet_html", stdout=StringIO())
+    self.assertTrue(RenderChunk.objects.filter(digest=digest).exists())
+
+    out = StringIO()
+    call_command("collect_snippet_html", min_age=0, stdout=out)
+    self.assertIn("the chunks of 1 render.", out.getvalue())
+    self.assertFalse(RenderChunk.objects.filter(digest=digest).exists())
+    self.assertTrue(
+      RenderChunk.objects.filter(digest=self.snippet.render_digest).exists())
+
+
+# Long enough that a one-line change is stored as a delta.
+MODULE_CODE = "".join(
+  f"def function_{n}(value):\n    return value * {n}\n\n" for n in range(40))
+
+
+@override_settings(SNIPPETS_REVISIONS={"CHECKPOINT_INTERVAL": 4})
+class RevisionTests(TestCase):
+  def setUp(self):
+    self.owner = User.objects.create_superuser("owner")
+    self.snippet = create_snippet(self.owner, code=MODULE_CODE)
+    self.versions = [MODULE_CODE]
+
+  def edit(self, number):
+    snippet = Snippet.objects.get(pk=self.snippet.pk)
+    lines = snippet.code.splitlines(keepends=True)
+    lines[number * 3 % len(lines)] = f"# Edit {number}\n"
+    snippet.code = "".join(lines)
+    snippet.save()
+    self.versions.append(snippet.code)
+
+  def test_deltas(self):
+    for old, new in [
+        ("a\nb\nc\n", "a\nB\nc\nd"),
+        ("", "x\r\ny\rz"),
+        ("one\ntwo\n", ""),
+        ("same\n", "same\n")]:
+      self.assertEqual(apply_delta(old, make_delta(old, new)), new)
+    self.assertEqual(make_delta("a\nb\nc\n", "a\nB\nc\n"), [[0, 1], "B\n", [2, 3]])
+
+  def test_every_revision_is_rebuilt(self):
+    for number in range(9):
+      self.edit(number)
+
+    revisions = SnippetRevision.objects.filter(
+      snippet=self.snippet).order_by("number")
+    self.assertEqual(
+      [(revision.number, revision.checkpoint) for revision in revisions],
+      [(1, 1), (2, 1), (3, 1), (4, 1), (5, 5), (6, 5), (7, 5), (8, 5),
+       (9, 9), (10, 9)])
+    # Deltas are a fraction of the code.
+    self.assertLess(len(revisions[1].data), len(revisions[0].data) / 4)
+
+    for number, code in enumerate(self.versions, 1):
+      with self.assertNumQueries(1):
+        self.assertEqual(revision_code(self.snippet.pk, number), code)
+    self.assertIsNone(revision_code(self.snippet.pk, 11))
+
+  def test_only_revised_fields_add_revisions(self):
+    snippet = Snippet.objects.get(pk=self.snippet.pk)
+    snippet.owner = User.objects.create_user("other")
+    snippet.save()
+    self.assertEqual(snippet.revisions.count(), 1)
+
+    snippet.title = "Renamed"
+    snippet.save()
+    revision = snippet.revisions.get(number=2)
+    self.assertEqual(revision.title, "Renamed")
+    self.assertEqual(revision.content_hash, snippet.content_hash)
+    self.assertEqual(revision_code(snippet.pk, 2), MODULE_CODE)
+
+  def test_unknown_previous_code_is_rebuilt(self):
+    self.edit(1)
+    # Neither the code nor its previous version is loaded.
+    snippet = Snippet.objects.defer("code").get(pk=self.snippet.pk)
+    snippet.style = "monokai"
+    snippet.save()
+    revision = snippet.revisions.get(number=3)
+    self.assertEqual(revision.style, "monokai")
+    self.assertEqual(revision.checkpoint, 1)
+    self.assertEqual(revision_code(snippet.pk, 3), self.versions[1])
+
+  def test_bulk_saves_add_revisions(self):
+    created, changed = save_snippets([
+      Snippet(owner=self.owner, code="x = 1\n"),
+      Snippet.objects.get(pk=self.snippet.pk),
+    ])
+    changed.code = MODULE_CODE + "# The end\n"
+    save_snippets([changed])
+
+    self.assertEqual(revision_code(created.pk, 1), "x = 1\n")
+    self.assertEqual(changed.revisions.count(), 2)
+    self.assertEqual(revision_code(changed.pk, 2), changed.code)
+    self.assertEqual(changed.revisions.get(number=2).checkpoint, 1)
+
+  def test_revisions_are_deleted_with_their_snippet(self):
+    self.snippet.delete()
+    self.assertFalse(SnippetRevision.objects.exists())
+
+  def test_endpoints(self):
+    self.edit(1)
+    self.snippet.refresh_from_db()
+    self.snippet.title = "Renamed"
+    self.snippet.save()
+    url = f"/snippets/{self.snippet.pk}/revisions/"
+
+    response = self.client.get(url, {"page_size": 2})
+    self.assertEqual(response.status_code, 200)
+    page = response.json()
+    self.assertEqual([item["number"] for item in page["results"]], [1, 2])
+    self.assertEqual(page["results"][1]["size"], len(self.versions[1]))
+    self.assertNotIn("code", page["results"][0])
+    page = self.client.get(page["next"]).json()
+    self.assertEqual(
+      [(item["number"], item["title"]) for item in page["results"]],
+      [(3, "Renamed")])
+
+    response = self.client.get(f"{url}2/")
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()["code"], self.versions[1])
+    self.assertEqual(response.json()["title"], "")
+
+    self.assertEqual(self.client.get(f"{url}4/").status_code, 404)
+    self.assertEqual(
+      self.client.get("/snippets/999/revisions/").status_code, 404)
 
-# Create your tests here.
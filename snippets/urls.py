@@ -4,15 +4,31 @@ from snippets import views
 
 urlpatterns = [
   # For function-based views.
-  path('snippets/', views.snippet_list),
-  path('snippets/<int:pk>/', views.snippet_detail),
+  # path('snippets/', views.snippet_list),
+  # path('snippets/<int:pk>/', views.snippet_detail),
 
   # For class-based views.
   path('snippets/', views.SnippetList.as_view()),
+  path('snippets/search/', views.SnippetSearch.as_view()),
+  path('snippets/bulk/', views.SnippetBulk.as_view()),
   path('snippets/<int:pk>/', views.SnippetDetail.as_view()),
+  path('snippets/<int:pk>/revisions/', views.SnippetRevisionList.as_view()),
+  path('snippets/<int:pk>/revisions/<int:number>/',
+       views.SnippetRevisionDetail.as_view()),
 
   path('users/', views.UserList.as_view()),
-  path('users/<int:pk>/', views.UserDetail.as_view())
+  path('users/<int:pk>/', views.UserDetail.as_view()),
+
+  path('render-cache/', views.RenderCacheStats.as_view())
 ]
 
-urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
+urlpatterns = format_suffix_patterns(urlpatterns)
+
+urlpatterns += [
+  # Stylesheets for snippets stored as HTML fragments, and
+  # the highlighted HTML of each snippet.
+  path('snippets/styles/<str:style>.css', views.snippet_style,
+       name='snippet-style'),
+  path('snippets/<int:pk>/highlighted/', views.snippet_highlighted,
+       name='snippet-highlighted'),
+]
\ No newline at end of file
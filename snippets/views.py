@@ -1,17 +1,47 @@
-from django.http import HttpResponse, JsonResponse, Http404
+import hashlib
+import itertools
+import re
+
+from django.db.models import Case, Exists, OuterRef, TextField, Value, When
+from django.http import (
+  FileResponse, HttpResponse, JsonResponse, Http404, StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.parsers import JSONParser
-from snippets.models import Snippet
-from snippets.serializers import SnippetSerializer
+from snippets.models import HEAVY_FIELDS, RenderChunk, Snippet, SnippetRevision
+from snippets.serializers import (
+  SnippetRevisionDetailSerializer, SnippetRevisionSerializer,
+  SnippetRowSerializer, SnippetSearchResultSerializer, SnippetSerializer,
+  SnippetSummarySerializer)
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.views import APIView
 from rest_framework import permissions
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import _positive_int
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.response import Response
 from rest_framework import mixins
 from rest_framework import generics
 from django.contrib.auth.models import User
 from snippets.serializers import UserSerializer
+from snippets.pagination import (
+  KeysetPagination, RevisionKeysetPagination, UserKeysetPagination)
+from snippets.revisions import revision_code
+from snippets.render_cache import render_cache
+from snippets.search import match_expression, search_snippets
+from storefront.query_budget import query_budget
+from snippets.choices import STYLE_CHOICES
+from snippets.chunks import iter_chunks, read_lines
+from snippets.highlighting import render_window, split_lines, style_css
+from snippets.html_store import get_file_store
 
 # The root of our API is going to be a view that
 # supports listing all the existing snippets, or
@@ -173,6 +203,57 @@ class SnippetList(generics.ListCreateAPIView):
   queryset = Snippet.objects.all()
   serializer_class = SnippetSerializer
 
+  # Pages by (created, id) instead of by page number, so
+  # that deep pages cost no more than the first one.
+  pagination_class = KeysetPagination
+
+  # The most SQL queries one request may run (see
+  # storefront/query_budget.py). A GET loads the session and
+  # user, and the page and, if asked for, its count. A POST
+  # also looks the render up in the render cache and stores
+  # it there (evicting old entries at times), and inserts
+  # the snippet, its search entry and its first revision,
+  # in two transactions.
+  query_budget = {'GET': 4, 'POST': 14}
+
+  # Listings leave out the code and HTML of each snippet,
+  # which the detail view has; ?expand=code,highlighted
+  # includes them.
+  def get_expand(self):
+    expand = [
+      name for name in self.request.query_params.get('expand', '').split(',')
+      if name]
+    for name in expand:
+      if name not in HEAVY_FIELDS:
+        raise ValidationError({'expand': f'Cannot expand "{name}".'})
+    return expand
+
+  def get_queryset(self):
+    if self.request.method != 'GET':
+      return super().get_queryset()
+    return super().get_queryset().summaries(expand=self.get_expand())
+
+  def get_serializer(self, *args, **kwargs):
+    # The created snippet is returned in full.
+    if self.request.method != 'GET':
+      return super().get_serializer(*args, **kwargs)
+    kwargs.setdefault('context', self.get_serializer_context())
+    return SnippetSummarySerializer(*args, expand=self.get_expand(), **kwargs)
+
+  def list(self, request, *args, **kwargs):
+    # Reads the page as .values() rows, which
+    # SnippetRowSerializer turns into the same data as
+    # get_serializer() would from instances, in a fraction
+    # of the time.
+    serializer = SnippetRowSerializer(expand=self.get_expand())
+    ordering = [
+      name for name in self.paginator.ordering
+      if name not in serializer.value_fields]
+    queryset = self.filter_queryset(self.get_queryset()).values(
+      *serializer.value_fields, *ordering)
+    page = self.paginate_queryset(queryset)
+    return self.get_paginated_response(serializer.to_representation(page))
+
   # By overriding a .perform_create() method on the snippet
   # views, that allows us to modify how the instance save
   # is managed, and handle any information that is implicit
@@ -181,16 +262,364 @@ class SnippetList(generics.ListCreateAPIView):
     serializer.save(owner=self.request.user)
 
 
+# Full-text search over the snippets' titles and code:
+# ?q= words that must all appear, ?language= to only
+# search snippets in one language. Results come best
+# first, ?page_size= at a time, each with an excerpt of
+# where it matched.
+class SnippetSearch(APIView):
+  # Read-only, like the snippets list is to anyone.
+  permission_classes = [permissions.AllowAny]
+  max_page_size = 100
+  # Larger offsets would not fit the database's integers.
+  max_offset = 2 ** 31 - 1
+  query_budget = 3
+
+  def get(self, request, format=None):
+    query = request.query_params.get('q', '')
+    if not match_expression(query):
+      raise ValidationError({'q': 'Enter the words to search for.'})
+    language = request.query_params.get('language') or None
+    page_size = self.get_int('page_size', api_settings.PAGE_SIZE,
+                             cutoff=self.max_page_size)
+    offset = self.get_int('offset', 0)
+    if offset > self.max_offset:
+      raise ValidationError(
+        {'offset': f'Ensure this value is at most {self.max_offset}.'})
+
+    # One more than a page, to tell whether there is a next.
+    snippets = search_snippets(
+      query, language=language, limit=page_size + 1, offset=offset)
+    url = request.build_absolute_uri()
+    next_url = previous_url = None
+    if len(snippets) > page_size:
+      next_url = replace_query_param(url, 'offset', offset + page_size)
+    if offset:
+      previous = offset - page_size
+      previous_url = replace_query_param(url, 'offset', previous) \
+        if previous > 0 else remove_query_param(url, 'offset')
+
+    serializer = SnippetSearchResultSerializer(snippets[:page_size], many=True)
+    return Response({
+      'next': next_url,
+      'previous': previous_url,
+      'results': serializer.data,
+    })
+
+  def get_int(self, name, default, cutoff=None):
+    try:
+      return _positive_int(
+        self.request.query_params[name], strict=name == 'page_size',
+        cutoff=cutoff)
+    except (KeyError, ValueError):
+      return default
+
+
+# Creates (POST) or updates (PUT) up to max_items snippets
+# from a JSON list, e.g. to import a repository. Updates
+# name each snippet by its "id". Nothing is saved unless
+# every item is valid; otherwise the response lists the
+# errors of each item, {} for the valid ones.
+#
+# It has no query budget, as its queries grow with the
+# number of items (in batches, see snippets/bulk.py).
+class SnippetBulk(APIView):
+  # For the default permissions, which require the add or
+  # change permission on snippets, as SnippetList does.
+  queryset = Snippet.objects.all()
+  max_items = 10000
+
+  def post(self, request, format=None):
+    serializer = SnippetSerializer(
+      data=request.data, many=True, max_length=self.max_items)
+    serializer.is_valid(raise_exception=True)
+    snippets = serializer.save(owner=request.user)
+    return self.saved(snippets, status.HTTP_201_CREATED)
+
+  def put(self, request, format=None):
+    ids = [
+      item.get('id') for item in request.data
+      if isinstance(item, dict) and isinstance(item.get('id'), int)
+    ] if isinstance(request.data, list) else []
+    serializer = SnippetSerializer(
+      Snippet.objects.in_bulk(ids), data=request.data, many=True,
+      max_length=self.max_items)
+    serializer.is_valid(raise_exception=True)
+    snippets = serializer.save()
+    return self.saved(snippets, status.HTTP_200_OK)
+
+  def saved(self, snippets, status_code):
+    # Without the code that was just sent.
+    serializer = SnippetSummarySerializer(snippets, many=True)
+    return Response(serializer.data, status=status_code)
+
+
+def _snippet_version(request, pk):
+  """
+  Return snippet `pk` with only the fields its ETag and
+  Last-Modified are made from, and its style and linenos,
+  or None if there is no such snippet. Loaded once per
+  request."""
+  if not hasattr(request, '_snippet_version'):
+    request._snippet_version = Snippet.objects.only(
+      'content_hash', 'render_state', 'render_digest', 'modified', 'style',
+      'linenos',
+    ).filter(pk=pk).first()
+  return request._snippet_version
+
+
+# The browsable API shows the user and forms for them, so
+# only the other formats are cached by version.
+def _detail_etag(request, pk, format=None):
+  snippet = _snippet_version(request, pk)
+  renderer_format = request.accepted_renderer.format
+  if snippet is None or renderer_format == 'api':
+    return None
+  return snippet.etag(renderer_format)
+
+
+def _detail_last_modified(request, pk, format=None):
+  snippet = _snippet_version(request, pk)
+  if snippet is None or request.accepted_renderer.format == 'api':
+    return None
+  return snippet.modified
+
+
 class SnippetDetail(generics.RetrieveUpdateDestroyAPIView):
   queryset = Snippet.objects.all()
   serializer_class = SnippetSerializer
 
+  # A GET loads the session and user, the snippet's
+  # version, and, unless the client has it already, the
+  # snippet. An update also renders through the render
+  # cache, as a POST to SnippetList does, and replaces the
+  # snippet's search entry and adds its revision; a DELETE
+  # deletes the snippet, its revisions and its search entry.
+  query_budget = {'GET': 4, 'PUT': 15, 'PATCH': 15, 'DELETE': 7}
+
+  # A GET with a matching If-None-Match or If-Modified-Since
+  # gets a 304 before the snippet is loaded and serialized.
+  @method_decorator(vary_on_headers('Accept'))
+  @method_decorator(condition(
+    etag_func=_detail_etag, last_modified_func=_detail_last_modified))
+  def get(self, request, *args, **kwargs):
+    return super().get(request, *args, **kwargs)
+
+
+# The revisions of a snippet, oldest first (see
+# snippets/revisions.py), without their code; each one's
+# code is at /snippets/<pk>/revisions/<number>/.
+class SnippetRevisionList(generics.ListAPIView):
+  serializer_class = SnippetRevisionSerializer
+  pagination_class = RevisionKeysetPagination
+
+  # Loading the session and user, the snippet, and the page
+  # and, if asked for, its count.
+  query_budget = 5
+
+  def get_queryset(self):
+    return SnippetRevision.objects.filter(
+      snippet_id=self.kwargs['pk']).defer('data')
+
+  def list(self, request, *args, **kwargs):
+    if not Snippet.objects.filter(pk=kwargs['pk']).exists():
+      raise Http404('No such snippet.')
+    return super().list(request, *args, **kwargs)
+
+
+# One revision of a snippet, with its code as it was then,
+# rebuilt from the checkpoint before it.
+class SnippetRevisionDetail(generics.RetrieveAPIView):
+  serializer_class = SnippetRevisionDetailSerializer
+
+  # Loading the session and user, the revision, and the
+  # data its code is rebuilt from.
+  query_budget = 4
+
+  def get_queryset(self):
+    return SnippetRevision.objects.filter(snippet_id=self.kwargs['pk'])
+
+  def get_object(self):
+    revision = get_object_or_404(
+      self.get_queryset().defer('data'), number=self.kwargs['number'])
+    revision.code = revision_code(revision.snippet_id, revision.number)
+    return revision
+
 
 class UserList(generics.ListAPIView):
-  queryset = User.objects.all()
+  # UserSerializer lists each user's snippets; fetch them
+  # for the whole page in one query instead of one per user.
+  queryset = User.objects.prefetch_related('snippets')
   serializer_class = UserSerializer
+  pagination_class = UserKeysetPagination
+  query_budget = 5
 
 
 class UserDetail(generics.RetrieveAPIView):
-  queryset = User.objects.all()
-  serializer_class = UserSerializer
\ No newline at end of file
+  queryset = User.objects.prefetch_related('snippets')
+  serializer_class = UserSerializer
+  query_budget = 4
+
+
+# Exposes the render cache's hit and miss counts for
+# this process, so that the cache can be sized.
+class RenderCacheStats(APIView):
+  permission_classes = [permissions.IsAdminUser]
+
+  def get(self, request, format=None):
+    return Response(render_cache.stats())
+
+
+def _style_etag(request, style):
+  if style not in dict(STYLE_CHOICES):
+    return None
+  return hashlib.sha256(style_css(style).encode()).hexdigest()[:32]
+
+
+_LINES_PATTERN = re.compile(r'([1-9][0-9]*)(?:-([1-9][0-9]*))?')
+
+# The largest line number ?lines= accepts; larger ones would
+# not fit the database's integers.
+MAX_LINE = 2 ** 31 - 1
+
+
+def _requested_lines(request):
+  """
+  The (first, last) lines asked for with ?lines=first-last
+  or ?lines=line, None if none were, or False if they are
+  not valid."""
+  lines = request.GET.get('lines')
+  if lines is None:
+    return None
+  match = _LINES_PATTERN.fullmatch(lines)
+  if match is None:
+    return False
+  first = int(match[1])
+  last = int(match[2] or first)
+  return (first, last) if first <= last <= MAX_LINE else False
+
+
+def _highlighted_etag(request, pk):
+  snippet = _snippet_version(request, pk)
+  if snippet is None or snippet.render_state != Snippet.READY:
+    return None
+  lines = _requested_lines(request)
+  if lines is False:
+    return None
+  # The HTML is rendered from exactly what this hashes.
+  if lines is None:
+    return f'"{snippet.render_digest}"'
+  return f'"{snippet.render_digest}-{lines[0]}-{lines[1]}"'
+
+
+def _highlighted_last_modified(request, pk):
+  snippet = _snippet_version(request, pk)
+  if snippet is None or snippet.render_state != Snippet.READY:
+    return None
+  return snippet.modified
+
+
+# The highlighted HTML of a snippet on its own, to embed or
+# link to. Caches may keep it for a minute, and revalidate
+# it by ETag after that, so that edits show up soon; a 304
+# leaves the cached response's Cache-Control as it was.
+# HTML kept in the file store (snippets/html_store.py) is
+# streamed from its file, which servers that support it
+# send with sendfile() through wsgi.file_wrapper, and HTML
+# kept in chunks (snippets/chunks.py) a few chunks at a
+# time. With ?lines=10-20, only those lines are returned,
+# as a fragment.
+# http://127.0.0.1:8000/snippets/1/highlighted/
+@query_budget(3)
+@condition(etag_func=_highlighted_etag,
+           last_modified_func=_highlighted_last_modified)
+def snippet_highlighted(request, pk):
+  snippet = _snippet_version(request, pk)
+  if snippet is None:
+    raise Http404('No such snippet.')
+
+  lines = _requested_lines(request)
+  if lines is False:
+    return HttpResponse(
+      'lines must be a line number or a range such as 10-20.',
+      content_type='text/plain', status=400)
+
+  digest = snippet.render_digest
+  window = None
+  if snippet.render_state == Snippet.READY and lines is not None:
+    window = read_lines(digest, *lines)
+
+  highlighted = chunked = None
+  if snippet.render_state == Snippet.READY and not window:
+    # Filtered on the digest, in case the snippet has been
+    # saved since its version was read. The HTML of chunked
+    # renders is not in the row; never load it for them.
+    row = Snippet.objects.filter(pk=pk, render_digest=digest).annotate(
+      chunked=Exists(RenderChunk.objects.filter(digest=OuterRef('render_digest'))),
+    ).values_list(
+      'chunked',
+      Case(When(chunked=True, then=Value('')), default='highlighted',
+           output_field=TextField()),
+    ).first()
+    if row is not None:
+      chunked, highlighted = row
+
+  html_file = None
+  if highlighted == '' and lines is None:
+    try:
+      html_file = get_file_store().open(digest)
+    except FileNotFoundError:
+      if not chunked:
+        highlighted = None
+  elif highlighted == '' and not chunked:
+    highlighted = get_file_store().read(digest)
+
+  if highlighted is None and not window:
+    response = HttpResponse(
+      'This snippet has not been highlighted yet.',
+      content_type='text/plain', status=503)
+    if snippet.render_state == Snippet.PENDING:
+      response['Retry-After'] = '5'
+    add_never_cache_headers(response)
+    return response
+
+  if lines is not None:
+    if not window and not chunked:
+      _, all_lines, _ = split_lines(highlighted)
+      window = all_lines[lines[0] - 1:lines[1]]
+    # Past the end of a chunked render, there are none.
+    is_document = False
+    response = HttpResponse(render_window(window, lines[0], snippet.linenos))
+  elif html_file is not None:
+    start = html_file.read(len('<!DOCTYPE'))
+    html_file.seek(0)
+    is_document = start == b'<!DOCTYPE'
+    response = FileResponse(html_file, content_type='text/html; charset=utf-8')
+  elif chunked:
+    chunks = iter_chunks(digest)
+    head = next(chunks, '')
+    is_document = head.startswith('<!DOCTYPE')
+    response = StreamingHttpResponse(
+      itertools.chain([head], chunks), content_type='text/html; charset=utf-8')
+  else:
+    is_document = highlighted.startswith('<!DOCTYPE')
+    response = HttpResponse(highlighted)
+  patch_cache_control(response, public=True, max_age=60)
+  if not is_document:
+    # A fragment, to be shown with its style's stylesheet.
+    stylesheet = reverse('snippet-style', args=[snippet.style])
+    response['Link'] = f'<{stylesheet}>; rel=stylesheet'
+  return response
+
+
+# The stylesheet of a Pygments style, for snippets stored as
+# HTML fragments (SNIPPETS_RENDER["FULL_DOCUMENT"] = False).
+# It only changes when Pygments is upgraded, so browsers and
+# proxies may keep it for a day and revalidate it by ETag.
+# http://127.0.0.1:8000/snippets/styles/monokai.css
+@cache_control(public=True, max_age=86400)
+@condition(etag_func=_style_etag)
+def snippet_style(request, style):
+  if style not in dict(STYLE_CHOICES):
+    raise Http404('No such style.')
+  return HttpResponse(style_css(style), content_type='text/css')
@@ -0,0 +1,268 @@
+"""
+Query budgets: an upper bound on the number of SQL queries
+a view may run to serve one request.
+
+A view declares its budget with the @query_budget decorator
+or, for class-based views and viewsets, a `query_budget`
+class attribute:
+
+	@query_budget(2)
+	def vote(request, question_id): ...
+
+	class IndexView(generic.ListView):
+		query_budget = 2
+
+A number applies to requests of every HTTP method. Views
+whose methods cost different amounts declare a budget per
+method instead; methods left out have none, and HEAD has
+the budget of GET:
+
+	class SnippetList(generics.ListCreateAPIView):
+		query_budget = {"GET": 4, "POST": 14}
+
+QueryBudgetMiddleware counts the queries run while each
+request is handled, and how long they took, and logs the
+numbers. When a view goes over its budget the middleware
+logs a warning, or raises QueryBudgetExceeded if the
+QUERY_BUDGET_ACTION setting is "raise".
+
+assert_query_budgets() requests every URL of a URLconf
+whose view has a budget, and fails the test if any of them
+goes over it.
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils.regex_helper import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+	pass
+
+
+def query_budget(max_queries):
+	"""
+	Declare that a view runs at most `max_queries` queries,
+	a number or {HTTP method: number}. Works on function
+	views and on view classes."""
+	def decorator(view):
+		view.query_budget = max_queries
+		return view
+	return decorator
+
+
+def get_query_budget(view, method="GET"):
+	"""
+	Return the budget declared by a view, as returned by
+	as_view() for class-based views, for requests of HTTP
+	`method`, or None."""
+	# Django's as_view() sets view_class, and REST
+	# framework's sets cls, for viewsets as well.
+	for candidate in (
+			view, getattr(view, "view_class", None), getattr(view, "cls", None)):
+		budget = getattr(candidate, "query_budget", None)
+		if isinstance(budget, dict):
+			if method == "HEAD" and method not in budget:
+				method = "GET"
+			return budget.get(method)
+		if budget is not None:
+			return budget
+	return None
+
+
+class QueryCount:
+	"""The queries run while handling one request."""
+
+	def __init__(self):
+		self.count = 0
+		self.duration = 0.0
+
+
+# The QueryCount of the request being handled. A context
+# variable rather than a thread local, so that queries run
+# by async views through sync_to_async() are counted too.
+_current_count = ContextVar("query_budget_count", default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+	query_count = _current_count.get()
+	if query_count is None:
+		return execute(sql, params, many, context)
+
+	started = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		query_count.count += 1
+		query_count.duration += time.perf_counter() - started
+
+
+def _install(connection):
+	if _count_query not in connection.execute_wrappers:
+		connection.execute_wrappers.append(_count_query)
+
+
+def _connection_created(sender, connection, **kwargs):
+	_install(connection)
+
+
+class QueryBudgetMiddleware:
+	"""
+	Count the queries each request runs and check them
+	against the view's budget.
+
+	Only queries made inside this middleware are counted, so
+	it should come last in MIDDLEWARE. The content of a
+	streaming response is produced after the middleware has
+	returned and is not counted.
+	"""
+	sync_capable = True
+	async_capable = True
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+		if iscoroutinefunction(self.get_response):
+			markcoroutinefunction(self)
+
+		# Connections are given the counting wrapper as they
+		# are opened; the ones already open get it now.
+		connection_created.connect(
+			_connection_created, dispatch_uid="query_budget")
+		for connection in connections.all(initialized_only=True):
+			_install(connection)
+
+	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall__(request)
+
+		query_count = QueryCount()
+		token = _current_count.set(query_count)
+		try:
+			response = self.get_response(request)
+		finally:
+			_current_count.reset(token)
+		self.check(request, query_count)
+		return response
+
+	async def __acall__(self, request):
+		query_count = QueryCount()
+		token = _current_count.set(query_count)
+		try:
+			response = await self.get_response(request)
+		finally:
+			_current_count.reset(token)
+		self.check(request, query_count)
+		return response
+
+	def check(self, request, query_count):
+		match = getattr(request, "resolver_match", None)
+		budget = get_query_budget(match.func, request.method) if match else None
+
+		# Kept on the request for assert_query_budgets().
+		request.query_count = query_count.count
+		request.query_budget = budget
+
+		logger.debug(
+			"%s %s: %d queries in %.1f ms (budget: %s)",
+			request.method, request.path, query_count.count,
+			query_count.duration * 1000, budget)
+
+		if budget is None or query_count.count <= budget:
+			return
+
+		message = "%s %s ran %d queries, over its budget of %d" % (
+			request.method, request.path, query_count.count, budget)
+		# By then the view has run, and any writes it made are
+		# committed; raising only turns its response into a 500.
+		if getattr(settings, "QUERY_BUDGET_ACTION", "log") == "raise":
+			raise QueryBudgetExceeded(message)
+		logger.warning(message)
+
+
+def _patterns(resolvers, prefix=()):
+	"""
+	Yield the (regexes, view) of every URL pattern under
+	`resolvers`, where `regexes` are the patterns of the
+	pattern and of the resolvers it is included from."""
+	for entry in resolvers:
+		regexes = (*prefix, entry.pattern.regex.pattern)
+		if isinstance(entry, URLResolver):
+			yield from _patterns(entry.url_patterns, regexes)
+		elif isinstance(entry, URLPattern):
+			yield regexes, entry.callback
+
+
+def _build_url(regexes, kwargs):
+	"""
+	Fill in the URL made of `regexes` from `kwargs`, or
+	return None if it needs an argument `kwargs` lacks.
+	"""
+	url = ""
+	for regex in regexes:
+		for template, params in normalize(regex):
+			if set(params) <= set(kwargs):
+				url += template % {param: kwargs[param] for param in params}
+				break
+		else:
+			return None
+	return "/" + url
+
+
+def budgeted_urls(kwargs, view_kwargs=None, urlconf=None):
+	"""
+	Return {url: view} for every URL in `urlconf` whose view
+	declares a query budget.
+
+	URL arguments are taken from `view_kwargs[view class or
+	function]`, falling back to `kwargs`, so that views
+	taking a `pk` of different models can be told apart.
+	Variants that need other arguments, such as a format
+	suffix, are left out.
+	"""
+	view_kwargs = view_kwargs or {}
+	urls = {}
+	for regexes, view in _patterns(get_resolver(urlconf).url_patterns):
+		if get_query_budget(view) is None:
+			continue
+
+		owner = getattr(view, "view_class", None) or getattr(view, "cls", view)
+		url = _build_url(regexes, {**kwargs, **view_kwargs.get(owner, {})})
+		if url is not None:
+			urls.setdefault(url, view)
+	return urls
+
+
+def assert_query_budgets(test_case, kwargs, view_kwargs=None, urlconf=None):
+	"""
+	GET every budgeted URL in `urlconf` (the ROOT_URLCONF by
+	default) with `test_case.client`, and fail if a request
+	runs more queries than the view that served it allows.
+	QueryBudgetMiddleware must be installed.
+
+	The URLs are requested as the client is logged in; see
+	budgeted_urls() for `kwargs` and `view_kwargs`.
+	"""
+	from django.test import override_settings
+
+	urls = budgeted_urls(kwargs, view_kwargs, urlconf)
+	test_case.assertTrue(urls, "No URL declares a query budget.")
+
+	for url in urls:
+		with test_case.subTest(url=url), \
+				override_settings(QUERY_BUDGET_ACTION="log"):
+			request = test_case.client.get(url).wsgi_request
+			test_case.assertIsNotNone(
+				getattr(request, "query_budget", None),
+				f"{url} was not checked by QueryBudgetMiddleware.")
+			test_case.assertLessEqual(
+				request.query_count, request.query_budget,
+				f"{url} ran {request.query_count} queries, "
+				f"over its budget of {request.query_budget}.")
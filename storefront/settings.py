@@ -61,6 +61,131 @@ REST_FRAMEWORK = {
 	'PAGE_SIZE': 10
 }
 
+# Buffered ("write-behind") voting for polls.views.vote.
+# When enabled, votes are accumulated in memory and written
+# with one UPDATE per choice every FLUSH_INTERVAL seconds,
+# or as soon as FLUSH_THRESHOLD votes are pending. Votes
+# still pending when a process is killed are lost. Set
+# "ENABLED" to False to write every vote synchronously.
+POLLS_VOTE_BUFFER = {
+	'ENABLED': False,
+	'FLUSH_INTERVAL': 1.0,
+	'FLUSH_THRESHOLD': 100,
+}
+
+# Number of VoteShard rows each Choice's votes are spread
+# over. 0 adds every vote to Choice.votes directly. Run
+# "python manage.py compact_vote_shards" to fold the shards
+# back into Choice.votes.
+POLLS_VOTE_SHARDS = 0
+
+# Upper bound, in seconds, on how long the polls index
+# page's question list stays cached. The entry expires
+# earlier when a scheduled question is due to be published,
+# and is deleted whenever a Question is saved or deleted.
+POLLS_INDEX_CACHE_TIMEOUT = 300
+
+# How long, in seconds, a question's cached results page
+# data is kept. Committed votes delete the entry.
+POLLS_RESULTS_CACHE_TIMEOUT = 300
+
+# Bounded-staleness mode for very hot polls: when set to a
+# number of seconds, votes no longer invalidate the cached
+# results, which are instead re-read at most that often.
+# 0 turns the mode off.
+POLLS_RESULTS_MAX_STALENESS = 0
+
+# Live results stream (/polls/<id>/results/stream/).
+# Votes are pushed to watchers at most once per
+# COALESCE_INTERVAL seconds per question; an idle stream
+# sends a keepalive comment every KEEPALIVE seconds and is
+# closed, for the browser to reopen, after MAX_DURATION.
+POLLS_SSE_COALESCE_INTERVAL = 0.25
+POLLS_SSE_KEEPALIVE = 15
+POLLS_SSE_MAX_DURATION = 300
+
+# The largest number of entries accepted by one request to
+# the bulk vote API (/polls/api/votes/).
+POLLS_BULK_VOTE_MAX_ENTRIES = 10000
+
+# Only accept one vote per voter (user, or session for
+# anonymous visitors) and question. Voters are checked
+# against an in-memory Bloom filter per question, sized for
+# DEDUPE_CAPACITY voters at DEDUPE_ERROR_RATE false
+# positives; see polls/dedupe.py for the memory cost.
+POLLS_ONE_VOTE_PER_VOTER = False
+POLLS_DEDUPE_CAPACITY = 10000
+POLLS_DEDUPE_ERROR_RATE = 0.01
+
+# Highlighting of snippets. Snippet.save() stores the code
+# with render_state "pending" and a pool of WORKERS
+# processes renders it in the background. Set "SYNC" to
+# True to render inline during save() instead.
+# With FULL_DOCUMENT, each snippet is stored as a complete
+# HTML document including its style's CSS. Set it to False
+# to only store the highlighted code and serve the CSS once
+# per style from /snippets/styles/<style>.css; run
+# "python manage.py rewrite_snippet_html" after changing it.
+# With STORAGE "files", the HTML is kept in files named by
+# its hash under FILE_ROOT instead of in the database; run
+# "python manage.py move_snippet_html --to files" after
+# changing it (see snippets/html_store.py).
+# Renders of more than CHUNK_LINES lines are stored in
+# chunks of that many lines (see snippets/chunks.py).
+# Code of more than HIGHLIGHT_LINES lines or HIGHLIGHT_SIZE
+# characters is not highlighted, only escaped, as Pygments
+# takes seconds over it.
+SNIPPETS_RENDER = {
+	'SYNC': False,
+	'WORKERS': 2,
+	'FULL_DOCUMENT': True,
+	'STORAGE': 'database',
+	'FILE_ROOT': BASE_DIR / 'snippet_html',
+	'CHUNK_LINES': 1000,
+	'HIGHLIGHT_LINES': 20000,
+	'HIGHLIGHT_SIZE': 1024 * 1024,
+}
+
+# Cache of highlighted snippet HTML, keyed by a hash of the
+# code and render options. The in-process tier holds up to
+# MEMORY_ENTRIES renders and MEMORY_SIZE characters; the
+# persistent tier (a database table) up to
+# PERSISTENT_ENTRIES renders. EVICTION is "lru" or "fifo".
+SNIPPETS_RENDER_CACHE = {
+	'MEMORY_ENTRIES': 256,
+	'MEMORY_SIZE': 16 * 1024 * 1024,
+	'PERSISTENT': True,
+	'PERSISTENT_ENTRIES': 10000,
+	'EVICTION': 'lru',
+}
+
+# Guessing the language of snippets sent with language
+# "auto": the CANDIDATES are tried in order, most common
+# first, on the first SAMPLE_SIZE characters of the code,
+# until TIME_BUDGET seconds have gone. Up to MEMO_ENTRIES
+# guesses are remembered by the hash of the code. See
+# snippets/detection.py.
+SNIPPETS_LANGUAGE_DETECTION = {
+	'CANDIDATES': [
+		'python', 'javascript', 'typescript', 'java', 'c', 'cpp', 'csharp',
+		'go', 'rust', 'php', 'ruby', 'bash', 'sql', 'html', 'xml', 'css',
+		'yaml', 'json', 'markdown', 'toml', 'ini',
+	],
+	'TIME_BUDGET': 0.1,
+	'SAMPLE_SIZE': 2048,
+	'MEMO_ENTRIES': 1024,
+}
+
+# Revision history of snippets: each revision's code is a
+# compressed delta against the one before it, except every
+# CHECKPOINT_INTERVAL-th, which holds the whole code, so
+# that rebuilding a revision applies fewer deltas than
+# that. See snippets/revisions.py.
+SNIPPETS_REVISIONS = {
+	'CHECKPOINT_INTERVAL': 50,
+	'COMPRESSION_LEVEL': 6,
+}
+
 MIDDLEWARE = [
 	'debug_toolbar.middleware.DebugToolbarMiddleware',
 	'django.middleware.security.SecurityMiddleware',
@@ -70,9 +195,20 @@ MIDDLEWARE = [
 	'django.contrib.auth.middleware.AuthenticationMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
-	'django.middleware.common.BrokenLinkEmailsMiddleware'
+	'django.middleware.common.BrokenLinkEmailsMiddleware',
+
+	# Counts each request's SQL queries against its view's
+	# budget; kept last so that only the view is measured.
+	'storefront.query_budget.QueryBudgetMiddleware'
 ]
 
+# What QueryBudgetMiddleware does when a view runs more
+# queries than its query_budget: "log" a warning, or
+# "raise" QueryBudgetExceeded. Raising happens after the
+# view has run and committed its writes, so it is for tests
+# that want a budget to fail loudly, not for serving.
+QUERY_BUDGET_ACTION = 'log'
+
 INTERNAL_IPS = [
   "127.0.0.1",
 ]
@@ -0,0 +1,149 @@
+import datetime
+
+from django.contrib.auth.models import Group, User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from polls.models import Choice, Question
+from quickstart.views import UserViewSet
+from snippets.models import Snippet
+from snippets.views import (
+	SnippetDetail, SnippetRevisionDetail, SnippetRevisionList, UserDetail,
+	snippet_highlighted)
+from storefront.query_budget import (
+	QueryBudgetExceeded, QueryBudgetMiddleware, assert_query_budgets,
+	budgeted_urls, get_query_budget, query_budget)
+
+
+@query_budget(1)
+def one_query(request):
+	list(User.objects.all())
+	return HttpResponse()
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+	def get(self, view, **kwargs):
+		request = RequestFactory().get("/")
+		request.resolver_match = type("Match", (), {"func": view})
+
+		def get_response(request):
+			return view(request)
+
+		middleware = QueryBudgetMiddleware(get_response)
+		middleware(request)
+		return request
+
+	def test_counts_queries(self):
+		request = self.get(one_query)
+		self.assertEqual(request.query_count, 1)
+		self.assertEqual(request.query_budget, 1)
+
+	def test_unbudgeted_view(self):
+		def view(request):
+			list(User.objects.all())
+			list(Group.objects.all())
+			return HttpResponse()
+
+		request = self.get(view)
+		self.assertEqual(request.query_count, 2)
+		self.assertIsNone(request.query_budget)
+
+	@override_settings(QUERY_BUDGET_ACTION="log")
+	def test_logs_violation(self):
+		over_budget = query_budget(0)(lambda request: one_query(request))
+
+		with self.assertLogs("storefront.query_budget", "WARNING") as logs:
+			self.get(over_budget)
+		self.assertIn("ran 1 queries, over its budget of 0", logs.output[0])
+
+	@override_settings(QUERY_BUDGET_ACTION="raise")
+	def test_raises_violation(self):
+		over_budget = query_budget(0)(lambda request: one_query(request))
+
+		with self.assertRaises(QueryBudgetExceeded):
+			self.get(over_budget)
+
+	def test_class_based_budgets(self):
+		self.assertEqual(get_query_budget(SnippetDetail.as_view()), 4)
+		self.assertEqual(
+			get_query_budget(UserViewSet.as_view({"get": "list"})), 5)
+
+	def test_budgets_by_method(self):
+		view = query_budget({"GET": 1, "POST": 3})(one_query)
+		self.assertEqual(get_query_budget(view, "POST"), 3)
+		self.assertEqual(get_query_budget(view, "HEAD"), 1)
+		self.assertIsNone(get_query_budget(view, "DELETE"))
+		self.assertEqual(get_query_budget(SnippetDetail.as_view(), "PUT"), 15)
+
+
+class QueryBudgetTests(TestCase):
+	"""Every budgeted view in storefront.urls stays within its budget."""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_superuser("admin", "admin@example.com", "x")
+		cls.user.groups.add(Group.objects.create(name="editors"))
+
+		cls.question = Question.objects.create(
+			question_text="Budget?",
+			pub_date=timezone.now() - datetime.timedelta(days=1))
+		for choice_text in ["Yes", "No", "Maybe"]:
+			Choice.objects.create(question=cls.question, choice_text=choice_text)
+
+		for index in range(3):
+			cls.snippet = Snippet.objects.create(
+				title=f"Snippet {index}", code="print(1)", owner=cls.user)
+
+	def setUp(self):
+		self.client.force_login(self.user)
+
+	def url_kwargs(self):
+		return {
+			"pk": self.question.pk,
+			"question_id": self.question.pk,
+		}, {
+			SnippetDetail: {"pk": self.snippet.pk},
+			SnippetRevisionList: {"pk": self.snippet.pk},
+			SnippetRevisionDetail: {"pk": self.snippet.pk, "number": 1},
+			snippet_highlighted: {"pk": self.snippet.pk},
+			UserDetail: {"pk": self.user.pk},
+			UserViewSet: {"pk": self.user.pk},
+		}
+
+	def test_budgeted_urls(self):
+		urls = budgeted_urls(*self.url_kwargs())
+		for url in [
+				"/polls/",
+				f"/polls/{self.question.pk}/",
+				f"/polls/{self.question.pk}/vote/",
+				"/snippets/",
+				f"/snippets/{self.snippet.pk}/",
+				f"/snippets/{self.snippet.pk}/revisions/",
+				f"/snippets/{self.snippet.pk}/revisions/1/",
+				"/users/",
+				f"/users/{self.user.pk}/"]:
+			self.assertIn(url, urls)
+		self.assertNotIn("/admin/", urls)
+
+	def test_query_budgets(self):
+		assert_query_budgets(self, *self.url_kwargs())
+
+	@override_settings(QUERY_BUDGET_ACTION="raise")
+	def test_snippet_writes_stay_within_their_budgets(self):
+		for sync in (False, True):
+			with self.subTest(sync=sync), \
+					self.settings(SNIPPETS_RENDER={"SYNC": sync}):
+				response = self.client.post(
+					"/snippets/", {"code": "print(2)"}, content_type="application/json")
+				self.assertEqual(response.status_code, 201)
+				url = f"/snippets/{response.json()['id']}/"
+
+				response = self.client.put(
+					url, {"code": "print(3)", "title": "Put"},
+					content_type="application/json")
+				self.assertEqual(response.status_code, 200)
+				response = self.client.patch(
+					url, {"code": "print(4)"}, content_type="application/json")
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(self.client.delete(url).status_code, 204)
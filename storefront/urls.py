@@ -58,5 +58,9 @@ urlpatterns = [
 	# include() chops off whatever part of the URL matched up
 	# to that point and sends the remaining string to the
 	# included URLconf for further processing.
-	path("polls/", include("polls.urls"))
+	path("polls/", include("polls.urls")),
+
+	# The snippets API. Its users/ routes come after the
+	# router's, which take precedence.
+	path('', include('snippets.urls'))
 ] + debug_toolbar_urls()
\ No newline at end of file